@@ -1,8 +1,11 @@
 import tqdm
 import torch
 
+from model_explorer.utils.sequential_testing import SequentialAccuracyTest
 
-def compute_classification_accuracy(base_model, dataloader_generator, progress=True, title="") -> float:
+
+def compute_classification_accuracy(base_model, dataloader_generator, progress=True, title="",
+                                    early_termination: SequentialAccuracyTest = None) -> float:
     """Calculates the classification accuracy of the provided base classification model on the provided dataloader.
     The accuracy is calculated as the number of correct predictions by the number of samples.
 
@@ -10,6 +13,9 @@ def compute_classification_accuracy(base_model, dataloader_generator, progress=T
         base_model (nn.Model): The base classification model to be evaluated.
         dataloader (data.Dataloader):  The dataloader with the evaluation data
         progress (bool, optional): Wether to show a progress bar. Defaults to True.
+        early_termination (SequentialAccuracyTest, optional): Stops as soon as
+            the test is decided, the accuracy is then computed on the samples
+            used so far. Defaults to None.
 
     Returns:
         float: The accuracy of the provided base model on the provided dataloader.
@@ -28,6 +34,7 @@ def compute_classification_accuracy(base_model, dataloader_generator, progress=T
     model = model.to(device)
 
     correct_pred = 0
+    n_samples = 0
 
     model.eval()
     with torch.no_grad():
@@ -38,13 +45,63 @@ def compute_classification_accuracy(base_model, dataloader_generator, progress=T
             y_prob = model(X)
             _, predicted_labels = torch.max(y_prob, 1)
 
-            correct_pred += (predicted_labels == y_true).sum()
+            batch_correct = (predicted_labels == y_true).sum()
+            correct_pred += batch_correct
+            n_samples += y_true.size(0)
 
             if progress:
                 progress_bar.update(y_true.size(0))
 
+            # the test needs the result on the host, hence it only syncs if enabled
+            if early_termination is not None and early_termination.update(batch_correct.item(), y_true.size(0)):
+                break
+
     correct_pred = correct_pred.to(cpu_device)
+    if early_termination is not None:
+        return correct_pred.float() / n_samples
     return correct_pred.float() / dataset_size
 
 
+def compute_population_classification_accuracy(base_model, dataloader_generator, population_size: int,
+                                               progress=True, title="") -> list:
+    """Calculates the classification accuracy of several individuals at once,
+    the model has to be in population mode (see CustomModel.enable_population_mode).
+    Every batch is replicated once per individual along the batch axis.
+
+    Args:
+        base_model (nn.Model): The base classification model in population mode.
+        dataloader (data.Dataloader):  The dataloader with the evaluation data
+        population_size (int): number of individuals evaluated together
+        progress (bool, optional): Wether to show a progress bar. Defaults to True.
+
+    Returns:
+        list: The accuracy of every individual.
+    """
+    dev_string = "cuda" if torch.cuda.is_available() else "cpu"
+    device = torch.device(dev_string)
+
+    dataset_size = len(dataloader_generator)
+    dataloader = dataloader_generator.get_dataloader()
+
+    progress_bar = tqdm.tqdm(total=dataset_size, ascii=True, desc=title, position=0, disable=not progress)
+
+    model = base_model.to(device)
+    correct_pred = torch.zeros(population_size, device=device)
+
+    model.eval()
+    with torch.no_grad():
+        for X, y_true in dataloader:
+            X = X.to(device)
+            y_true = y_true.to(device)
+
+            y_prob = model(X.repeat(population_size, *[1] * (X.dim() - 1)))
+            predicted_labels = y_prob.argmax(1).view(population_size, -1)
+
+            correct_pred += (predicted_labels == y_true[None]).sum(dim=1)
+            progress_bar.update(y_true.size(0))
+
+    return (correct_pred.cpu() / dataset_size).tolist()
+
+
 accuracy_function = compute_classification_accuracy
+population_accuracy_function = compute_population_classification_accuracy
@@ -11,66 +11,6 @@ import logging
 # https://github.com/ultralytics/yolov5/blob/5774a1514de193c74ecc5203281da8de3c13f9af/utils/general.py#L748
 
 
-def ap_per_class(tp, conf, pred_cls, target_cls, eps=1e-16):
-    """Compute the average precision, given the recall and precision curves.
-    Source: https://github.com/rafaelpadilla/Object-Detection-Metrics.
-    # Arguments
-        tp:  True positives (nparray, nx1 or nx10).
-        conf:  Objectness value from 0-1 (nparray).
-        pred_cls:  Predicted object classes (nparray).
-        target_cls:  True object classes (nparray).
-    # Returns
-        The average precision as computed in py-faster-rcnn.
-    """
-
-    # Sort by objectness
-    i = np.argsort(-conf)
-    tp, conf, pred_cls = tp[i], conf[i], pred_cls[i]
-
-    # Find unique classes
-    unique_classes, nt = np.unique(target_cls, return_counts=True)
-    nc = unique_classes.shape[0]  # number of classes, number of detections
-
-    # Create Precision-Recall curve and compute AP for each class
-    px, _ = np.linspace(0, 1, 1000), []  # for plotting
-    ap, p, r = np.zeros((nc, tp.shape[1])), np.zeros((nc, 1000)), np.zeros(
-        (nc, 1000))
-    for ci, c in enumerate(unique_classes):
-        i = pred_cls == c
-        n_l = nt[ci]  # number of labels
-        n_p = i.sum()  # number of predictions
-        if n_p == 0 or n_l == 0:
-            continue
-
-        # Accumulate FPs and TPs
-        fpc = (1 - tp[i]).cumsum(0)
-        tpc = tp[i].cumsum(0)
-
-        # Recall
-        recall = tpc / (n_l + eps)  # recall curve
-        r[ci] = np.interp(-px, -conf[i], recall[:, 0],
-                          left=0)  # negative x, xp because xp decreases
-
-        # Precision
-        precision = tpc / (tpc + fpc)  # precision curve
-        p[ci] = np.interp(-px, -conf[i], precision[:, 0],
-                          left=1)  # p at pr_score
-
-        # AP from recall-precision curve
-        for j in range(tp.shape[1]):
-            ap[ci, j], mpre, mrec = compute_ap(recall[:, j], precision[:, j])
-
-    # Compute F1 (harmonic mean of precision and recall)
-    f1 = 2 * p * r / (p + r + eps)
-
-    i = smooth(f1.mean(0), 0.1).argmax()  # max F1 index
-    p, r, f1 = p[:, i], r[:, i], f1[:, i]
-    tp = (r * nt).round()  # true positives
-    fp = (tp / (p + eps) - tp).round()  # false positives
-
-    return tp, fp, p, r, f1, ap, unique_classes.astype(int)
-
-
 def smooth(y, f=0.05):
     # Box filter of fraction f
     nf = round(
@@ -145,39 +85,112 @@ def box_iou(box1, box2):
     return inter / (box_area(box1.T)[:, None] + box_area(box2.T) - inter)
 
 
-def process_batch(detections, labels, iouv):
+def match_predictions(detections, labels, iouv):
     """
-    Return correct predictions matrix. Both sets of boxes are in (x1, y1, x2, y2) format.
+    Return correct predictions matrix for all IoU levels at once, on the
+    device of the detections. Same matching as the per level loop of yolov5:
+    every detection is matched to the label of the same class with the
+    highest IoU, every label then keeps the matched detection with the lowest
+    index, i.e. the highest confidence after NMS.
+    Both sets of boxes are in (x1, y1, x2, y2) format.
     Arguments:
-        detections (Array[N, 6]), x1, y1, x2, y2, conf, class
-        labels (Array[M, 5]), class, x1, y1, x2, y2
+        detections (Tensor[N, 6]), x1, y1, x2, y2, conf, class
+        labels (Tensor[M, 5]), class, x1, y1, x2, y2
+        iouv (Tensor[T]), IoU levels
     Returns:
-        correct (Array[N, 10]), for 10 IoU levels
+        correct (Tensor[N, T]), for T IoU levels
     """
-    correct = torch.zeros(detections.shape[0],
-                          iouv.shape[0],
-                          dtype=torch.bool,
-                          device=iouv.device)
+    n_det, n_iou = detections.shape[0], iouv.shape[0]
+
     iou = box_iou(labels[:, 1:], detections[:, :4])
-    correct_class = labels[:, 0:1] == detections[:, 5]
+    iou = iou * (labels[:, 0:1] == detections[:, 5])
+
+    # [T, M, N] IoU of the pairs above each level
+    valid_iou = iou[None] * (iou[None] >= iouv[:, None, None])
+    best_iou, best_label = valid_iou.max(dim=1)
+    matched = best_iou > 0
 
-    for i, iouv_i in enumerate(iouv):
-        x = torch.where((iou >= iouv_i)
-                        & correct_class)  # IoU > threshold and classes match
+    # per label the first of the detections matched to it
+    detection_idx = torch.arange(n_det, device=iou.device).expand(n_iou, n_det)
+    first = torch.full((n_iou, labels.shape[0]), n_det, dtype=torch.long, device=iou.device)
+    first = first.scatter_reduce(1, best_label, torch.where(matched, detection_idx, n_det), reduce='amin')
 
-        if x[0].shape[0]:
-            matches = (torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]),
-                                 1).cpu().numpy())  # [label, detect, iou]
-            if x[0].shape[0] > 1:
-                matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 1],
-                                            return_index=True)[1]]
-                # matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 0],
-                                            return_index=True)[1]]
-            correct[matches[:, 1].astype(int), i] = True
+    return (matched & (first.gather(1, best_label) == detection_idx)).T
 
-    return correct
+
+class StreamingAPAccumulator:
+    """Accumulates the detection statistics of a whole dataset in fixed size
+    per class confidence histograms on the device: the number of predictions
+    and of true positives per IoU level for every confidence bin, and the
+    number of targets. The memory does not grow with the dataset and the
+    precision-recall curves are only built once by compute(). Predictions in
+    the same bin are ranked equally, hence the AP approximates the one of the
+    exact confidence ranking.
+    """
+
+    def __init__(self, n_classes: int, n_iou: int, n_bins: int = 1000, device: torch.device = None) -> None:
+        self.n_classes = n_classes
+        self.n_iou = n_iou
+        self.n_bins = n_bins
+
+        self.predictions = torch.zeros((n_classes, n_bins), device=device)
+        self.true_positives = torch.zeros((n_classes, n_iou, n_bins), device=device)
+        self.targets = torch.zeros(n_classes, device=device)
+
+    def update(self, correct, conf, pred_cls, target_cls):
+        """Adds the predictions and targets of an image
+
+        Args:
+            correct (Tensor[N, T]): true positive per IoU level
+            conf (Tensor[N]): confidence of the predictions
+            pred_cls (Tensor[N]): predicted classes
+            target_cls (Tensor[M]): classes of the targets
+        """
+        bins = (conf * self.n_bins).long().clamp(0, self.n_bins - 1)
+        pred_cls = pred_cls.long()
+
+        self.predictions.view(-1).index_add_(0, pred_cls * self.n_bins + bins,
+                                             torch.ones_like(conf, dtype=self.predictions.dtype))
+        iou_idx = torch.arange(self.n_iou, device=conf.device)
+        tp_idx = (pred_cls[:, None] * self.n_iou + iou_idx[None]) * self.n_bins + bins[:, None]
+        self.true_positives.view(-1).index_add_(0, tp_idx.view(-1), correct.view(-1).to(self.true_positives.dtype))
+        self.targets.index_add_(0, target_cls.long(), torch.ones_like(target_cls, dtype=self.targets.dtype))
+
+    def compute(self, eps=1e-16):
+        """Average precision of the classes with targets, see compute_ap
+
+        Returns:
+            tuple: mean precision and recall at the maximum mean F1 (IoU 0.5),
+            mAP@0.5, mAP@0.5:0.95 and the number of targets per class
+        """
+        # cumulated from the highest confidence down
+        tpc = self.true_positives.flip(-1).cumsum(-1).cpu().numpy()
+        predc = self.predictions.flip(-1).cumsum(-1).cpu().numpy()
+        nt = self.targets.cpu().numpy()
+        classes = np.nonzero(nt)[0]
+
+        ap = np.zeros((len(classes), self.n_iou))
+        for ci, c in enumerate(classes):
+            # one curve point per non empty bin
+            points = np.diff(predc[c], prepend=0) > 0
+            if not points.any():
+                continue
+            recall = tpc[c][:, points] / (nt[c] + eps)
+            precision = tpc[c][:, points] / predc[c][points]
+            for j in range(self.n_iou):
+                ap[ci, j], _, _ = compute_ap(recall[j], precision[j])
+
+        # precision and recall at every confidence threshold, undefined precision is 1
+        p = np.where(predc[classes] > 0, tpc[classes, 0] / np.maximum(predc[classes], eps), 1.0)
+        r = tpc[classes, 0] / (nt[classes, None] + eps)
+        f1 = 2 * p * r / (p + r + eps)
+        i = smooth(f1.mean(0), 0.1).argmax() if len(classes) else 0
+
+        mp = p[:, i].mean() if len(classes) else 0.0
+        mr = r[:, i].mean() if len(classes) else 0.0
+        map50 = ap[:, 0].mean() if len(classes) else 0.0
+        map = ap.mean() if len(classes) else 0.0
+        return mp, mr, map50, map, nt
 
 
 def non_max_suppression(
@@ -382,7 +395,7 @@ def compute_detection_accuracy(base_model,
                           device=device)  # iou vector for mAP@0.5:0.95
     niou = iouv.numel()
 
-    stats = []
+    accumulator = StreamingAPAccumulator(N_CLASSES, niou, device=device)
 
     with torch.inference_mode():
         for batch_i, (im, targets, paths, shapes) in enumerate(dataloader):
@@ -422,8 +435,8 @@ def compute_detection_accuracy(base_model,
 
                 if npr == 0:
                     if nl:  # no predictions but labels were provided
-                        stats.append((correct, *torch.zeros(
-                            (3, 0), device=device)))
+                        accumulator.update(correct, torch.zeros(0, device=device),
+                                           torch.zeros(0, device=device), labels[:, 0])
                     continue
 
                 # Predictions
@@ -438,25 +451,19 @@ def compute_detection_accuracy(base_model,
                                  shapes[si][1])  # native-space labels
                     labelsn = torch.cat((labels[:, 0:1], tbox),
                                         1)  # native-space labels
-                    correct = process_batch(predn, labelsn, iouv)
+                    correct = match_predictions(predn, labelsn, iouv)
                     # confusion_matrix.process_batch(predn, labelsn)
 
                 # pred[:, 5] (pcls)     := predicted probability distribution of all classes
                 # labels[:, 0] (tcls)   := probability distribution of the ground truth
                 # pred[:, 4] (conf)     := confidence
-                stats.append((correct, pred[:, 4], pred[:, 5], labels[:, 0]))
+                accumulator.update(correct, pred[:, 4], pred[:, 5], labels[:, 0])
 
             if progress:
                 progress_bar.update(nb)
 
     # Compute metrics
-    stats = [torch.cat(x, 0).cpu().numpy() for x in zip(*stats)]  # to numpy
-
-    tp, fp, p, r, f1, ap, ap_class = ap_per_class(*stats)
-    ap50, ap = ap[:, 0], ap.mean(1)  # AP@0.5, AP@0.5:0.95
-    mp, mr, map50, map = p.mean(), r.mean(), ap50.mean(), ap.mean()
-    nt = np.bincount(stats[3].astype(int),
-                     minlength=N_CLASSES)  # number of targets per class
+    mp, mr, map50, map, nt = accumulator.compute()
 
     pf = "%20s" * 6  # print format
     logging.info(pf % ("samples", "n tpc", "mP", "mR", "mAP50", "mAP"))
@@ -468,4 +475,7 @@ def compute_detection_accuracy(base_model,
     return map  # confusion_matrix.global_acc()
 
 
+# part of the evaluation cache context, results of earlier metric versions are not reused
+compute_detection_accuracy.cache_version = 'streaming_ap_1000_bins'
+
 accuracy_function = compute_detection_accuracy
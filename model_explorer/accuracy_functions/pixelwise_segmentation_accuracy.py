@@ -1,8 +1,11 @@
 import torch
 import tqdm
 
+from model_explorer.utils.sequential_testing import SequentialAccuracyTest
 
-def compute_pixelwise_segmentation_accuracy(base_model, dataloader_generator, progress=True, title="") -> float:
+
+def compute_pixelwise_segmentation_accuracy(base_model, dataloader_generator, progress=True, title="",
+                                            early_termination: SequentialAccuracyTest = None) -> float:
     dev_string = "cuda" if torch.cuda.is_available() else "cpu"
     device = torch.device(dev_string)
     cpu_device = torch.device("cpu")
@@ -30,9 +33,52 @@ def compute_pixelwise_segmentation_accuracy(base_model, dataloader_generator, pr
 
             progress_bar.update(y_pred.size(0))
 
+            # every image contributes its pixel accuracy as score
+            if early_termination is not None:
+                image_accs = (target == y_pred).float().mean((1, 2))
+                if early_termination.update(image_accs.sum().item(), y_pred.size(0)):
+                    break
+
     pixel_accs = torch.stack(running_pixel_acc)
 
     return float(pixel_accs.float().mean().to(cpu_device))
 
 
+def compute_population_pixelwise_segmentation_accuracy(base_model, dataloader_generator, population_size: int,
+                                                       progress=True, title="") -> list:
+    """Pixelwise accuracy of several individuals at once, the model has to be
+    in population mode and every batch is replicated once per individual.
+    """
+    dev_string = "cuda" if torch.cuda.is_available() else "cpu"
+    device = torch.device(dev_string)
+
+    dataset_size = len(dataloader_generator)
+    dataloader = dataloader_generator.get_dataloader()
+
+    progress_bar = tqdm.tqdm(total=dataset_size, ascii=True, desc=title, position=0, disable=not progress)
+
+    model = base_model.to(device)
+
+    running_pixel_acc = []
+
+    model.eval()
+    with torch.no_grad():
+        for x, target in dataloader:
+            x = x.to(device)
+            target = target.to(device)
+
+            y_prob = model(x.repeat(population_size, *[1] * (x.dim() - 1)))
+            y_pred = y_prob.argmax(1)[:, 4:-4, :]
+            y_pred = y_pred.view(population_size, -1, *y_pred.shape[1:])
+
+            running_pixel_acc.append((target[None] == y_pred).float().flatten(1).mean(1))
+
+            progress_bar.update(target.size(0))
+
+    pixel_accs = torch.stack(running_pixel_acc)
+
+    return pixel_accs.mean(0).cpu().tolist()
+
+
 accuracy_function = compute_pixelwise_segmentation_accuracy
+population_accuracy_function = compute_population_pixelwise_segmentation_accuracy
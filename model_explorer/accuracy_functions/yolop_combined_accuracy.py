@@ -15,7 +15,7 @@ def compute_yolop_combined_metric(base_model, dataloader_generator, progress=Tru
 
     model = base_model.to(device)
 
-    validation_loader = dataloader_generator.dataloader
+    validation_loader = dataloader_generator.get_dataloader()
     criterion = get_loss(cfg, device)
     output_dir = 'results'
 
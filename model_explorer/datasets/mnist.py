@@ -64,6 +64,7 @@ def prepare_mnist_dataset(path, download=False, **kwargs):
                           download=download)
 
 
+dataset_creator = prepare_mnist_dataset
 collate_fn = None
 get_validation_dataset = prepare_mnist_dataset
 get_train_dataset = None
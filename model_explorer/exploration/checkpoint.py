@@ -0,0 +1,124 @@
+import os
+import glob
+import time
+import random
+import pickle
+import tempfile
+import numpy as np
+
+from pymoo.core.population import Population
+from pymoo.algorithms.moo.nsga2 import NSGA2
+
+from model_explorer.utils.logger import logger
+from model_explorer.problems.evaluation_cache import EvaluationCache
+from model_explorer.result_handling.save_results import RESULTS_DIR
+
+
+CHECKPOINT_FILE = "checkpoint.pkl"
+
+# individual attributes required to continue the survival and tournament selection,
+# the feasibility is a read-only property derived from CV
+POPULATION_KEYS = ['X', 'F', 'G', 'CV', 'rank', 'crowding']
+
+
+def save_checkpoint(run_dir: str, algorithm: NSGA2, evaluation_cache: EvaluationCache = None):
+    """Stores the state needed to continue an exploration after the last
+    finished generation: the population, the generation and evaluation
+    counters, the random number generator states, the in-memory entries of
+    the evaluation cache and the training data of the surrogate. The model itself is not part of the checkpoint, it
+    is rebuilt from the workload file.
+
+    Args:
+        run_dir (str): run directory the checkpoint is written to
+        algorithm (NSGA2): algorithm after a finished generation
+        evaluation_cache (EvaluationCache, optional): cache of the problem. Defaults to None.
+    """
+    metadata_keys = list(getattr(algorithm.problem, 'result_metadata_keys', []))
+    population = {}
+    for key in POPULATION_KEYS + metadata_keys:
+        values = algorithm.pop.get(key)
+        if values is not None and all(v is not None for v in values):
+            population[key] = np.asarray(values)
+
+    state = {
+        'n_gen': algorithm.n_iter - 1,
+        'n_eval': algorithm.evaluator.n_eval,
+        'population': population,
+        'np_random_state': np.random.get_state(),
+        'random_state': random.getstate(),
+        'evaluation_cache': None,
+        'surrogate': None
+    }
+    # entries of the disk backend are already persistent
+    if evaluation_cache is not None and evaluation_cache.backend == 'memory':
+        state['evaluation_cache'] = evaluation_cache.get_state()
+    if getattr(algorithm.problem, 'surrogate', None) is not None:
+        state['surrogate'] = algorithm.problem.surrogate.get_state()
+
+    os.makedirs(run_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', dir=run_dir, suffix='.tmp', delete=False) as f:
+        pickle.dump(state, f)
+    os.replace(f.name, os.path.join(run_dir, CHECKPOINT_FILE))
+
+    logger.debug(f"Saved checkpoint of generation {state['n_gen']} to {run_dir}")
+
+
+def load_checkpoint(run_dir: str) -> dict:
+    with open(os.path.join(run_dir, CHECKPOINT_FILE), 'rb') as f:
+        return pickle.load(f)
+
+
+def restore_checkpoint(algorithm: NSGA2, state: dict, evaluation_cache: EvaluationCache = None):
+    """Continues a set up algorithm from a checkpoint, the next call of
+    algorithm.next() evaluates the generation after the checkpoint.
+
+    Args:
+        algorithm (NSGA2): algorithm after algorithm.setup()
+        state (dict): checkpoint from load_checkpoint
+        evaluation_cache (EvaluationCache, optional): cache of the problem. Defaults to None.
+    """
+    algorithm.pop = Population.new(**state['population'])
+    algorithm.evaluator.n_eval = state['n_eval']
+    algorithm.is_initialized = True
+    algorithm.start_time = time.time()
+    algorithm.n_iter = state['n_gen']
+    algorithm.opt = None
+    algorithm._set_optimum()
+    algorithm.termination.update(algorithm)
+    algorithm.n_iter += 1
+
+    # setup() seeded the generators, continue with the sequence of the interrupted run
+    np.random.set_state(state['np_random_state'])
+    random.setstate(state['random_state'])
+
+    if evaluation_cache is not None and state['evaluation_cache'] is not None:
+        evaluation_cache.set_state(state['evaluation_cache'])
+    if getattr(algorithm.problem, 'surrogate', None) is not None and state.get('surrogate') is not None:
+        algorithm.problem.surrogate.set_state(state['surrogate'])
+
+    # the checkpoint of a finished run is not continued
+    if algorithm.termination.has_terminated():
+        algorithm.finalize()
+
+    logger.info(f"Resuming after generation {state['n_gen']} ({state['n_eval']} evaluations)")
+
+
+def find_latest_checkpoint(problem_name: str = "", model_name: str = "", dataset_name: str = "") -> str:
+    """Searches the RESULTS_DIR for the most recent run directory of the
+    given exploration that holds a checkpoint, for SLURM array jobs only runs
+    of the same task id are considered.
+
+    Returns:
+        str: run directory or None if there is no checkpoint
+    """
+    pattern = os.path.join(RESULTS_DIR, f'expl_{problem_name}_{model_name}_{dataset_name}_*', CHECKPOINT_FILE)
+    checkpoints = glob.glob(pattern)
+
+    if 'SLURM_ARRAY_TASK_ID' in os.environ:
+        suffix = f"_slurmid_{os.environ['SLURM_ARRAY_TASK_ID']}"
+        checkpoints = [c for c in checkpoints if os.path.dirname(c).endswith(suffix)]
+
+    if len(checkpoints) == 0:
+        return None
+
+    return os.path.dirname(max(checkpoints, key=os.path.getmtime))
@@ -1,59 +1,164 @@
+import os
+import json
+import torch
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
 from model_explorer.utils.logger import logger
-from model_explorer.utils.setup import build_dataloader_generators, setup_torch_device, setup_workload
+from model_explorer.utils.setup import build_dataloader_generators, setup_torch_device, setup_workload, \
+        get_population_accuracy_function
 from model_explorer.utils.workload import Workload
 from model_explorer.utils.setup import get_model_init_function, get_model_update_function
 
 
+class _Reevaluator:
+    """Model, dataset and accuracy function of the reevaluation, created once
+    per process. With a population accuracy function, a chunk of
+    configurations is evaluated together: every batch is decoded once and
+    runs through the model in population mode for all of them.
+    """
+
+    def __init__(self, workload: Workload, progress: bool) -> None:
+        dataloaders = build_dataloader_generators(workload['reevaluation']['datasets'])
+        self.reevaluate_dataloader = dataloaders['reevaluate']
+        model, self.accuracy_function = setup_workload(workload['model'])
+        self.population_accuracy_function = get_population_accuracy_function(workload['model'])
+        device = setup_torch_device()
+        self.progress = progress
+
+        model_init_func = get_model_init_function(workload['problem']['problem_function'])
+        self.model_update_func = get_model_update_function(workload['problem']['problem_function'])
+        kwargs: dict = workload['exploration']['extra_args']
+        if 'calibration' in workload.yaml_data:
+            kwargs['calibration_file'] = workload['calibration']['file']
+        self.explorable_model = model_init_func(model, device, **kwargs)
+
+    def evaluate(self, configurations: list, title: str) -> list:
+        """Full accuracy of every configuration (list of parameter vectors)"""
+        if len(configurations) > 1 and self.population_accuracy_function is not None and \
+                self.explorable_model.supports_population_mode():
+            self.explorable_model.enable_population_mode(configurations)
+            try:
+                return self.population_accuracy_function(self.explorable_model.base_model,
+                                                         self.reevaluate_dataloader,
+                                                         len(configurations),
+                                                         progress=self.progress,
+                                                         title=title)
+            finally:
+                self.explorable_model.disable_population_mode()
+
+        accuracies = []
+        for parameters in configurations:
+            self.model_update_func(self.explorable_model, parameters)
+            accuracies.append(self.accuracy_function(self.explorable_model.base_model,
+                                                     self.reevaluate_dataloader,
+                                                     progress=self.progress,
+                                                     title=title))
+        return accuracies
+
+
+# Reevaluator of a worker process, set once by the pool initializer
+_worker_reevaluator = None
+
+
+def _init_worker(workload: Workload, progress: bool):
+    global _worker_reevaluator
+    _worker_reevaluator = _Reevaluator(workload, progress)
+
+
+def _evaluate_in_worker(configurations: list, title: str) -> list:
+    return _worker_reevaluator.evaluate(configurations, title)
+
+
+def _configuration_key(parameters) -> str:
+    return json.dumps([float(p) for p in parameters])
+
+
+def _to_float(accuracy):
+    if isinstance(accuracy, torch.Tensor):
+        return accuracy.item()
+    return accuracy
+
 
 def evaluate_full_model(workload: Workload, model_configurations: pd.DataFrame,
-                        progress: bool) -> pd.DataFrame:
+                        progress: bool, configurations_per_pass: int = 1, workers: int = 1,
+                        results_file: str = None) -> pd.DataFrame:
     """Function to evaluate a list of model configurations with the entire dataset
 
     Args:
         workload (Workload): Workload description
         model_configurations (pd.DataFrame): Input dataframe with the selected model configurations.
         progress (bool): Show evaluation progress?
+        configurations_per_pass (int, optional): Configurations evaluated in
+            one pass over the dataset, requires a population accuracy function
+            and model. Defaults to 1.
+        workers (int, optional): Processes the chunks of configurations are
+            spread across, each holds its own model. Defaults to 1.
+        results_file (str, optional): Every finished configuration is appended
+            to this csv file, configurations already in it are not evaluated
+            again. Defaults to None.
 
     Returns:
         pd.DataFrame: Dataframe with new column showing the full accuarcy
     """
-
-    dataloaders = build_dataloader_generators(
-        workload['reevaluation']['datasets'])
-    reevaluate_dataloader = dataloaders['reevaluate']
-    model, accuracy_function = setup_workload(workload['model'])
-    device = setup_torch_device()
-
-    model_init_func = get_model_init_function(workload['problem']['problem_function'])
-    model_update_func = get_model_update_function(workload['problem']['problem_function'])
-    kwargs: dict = workload['exploration']['extra_args']
-    if 'calibration' in workload.yaml_data:
-        kwargs['calibration_file'] = workload['calibration']['file']
-    explorable_model = model_init_func(model, device, **kwargs)
-
     # Copy individuals and add full_accuracy column
     evaluated_configs = model_configurations.copy(deep=True)
-    evaluated_configs['full_accuracy'] = -1
+    evaluated_configs['config_key'] = [_configuration_key(p) for p in evaluated_configs['parameters']]
+    evaluated_configs['full_accuracy'] = -1.0
+
+    finished = {}
+    if results_file is not None and os.path.exists(results_file):
+        finished_df = pd.read_csv(results_file)
+        finished = dict(zip(finished_df['config_key'], finished_df['full_accuracy']))
+        logger.info(f"Loaded {len(finished)} finished configurations from {results_file}")
+
+    pending = [i for i, key in zip(evaluated_configs.index, evaluated_configs['config_key']) if key not in finished]
+    chunks = [pending[start:start + configurations_per_pass]
+              for start in range(0, len(pending), configurations_per_pass)]
 
     tot_eval = len(model_configurations)
-    logger.info(f"Starting to evaluate {tot_eval} individuals")
+    logger.info(f"Starting to evaluate {len(pending)} of {tot_eval} individuals in {len(chunks)} pass(es)")
+
+    # 1-based position of each configuration for the log output
+    position = {i: n + 1 for n, i in enumerate(evaluated_configs.index)}
+
+    def store(chunk: list, accuracies: list):
+        for i, full_accuracy in zip(chunk, accuracies):
+            full_accuracy = _to_float(full_accuracy)
+            finished[evaluated_configs.loc[i, 'config_key']] = full_accuracy
+            logger.info(f"Done with ind {position[i]} / {tot_eval}, accuracy is {full_accuracy:.4f}, "
+                        f"was before {evaluated_configs.loc[i, 'accuracy']:.4f}, fo={evaluated_configs.loc[i, 'F_0']}")
+
+        # append the finished configurations, a crash only loses the running ones
+        if results_file is not None:
+            rows = evaluated_configs.loc[chunk].copy()
+            rows['full_accuracy'] = [finished[key] for key in rows['config_key']]
+            rows.to_csv(results_file, mode='a', header=not os.path.exists(results_file), index=False)
 
-    for i, row in model_configurations.iterrows():
-        logger.debug(f"Evaluating {i+1} / {tot_eval} models with optimization accuracy: {row['accuracy']}")
+    def title(chunk: list) -> str:
+        for i in chunk:
+            logger.debug(f"Evaluating {position[i]} / {tot_eval} models with optimization accuracy: "
+                         f"{evaluated_configs.loc[i, 'accuracy']}")
+        return f"Reevaluating {', '.join(str(position[i]) for i in chunk)}/{tot_eval}"
 
-        thresholds = row['parameters']
-        model_update_func(explorable_model, thresholds)
-        full_accuracy = accuracy_function(explorable_model.base_model,
-                                          reevaluate_dataloader,
-                                          progress=progress,
-                                          title=f"Reevaluating {i+1}/{tot_eval}")
+    configurations = {i: list(evaluated_configs.loc[i, 'parameters']) for i in pending}
 
-        logger.info(f"Done with ind {i+1} / {tot_eval}, accuracy is {full_accuracy:.4f}, \
-                    was before {row['accuracy']:.4f}, fo={row['F_0']}")
+    if workers > 1 and len(chunks) > 1:
+        # spawn is required, forked processes cannot use cuda
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=get_context('spawn'),
+                                 initializer=_init_worker, initargs=(workload, progress)) as executor:
+            futures = {executor.submit(_evaluate_in_worker, [configurations[i] for i in chunk], title(chunk)): chunk
+                       for chunk in chunks}
+            for future in as_completed(futures):
+                store(futures[future], future.result())
+    elif len(chunks) > 0:
+        reevaluator = _Reevaluator(workload, progress)
+        for chunk in chunks:
+            store(chunk, reevaluator.evaluate([configurations[i] for i in chunk], title(chunk)))
 
-        # add full accuary to dataframe
-        evaluated_configs.loc[i, 'full_accuracy'] = full_accuracy.item()
+    evaluated_configs['full_accuracy'] = [finished[key] for key in evaluated_configs['config_key']]
 
-    return evaluated_configs
+    # the key is only needed to resume from the results file
+    return evaluated_configs.drop(columns=['config_key'])
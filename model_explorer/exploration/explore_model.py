@@ -4,20 +4,29 @@ import numpy as np
 from pymoo.algorithms.moo.nsga2 import NSGA2
 from pymoo.operators.crossover.sbx import SBX
 from pymoo.operators.mutation.pm import PolynomialMutation
-from pymoo.optimize import minimize
 from pymoo.termination import get_termination
 import pymoo.core.result
 
 from model_explorer.utils.logger import logger
+from model_explorer.problems.evaluation_functions import build_evaluation_runner, \
+        ParallelElementwiseEvaluationWithIndex
+from model_explorer.problems.evaluation_cache import build_evaluation_cache
+from model_explorer.problems.multi_fidelity import build_screening
+from model_explorer.problems.surrogate import build_surrogate
+from model_explorer.models.activation_cache import build_activation_cache
+from model_explorer.exploration.checkpoint import save_checkpoint, load_checkpoint, restore_checkpoint
+from model_explorer.result_handling.results_writer import ResultsWriter
+from model_explorer.result_handling.save_results import get_run_directory
 from model_explorer.utils.setup import build_dataloader_generators, setup_torch_device, \
-        setup_workload, get_prepare_exploration_function
+        setup_workload, get_prepare_exploration_function, get_population_accuracy_function
 from model_explorer.utils.workload import Workload
 
 
 
 def explore_model(workload: Workload,
                   skip_baseline: bool,
-                  progress: bool) -> pymoo.core.result.Result:
+                  progress: bool,
+                  resume: str = None) -> pymoo.core.result.Result:
     """Function to explore the influence of model parameter to the accuracy. It
     instanciates an NSGA algorithm to automatically explore different model
     parameter sets.
@@ -26,6 +35,7 @@ def explore_model(workload: Workload,
         workload (Workload): Workload description
         skip_baseline (bool): Skip the initial base line accuracy computation?
         progress (bool): Show evaluation progress?
+        resume (str, optional): Run directory whose checkpoint is continued. Defaults to None.
 
     Returns:
         pymoo.core.result.Result: pymoo result object with the found
@@ -57,6 +67,34 @@ def explore_model(workload: Workload,
     min_accuracy = workload['exploration']['minimum_accuracy']
     problem = prepare_function(model, device, dataloaders['exploration'],
                                accuracy_function, min_accuracy, progress, **kwargs)
+    problem.set_early_termination(workload['exploration'].get('early_termination', None))
+    evaluation_settings = workload['exploration'].get('evaluation', {})
+    problem.elementwise_runner = build_evaluation_runner(evaluation_settings)
+    problem.population_size = evaluation_settings.get('population_size', 1)
+    problem.population_accuracy_function = get_population_accuracy_function(workload['model'])
+    problem.screening = build_screening(workload['exploration'].get('screening', None),
+                                        workload['exploration']['datasets']['exploration'])
+    if problem.screening is not None:
+        problem.result_metadata_keys += ['screening_violation', 'promoted']
+    problem.surrogate = build_surrogate(workload['exploration'].get('surrogate', None), problem.xl, problem.xu)
+    if problem.surrogate is not None:
+        problem.result_metadata_keys += ['surrogate', 'surrogate_violation']
+    cache_context = {
+        'problem': workload['problem'],
+        'model': workload['model'],
+        'dataset': workload['exploration']['datasets']['exploration'],
+        'subset_indices': dataloaders['exploration'].subset_indices,
+        'minimum_accuracy': min_accuracy,
+        'early_termination': problem.early_termination,
+        'screening': problem.screening.settings() if problem.screening is not None else None,
+        'surrogate': problem.surrogate.settings() if problem.surrogate is not None else None,
+        'extra_args': kwargs
+    }
+    # accuracy functions whose results changed between versions
+    if hasattr(accuracy_function, 'cache_version'):
+        cache_context['accuracy_function'] = accuracy_function.cache_version
+    problem.evaluation_cache = build_evaluation_cache(evaluation_settings, context=cache_context)
+    activation_cache = build_activation_cache(problem.model, workload['exploration'].get('activation_cache', None))
 
     # Setup algorithm
     crossover = SBX(prob_var=workload['exploration']['nsga']['crossover_prob'],
@@ -77,6 +115,22 @@ def explore_model(workload: Workload,
     )
 
     termination = get_termination("n_gen", workload['exploration']['nsga']['generations'])
+
+    # individuals are streamed to a run directory, the history is only needed for result pickles
+    results_settings = workload['exploration'].get('results', {})
+    checkpoint_every = results_settings.get('checkpoint_every', 1)
+    run_dir = resume
+    if run_dir is None:
+        run_dir = get_run_directory(workload['problem']['problem_function'], workload['model']['type'],
+                                    workload['exploration']['datasets']['exploration']['type'])
+    results_writer = None
+    if results_settings.get('stream', True):
+        results_writer = ResultsWriter(run_dir, run_meta={
+            'problem': workload['problem']['problem_function'],
+            'model': workload['model']['type'],
+            'dataset': workload['exploration']['datasets']['exploration']['type'],
+            'nsga': workload['exploration']['nsga']
+        })
     # termination = get_termination("moo")
 
     logger.info("Prepared Run, run infomation:")
@@ -88,16 +142,53 @@ def explore_model(workload: Workload,
     logger.info(f"\tNSGA gens: {workload['exploration']['nsga']['generations']}")
     logger.info(f"\tNSGA pop size: {workload['exploration']['nsga']['pop_size']} " +
                 f"offsprings: {workload['exploration']['nsga']['offsprings']}")
+    logger.info(f"\tEvaluation runner: {type(problem.elementwise_runner).__name__}")
+    if problem.population_size > 1 and isinstance(problem.elementwise_runner, ParallelElementwiseEvaluationWithIndex):
+        logger.warning("Population batched evaluation is only supported by the serial runner, "
+                       "individuals are evaluated one by one")
+    elif problem.supports_population_evaluation():
+        logger.info(f"\tPopulation batched evaluation of {problem.population_size} individuals")
+    elif problem.population_size > 1:
+        logger.warning("Population batched evaluation is not supported by the problem or accuracy function")
+    if problem.evaluation_cache is not None:
+        logger.info(f"\tEvaluation cache: {problem.evaluation_cache.backend}")
+    if results_writer is not None:
+        logger.info(f"\tStreaming results to: {results_writer.run_dir}")
+    if checkpoint_every > 0:
+        logger.info(f"\tCheckpoint every {checkpoint_every} generation(s) to: {run_dir}")
+    if problem.early_termination is not None:
+        logger.info(f"\tEarly termination: {problem.early_termination}")
+    if problem.screening is not None:
+        logger.info(f"\tScreening: {problem.screening.settings()}")
+    if problem.surrogate is not None:
+        logger.info(f"\tSurrogate: {problem.surrogate.settings()}")
+    if activation_cache is not None:
+        logger.info(f"\tActivation cache cut points: {', '.join(activation_cache.cut_points)}")
+
+    algorithm.setup(problem,
+                    termination=termination,
+                    seed=1,
+                    save_history=results_settings.get('save_pickle', True),
+                    callback=results_writer)
+
+    if resume is not None:
+        restore_checkpoint(algorithm, load_checkpoint(resume), problem.evaluation_cache)
 
     logger.info("Starting problem minimization.")
 
-    res = minimize(
-        problem,
-        algorithm,
-        termination,
-        seed=1,
-        save_history=True
-    )
+    # explicit generation loop of pymoo.optimize.minimize, the state is stored after generations
+    try:
+        while algorithm.has_next():
+            algorithm.next()
+
+            n_gen = algorithm.n_iter - 1
+            if checkpoint_every > 0 and (n_gen % checkpoint_every == 0 or not algorithm.has_next()):
+                save_checkpoint(run_dir, algorithm, problem.evaluation_cache)
+
+        res = algorithm.result()
+    finally:
+        # also stops the worker processes of the parallel runner after errors or interrupts
+        problem.elementwise_runner.close()
 
     logger.info("Finished problem minimization.")
 
@@ -0,0 +1,259 @@
+import os
+import uuid
+import hashlib
+import torch
+import functools
+import numpy as np
+
+from collections import OrderedDict
+
+from model_explorer.utils.logger import logger
+
+
+class _BatchState():
+    """Book keeping of the batch that is currently forwarded"""
+
+    def __init__(self, fingerprint: tuple, parameters: list, start_stats: list) -> None:
+        self.fingerprint = fingerprint
+        self.parameters = parameters
+        self.start_stats = start_stats
+        self.resume_child = None
+        self.resume_entry = None
+
+
+class ActivationCache():
+    """Stores the outputs of chosen top level children (cut points) of the base
+    model for the batches of a fixed exploration dataset. An entry is keyed on
+    the cut point, the input batch and the explorable parameters of all modules
+    up to the cut point. When an individual only differs from an already
+    evaluated one in deeper layers, the forward pass is resumed from the
+    deepest cut point with a matching parameter prefix.
+
+    The cache assumes that the top level children are executed in the order
+    they are defined and that nothing before a cut point is used after it,
+    e.g. torchvision ResNets with cut points at layer1 ... layer4. The modules
+    before the resumed cut point are skipped, model statistics (e.g. created
+    sparse blocks) are restored from the entry.
+
+    Entries are evicted least recently used once memory_limit_mb is exceeded,
+    with a spill directory they are moved to memory-mapped files instead.
+    Without one, the limit has to hold the entries of one pass over the
+    dataset (batches x size of the cut point outputs of a batch), otherwise
+    the batches of an individual evict each other before they are reused.
+    """
+
+    def __init__(self, model, cut_points: list = None, memory_limit_mb: float = 1024,
+                 spill_dir: str = None) -> None:
+        self.model = model
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self.spill_dir = spill_dir
+
+        self.children = [name for name, _ in model.base_model.named_children()]
+        if cut_points is None:
+            cut_points = self.children
+        for cut_point in cut_points:
+            assert cut_point in self.children, f"Cut point {cut_point} is not a top level child of the model"
+        self.cut_points = [name for name in self.children if name in cut_points]
+
+        # indices of the explorable modules that influence the output of each cut point
+        self._prefix_modules = {}
+        for cut_point in self.cut_points:
+            prefix_children = self.children[:self.children.index(cut_point) + 1]
+            self._prefix_modules[cut_point] = [
+                i for i, name in enumerate(model.explorable_module_names)
+                if name.split('.')[0] in prefix_children]
+
+        self._entries = OrderedDict()
+        self._spilled = {}
+        self._memory_used = 0
+        self._state = None
+
+        # statistics
+        self.hits = 0
+        self.requests = 0
+
+        # batches of the first pass over the dataset, to warn if the limit cannot hold it
+        self._first_pass_batches = set()
+        self._first_pass_done = False
+        self._warned_limit = False
+
+        if self.spill_dir is not None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._original_forwards = {}
+        for name, child in model.base_model.named_children():
+            # the previous instance forward is restored by remove()
+            self._original_forwards[name] = child.__dict__.get('forward', None)
+            child.forward = functools.partial(self._forward_child, name, child.forward)
+
+        self._pre_hook = model.base_model.register_forward_pre_hook(self._start_batch)
+        self._hook = model.base_model.register_forward_hook(self._end_batch)
+
+    def remove(self):
+        """Restores the original forward methods and drops all entries"""
+        for name, child in self.model.base_model.named_children():
+            if self._original_forwards[name] is None:
+                del child.forward
+            else:
+                child.forward = self._original_forwards[name]
+        self._pre_hook.remove()
+        self._hook.remove()
+        self.clear()
+
+    def clear(self):
+        """Drops all entries, has to be called whenever the model changes in a
+        way that is not described by its explorable parameters.
+        """
+        for filename, *_ in self._spilled.values():
+            os.remove(filename)
+        self._entries.clear()
+        self._spilled.clear()
+        self._memory_used = 0
+
+    def hit_rate(self) -> float:
+        return self.hits / self.requests if self.requests > 0 else 0.0
+
+    def reset_statistics(self):
+        self.hits = 0
+        self.requests = 0
+
+    def _key(self, cut_point: str, state: _BatchState) -> tuple:
+        prefix = tuple(float(state.parameters[i]) for i in self._prefix_modules[cut_point])
+        return (cut_point, state.fingerprint, prefix)
+
+    @staticmethod
+    def _fingerprint(inp: torch.Tensor) -> tuple:
+        # exact digest of the batch, summaries like sums match for permuted or differently augmented batches
+        data = inp.detach().contiguous().view(-1).view(torch.uint8).cpu().numpy()
+        return (tuple(inp.shape), str(inp.dtype), hashlib.blake2b(data.tobytes(), digest_size=16).hexdigest())
+
+    def _start_batch(self, module, args):
+        self._state = None
+        if module.training or torch.is_grad_enabled() or len(args) == 0 or not isinstance(args[0], torch.Tensor):
+            return
+        # the explorable parameters do not describe a population batch
+        if self.model.in_population_mode():
+            return
+
+        self._state = _BatchState(self._fingerprint(args[0]),
+                                  self.model.get_explorable_parameters(),
+                                  self.model.get_module_stats())
+
+        if not self._first_pass_done and not self._warned_limit:
+            # the first repeated batch ends the first pass
+            self._first_pass_done = self._state.fingerprint in self._first_pass_batches
+            self._first_pass_batches.add(self._state.fingerprint)
+            if self._first_pass_done:
+                self._first_pass_batches.clear()
+
+        self.requests += 1
+        for cut_point in reversed(self.cut_points):
+            entry = self._lookup(self._key(cut_point, self._state))
+            if entry is not None:
+                self.hits += 1
+                self._state.resume_child = cut_point
+                self._state.resume_entry = entry
+                break
+
+    def _end_batch(self, module, args, output):
+        self._state = None
+
+    def _forward_child(self, name: str, forward: callable, *args, **kwargs):
+        state = self._state
+        if state is None:
+            return forward(*args, **kwargs)
+
+        if state.resume_child is not None:
+            if name != state.resume_child:
+                # skipped, the result is replaced by the cached activation anyway
+                return args[0] if len(args) > 0 else None
+
+            activation, stats = state.resume_entry
+            self.model.add_module_stats(stats)
+            state.resume_child = None
+            state.resume_entry = None
+            return activation
+
+        output = forward(*args, **kwargs)
+        if name in self._prefix_modules and isinstance(output, torch.Tensor):
+            key = self._key(name, state)
+            if key not in self._entries and key not in self._spilled:
+                current_stats = self.model.get_module_stats()
+                stats = [None] * len(current_stats)
+                for i in self._prefix_modules[name]:
+                    if current_stats[i] is not None:
+                        stats[i] = tuple(c - s for c, s in zip(current_stats[i], state.start_stats[i]))
+                self._insert(key, output.detach(), stats)
+
+        return output
+
+    def _lookup(self, key: tuple):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        if key in self._spilled:
+            filename, shape, dtype, device, stats = self._spilled[key]
+            data = np.memmap(filename, dtype=dtype, mode='r', shape=shape)
+            return torch.from_numpy(np.array(data)).to(device), stats
+
+        return None
+
+    def _insert(self, key: tuple, activation: torch.Tensor, stats: list):
+        size = activation.element_size() * activation.numel()
+        if size > self.memory_limit:
+            logger.debug(f"Activation of {key[0]} exceeds the activation cache limit")
+            return
+
+        self._entries[key] = (activation, stats)
+        self._memory_used += size
+
+        if self._memory_used > self.memory_limit and self.spill_dir is None and \
+                not self._first_pass_done and not self._warned_limit:
+            logger.warning(f"The activation cache limit of {self.memory_limit / 2**20:.0f} MB cannot hold one "
+                           f"pass over the dataset (full after {len(self._first_pass_batches)} batches), evicted "
+                           "activations are not reused: increase memory_limit_mb, reduce the cut points or set a "
+                           "spill_dir")
+            self._warned_limit = True
+            self._first_pass_batches.clear()
+
+        while self._memory_used > self.memory_limit:
+            evicted_key, (evicted, evicted_stats) = self._entries.popitem(last=False)
+            self._memory_used -= evicted.element_size() * evicted.numel()
+            if self.spill_dir is not None:
+                self._spill(evicted_key, evicted, evicted_stats)
+
+    def _spill(self, key: tuple, activation: torch.Tensor, stats: list):
+        array = activation.cpu().numpy()
+        filename = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.npy")
+        data = np.memmap(filename, dtype=array.dtype, mode='w+', shape=array.shape)
+        data[:] = array
+        data.flush()
+        self._spilled[key] = (filename, array.shape, array.dtype, activation.device, stats)
+
+    def __getstate__(self):
+        # entries are neither shared nor sent to other processes
+        state = self.__dict__.copy()
+        state['_entries'] = OrderedDict()
+        state['_spilled'] = {}
+        state['_memory_used'] = 0
+        state['_state'] = None
+        return state
+
+
+def build_activation_cache(model, settings: dict) -> ActivationCache:
+    """Enables the activation cache described in the exploration settings.
+
+    Args:
+        model (CustomModel): the explored model
+        settings (dict): activation_cache settings from the workload file
+
+    Returns:
+        ActivationCache: the cache or None if it is disabled
+    """
+    if settings is None or not settings.get('enabled', True):
+        return None
+
+    return model.enable_activation_cache(cut_points=settings.get('cut_points', None),
+                                         memory_limit_mb=settings.get('memory_limit_mb', 1024),
+                                         spill_dir=settings.get('spill_dir', None))
@@ -0,0 +1,70 @@
+import torch
+import functools
+
+from pytorch_quantization import nn as quant_nn
+
+
+class CompactQuantizationBackend:
+    """Replaces the forward of calibrated per tensor TensorQuantizers with a
+    single fake quantization op. The amax values of all quantizers are kept
+    in one tensor, whenever the bit widths change the scales and integer
+    bounds of all quantizers are computed at once, hence a forward pass does
+    not recompute them in Python for every quantizer.
+
+    The quantization matches TensorQuantizer: symmetric, zero point 0, scale
+    amax / (2^(bits - 1 + unsigned) - 1) and a narrow or full signed range.
+    """
+
+    def __init__(self, quantizers: list) -> None:
+        self.quantizers = quantizers
+
+        for quantizer in self.quantizers:
+            assert quantizer.amax is not None, "The compact backend requires calibrated quantizers"
+            assert quantizer.amax.numel() == 1, "The compact backend only supports per tensor quantization"
+
+        self.amax = torch.tensor([float(q.amax) for q in self.quantizers], dtype=torch.float64)
+        self.unsigned = torch.tensor([bool(q._unsigned) for q in self.quantizers])
+        self.narrow_range = torch.tensor([bool(q._narrow_range) for q in self.quantizers])
+
+        self.scales = []
+        self.quant_min = []
+        self.quant_max = []
+        self.set_bit_widths([q.num_bits for q in self.quantizers])
+
+        self._original_forwards = {}
+
+    def set_bit_widths(self, bit_widths):
+        """Precomputes scale and integer bounds of all quantizers"""
+        bits = torch.as_tensor(bit_widths, dtype=torch.float64)
+        assert len(bits) == len(self.quantizers), "bit_width list has to match the amount of quantization layers"
+
+        max_bound = torch.pow(2.0, bits - 1 + self.unsigned.double()) - 1.0
+        min_bound = torch.where(self.unsigned, torch.zeros_like(max_bound),
+                                torch.where(self.narrow_range, -max_bound, -max_bound - 1.0))
+
+        scales = self.amax / max_bound
+        scales = torch.where(self.amax <= 1.0 / (1 << 24), torch.ones_like(scales), scales)
+
+        # python scalars, the fake quantization op takes them without a device sync
+        self.scales = scales.tolist()
+        self.quant_min = min_bound.long().tolist()
+        self.quant_max = max_bound.long().tolist()
+
+    def attach(self):
+        for i, quantizer in enumerate(self.quantizers):
+            self._original_forwards[i] = quantizer.__dict__.get('forward', None)
+            quantizer.forward = functools.partial(self._forward, i)
+
+    def detach(self):
+        for i, forward in self._original_forwards.items():
+            if forward is None:
+                del self.quantizers[i].forward
+            else:
+                self.quantizers[i].forward = forward
+        self._original_forwards = {}
+
+    def _forward(self, i: int, inputs: torch.Tensor) -> torch.Tensor:
+        quantizer: quant_nn.TensorQuantizer = self.quantizers[i]
+        if quantizer._disabled or not quantizer._if_quant:
+            return inputs
+        return torch.fake_quantize_per_tensor_affine(inputs, self.scales[i], 0, self.quant_min[i], self.quant_max[i])
@@ -5,6 +5,7 @@ from torch import nn
 
 from model_explorer.utils.data_loader_generator import DataLoaderGenerator
 from model_explorer.utils.logger import logger
+from model_explorer.models.activation_cache import ActivationCache
 
 
 class CustomModel():
@@ -30,9 +31,55 @@ class CustomModel():
                                                             step_size=1,
                                                             gamma=0.1)
 
+        self.activation_cache = None
+
     def get_explorable_parameter_count(self) -> int:
         return len(self.explorable_modules)
 
+    def get_explorable_parameters(self) -> list:
+        """Returns the current parameter of every explorable module"""
+        raise NotImplementedError()
+
+    def enable_population_mode(self, parameters):
+        """Evaluates several individuals in one forward pass, the batch is then
+        the input batch replicated once per individual (see QuantizedModel).
+
+        Args:
+            parameters: [individuals, explorable modules] parameters
+        """
+        raise NotImplementedError()
+
+    def disable_population_mode(self):
+        raise NotImplementedError()
+
+    def supports_population_mode(self) -> bool:
+        return False
+
+    def in_population_mode(self) -> bool:
+        return False
+
+    def get_module_stats(self) -> list:
+        """Returns a tuple of the statistics every explorable module collects
+        during a forward pass (or None), used to restore them for cached
+        activations.
+        """
+        return [None] * len(self.explorable_modules)
+
+    def add_module_stats(self, stats: list):
+        pass
+
+    def enable_activation_cache(self, cut_points: list = None, memory_limit_mb: float = 1024,
+                                spill_dir: str = None):
+        """Caches the outputs of the given top level children, see activation_cache.py"""
+        self.disable_activation_cache()
+        self.activation_cache = ActivationCache(self, cut_points, memory_limit_mb, spill_dir)
+        return self.activation_cache
+
+    def disable_activation_cache(self):
+        if self.activation_cache is not None:
+            self.activation_cache.remove()
+            self.activation_cache = None
+
     def load_parameters(self, filename: str):
         self.base_model.load_state_dict(
             torch.load(filename, map_location=self.device))
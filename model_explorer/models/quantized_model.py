@@ -5,6 +5,7 @@ import pandas as pd
 
 from tqdm import tqdm
 from torch import nn as torch_nn
+from torch.nn import functional as F
 
 from torch.utils.data import DataLoader
 
@@ -15,6 +16,86 @@ from pytorch_quantization.tensor_quant import QuantDescriptor
 
 from model_explorer.exploration.weighting_functions import bits_weighted_linear
 from model_explorer.models.custom_model import CustomModel
+from model_explorer.models.compact_quantization import CompactQuantizationBackend
+from model_explorer.models.weight_cache import QuantizedWeightCache
+
+
+def _interpolate_energy(bits: np.ndarray, table_bits: np.ndarray, table_energy: np.ndarray) -> np.ndarray:
+    """Piecewise linear interpolation of a bits -> energy table. Zero bits
+    cost no energy and beyond the largest bit width of the table the energy
+    grows proportionally to the bits.
+    """
+    table_bits = np.concatenate([[0.0], table_bits])
+    table_energy = np.concatenate([[0.0], table_energy])
+
+    energy = np.interp(bits, table_bits, table_energy)
+    above = bits > table_bits[-1]
+    energy[above] = table_energy[-1] * bits[above] / table_bits[-1]
+    return energy
+
+
+def _combine_energy_tables(tables: list) -> tuple:
+    """Sums several bits -> energy tables into one, which is exact as all
+    tables are piecewise linear between their bit widths.
+    """
+    if len(tables) == 0:
+        return np.array([16.0]), np.zeros(1)
+
+    points = np.unique(np.concatenate([bits for bits, _ in tables]))
+    energy = sum(_interpolate_energy(points, bits, table_energy) for bits, table_energy in tables)
+    return points, energy
+
+
+def _population_fake_quant(quantizer: quant_nn.TensorQuantizer, inputs: torch.Tensor,
+                           num_bits: torch.Tensor) -> torch.Tensor:
+    """Fake quantization of a TensorQuantizer with one bit width per slice of
+    the leading population dimension, num_bits is broadcastable to inputs.
+    """
+    if quantizer._disabled or not quantizer._if_quant:
+        return inputs
+
+    num_bits = num_bits.to(inputs.device)
+    amax = quantizer.amax
+    if amax is None:
+        # dynamic range of each individual's slice
+        amax = inputs.detach().abs().flatten(1).max(dim=1).values.view(-1, *[1] * (inputs.dim() - 1))
+    amax = amax.to(inputs.device)
+
+    max_bound = torch.pow(2.0, num_bits - 1 + int(quantizer._unsigned)) - 1.0
+    if quantizer._unsigned:
+        min_bound = torch.zeros_like(max_bound)
+    elif quantizer._narrow_range:
+        min_bound = -max_bound
+    else:
+        min_bound = -max_bound - 1.0
+
+    scale = max_bound / amax
+    scale = torch.where(amax <= 1.0 / (1 << 24), torch.ones_like(scale), scale)
+
+    outputs = torch.min(torch.max((inputs * scale).round(), min_bound), max_bound)
+    return outputs / scale
+
+
+def _population_conv_forward(module: quant_nn.QuantConv2d, input_bits: torch.Tensor, weight_bits: torch.Tensor,
+                             population_size: int, inputs: torch.Tensor) -> torch.Tensor:
+    """Forward pass of a QuantConv2d for a population batch, the individuals
+    are the groups of one grouped convolution.
+    """
+    inputs = inputs.view(population_size, -1, *inputs.shape[1:])
+    batch_size = inputs.size(1)
+
+    quant_inputs = _population_fake_quant(module._input_quantizer, inputs, input_bits)
+    quant_weights = _population_fake_quant(module._weight_quantizer, module.weight[None], weight_bits)
+    quant_weights = quant_weights.expand(population_size, *module.weight.shape)
+
+    quant_inputs = quant_inputs.transpose(0, 1).reshape(batch_size, -1, *inputs.shape[3:])
+    bias = module.bias.repeat(population_size) if module.bias is not None else None
+
+    outputs = F.conv2d(quant_inputs, quant_weights.reshape(-1, *module.weight.shape[1:]), bias,
+                       module.stride, module.padding, module.dilation, module.groups * population_size)
+
+    outputs = outputs.view(batch_size, population_size, -1, *outputs.shape[2:]).transpose(0, 1)
+    return outputs.reshape(-1, *outputs.shape[2:])
 
 
 class QuantizedModel(CustomModel):
@@ -37,6 +118,13 @@ class QuantizedModel(CustomModel):
         self.input_quantizers = []
         self.weight_quantizers = []
 
+        # forward functions replaced while the population mode is enabled
+        self._population_forwards = {}
+
+        # see enable_compact_quantization and enable_weight_cache
+        self.compact_backend = None
+        self.weight_cache = None
+
         # supposingly this is not going to change
         self._create_quantized_model()
 
@@ -60,39 +148,127 @@ class QuantizedModel(CustomModel):
         # Update Model ...
         for i, module in enumerate(self.explorable_modules):
             module.num_bits = new_bit_widths[i]
+        if self.compact_backend is not None:
+            self.compact_backend.set_bit_widths(new_bit_widths)
 
         self._bit_widths = new_bit_widths
 
     def get_explorable_parameter_count(self) -> int:
         return len(self.explorable_modules)
 
+    def get_explorable_parameters(self) -> list:
+        return [module.num_bits for module in self.explorable_modules]
+
     def get_bit_weighted(self) -> int:
         return self.weighting_function(self.explorable_modules,
                                        self.explorable_module_names)
 
     def get_forward_pass_dram_energy(self) -> float:
-        dram_energy_sum = 0.0
-        i = 0
-
-        for name, module in self.base_model.named_modules():
-            if isinstance(module, quant_nn.QuantConv2d):
-                w_bits = module._weight_quantizer.num_bits
-                i_bits = module._input_quantizer.num_bits
+        bit_widths = np.array(self.get_explorable_parameters(), dtype=np.float64)
+        return float(self.get_population_dram_energy(bit_widths[None, :])[0])
 
-                if i > 0:
-                    dram_energy_sum += self.dram_data[i-1]['o_energy'] * (i_bits / 16)
+    def get_population_dram_energy(self, bit_widths: np.ndarray) -> np.ndarray:
+        """Computes the DRAM energy of a forward pass for a whole population
+        at once, without changing the model.
 
-                dram_energy_sum += self.dram_data[i]['i_energy'] * (i_bits / 16)
-                dram_energy_sum += self.dram_data[i]['w_energy'] * (w_bits / 16)
+        Args:
+            bit_widths (np.ndarray): [individuals, explorable modules] bit widths
 
-                # Last layer has always 16 bit
-                if i == len(self.dram_data) - 1:
-                    dram_energy_sum += self.dram_data[i]['o_energy'] * 1
-
-                i += 1
+        Returns:
+            np.ndarray: energy of each individual in uJ
+        """
+        bit_widths = np.asarray(bit_widths, dtype=np.float64)
+        dram_energy = np.full(len(bit_widths), self.dram_energy_constant)
+        for i, (table_bits, table_energy) in enumerate(self.dram_energy_tables):
+            dram_energy += _interpolate_energy(bit_widths[:, i], table_bits, table_energy)
 
         # Timeloop works with pJ as unit, for convenience we use uJ from here on
-        return dram_energy_sum / 1_000_000
+        return dram_energy / 1_000_000
+
+    def _population_convolutions(self) -> list:
+        """QuantConv2d modules whose forward is replaced in population mode"""
+        return [module for module in self.base_model.modules()
+                if isinstance(module, quant_nn.QuantConv2d) and module.padding_mode == 'zeros']
+
+    def supports_population_mode(self) -> bool:
+        # every explorable quantizer has to apply per individual bit widths,
+        # others (e.g. of linear layers) would use one bit width for the whole population
+        patched = {id(quantizer) for module in self._population_convolutions()
+                   for quantizer in [module._input_quantizer, module._weight_quantizer]}
+        return all(id(module) in patched for module in self.explorable_modules)
+
+    def in_population_mode(self) -> bool:
+        return len(self._population_forwards) > 0
+
+    def enable_population_mode(self, bit_widths):
+        """Evaluates several bit width configurations in one forward pass. The
+        model then expects the input batch replicated once per individual
+        along the batch axis (individual-major), every quantizer applies the
+        bit width of the individual to its slice of the batch.
+
+        Args:
+            bit_widths: [individuals, explorable modules] bit widths
+        """
+        self.disable_population_mode()
+
+        bit_widths = torch.as_tensor(np.asarray(bit_widths, dtype=np.float32), device=self.device)
+        population_size = bit_widths.shape[0]
+        module_index = {id(module): i for i, module in enumerate(self.explorable_modules)}
+
+        assert self.supports_population_mode(), \
+            "The population mode only supports explorable quantizers of zero padded QuantConv2d modules"
+
+        for module in self._population_convolutions():
+            input_bits = bit_widths[:, module_index[id(module._input_quantizer)]].view(-1, 1, 1, 1, 1)
+            weight_bits = bit_widths[:, module_index[id(module._weight_quantizer)]].view(-1, 1, 1, 1, 1)
+
+            # an instance forward (e.g. of the activation cache) is restored afterwards
+            self._population_forwards[module] = module.__dict__.get('forward', None)
+            module.forward = functools.partial(_population_conv_forward, module, input_bits, weight_bits,
+                                               population_size)
+
+    def disable_population_mode(self):
+        for module, forward in self._population_forwards.items():
+            if forward is None:
+                del module.forward
+            else:
+                module.forward = forward
+        self._population_forwards = {}
+
+    def enable_compact_quantization(self):
+        """Runs the fake quantization of all calibrated quantizers through the
+        compact backend, see compact_quantization.py. The quantizers keep
+        their num_bits, which is still read by the weighting functions.
+        """
+        assert self.weight_cache is None, "the compact backend has to be enabled before the weight cache"
+        self.disable_compact_quantization()
+        self.compact_backend = CompactQuantizationBackend(self.explorable_modules)
+        self.compact_backend.attach()
+
+    def disable_compact_quantization(self):
+        if self.compact_backend is not None:
+            assert self.weight_cache is None, "the weight cache has to be disabled before the compact backend"
+            self.compact_backend.detach()
+            self.compact_backend = None
+
+    def enable_weight_cache(self, memory_limit_mb: float = 256, dtype: str = 'float32'):
+        """Stores the quantized weights per layer and bit width, forward
+        passes then only quantize the activations, see weight_cache.py.
+        """
+        self.disable_weight_cache()
+        self.weight_cache = QuantizedWeightCache(self.weight_quantizers, memory_limit_mb, dtype)
+        return self.weight_cache
+
+    def disable_weight_cache(self):
+        if self.weight_cache is not None:
+            self.weight_cache.remove()
+            self.weight_cache = None
+
+    def load_parameters(self, filename: str):
+        super().load_parameters(filename)
+        # amax values may have changed
+        if self.weight_cache is not None:
+            self.weight_cache.clear()
 
     def enable_quantization(self):
         [module.enable_quant() for module in self.explorable_modules]
@@ -101,17 +277,45 @@ class QuantizedModel(CustomModel):
         [module.disable_quant() for module in self.explorable_modules]
 
     def _build_energy_model(self, fn) -> None:
+        """Builds a bits -> DRAM energy table for every explorable module from
+        the Timeloop analysis. The analysis holds one row per layer and mapped
+        bit width, the energy of a forward pass is then the sum of the
+        interpolated tables. An analysis mapped at a single bit width results
+        in the energy growing linearly with the bits.
+        """
         dram_data_df = pd.read_csv(fn)
-        self.dram_data = {}
-        for i, row in dram_data_df.iterrows():
-            # realign values to 16 bit
-            scale_factor = 16 / row['bitwidth']
 
-            self.dram_data[i] = {
-                'w_energy': (row['w_reads'] + row['w_updates'] + row['w_fills']) * row['w_energy'] * scale_factor,
-                'i_energy': (row['i_reads'] + row['i_updates'] + row['i_fills']) * row['i_energy'] * scale_factor,
-                'o_energy': (row['o_reads'] + row['o_updates'] + row['o_fills']) * row['o_energy'] * scale_factor
-            }
+        # bits -> energy of the weight, input and output accesses of each layer
+        layer_tables = []
+        for _, layer_df in dram_data_df.groupby('layer_idx', sort=True):
+            layer_df = layer_df.sort_values('bitwidth')
+            energies = {}
+            for kind in ['w', 'i', 'o']:
+                accesses = (layer_df[f'{kind}_reads'] + layer_df[f'{kind}_updates'] +
+                            layer_df[f'{kind}_fills']).to_numpy()
+                energies[kind] = accesses * layer_df[f'{kind}_energy'].to_numpy()
+            layer_tables.append((layer_df['bitwidth'].to_numpy(dtype=np.float64), energies))
+
+        # the layers of the analysis follow the order of the quantized convolutions
+        module_index = {id(module): i for i, module in enumerate(self.explorable_modules)}
+        quant_convs = [module for module in self.base_model.modules() if isinstance(module, quant_nn.QuantConv2d)]
+        assert len(quant_convs) == len(layer_tables), "DRAM analysis does not match the quantized layers"
+
+        module_tables = [[] for _ in self.explorable_modules]
+        for i, module in enumerate(quant_convs):
+            bits, energies = layer_tables[i]
+            # inputs are read as outputs of the previous layer and read again by this layer
+            module_tables[module_index[id(module._input_quantizer)]].append((bits, energies['i']))
+            if i > 0:
+                prev_bits, prev_energies = layer_tables[i - 1]
+                module_tables[module_index[id(module._input_quantizer)]].append((prev_bits, prev_energies['o']))
+            module_tables[module_index[id(module._weight_quantizer)]].append((bits, energies['w']))
+
+        self.dram_energy_tables = [_combine_energy_tables(tables) for tables in module_tables]
+
+        # Last layer has always 16 bit
+        last_bits, last_energies = layer_tables[-1]
+        self.dram_energy_constant = float(_interpolate_energy(np.array([16.0]), last_bits, last_energies['o'])[0])
 
     def _create_quantized_model(self) -> None:
         for name, module in self.base_model.named_modules():
@@ -161,6 +365,7 @@ class QuantizedModel(CustomModel):
                                   calib_method='histogram', **kwargs):
         assert calib_method in ['max', 'histogram'], "method has to be either max or histogram"
         assert 'method' in kwargs, "you have to specify a method for quantization calibration"
+        assert self.compact_backend is None, "calibration requires the pytorch_quantization backend"
 
         self.base_model.to(self.device)
 
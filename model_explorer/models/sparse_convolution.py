@@ -1,13 +1,21 @@
+import math
 import torch
 
 from torch import nn
 
+# upper bound of unfolded input elements the fused mode materializes at once
+FUSED_CHUNK_ELEMENTS = 2**24
+
 
 class SparseConv2d(nn.Conv2d):
     """Sparse convolution module that splits the im2col representation of the forwarded input
     into blocks of the provided block sizes. The mean of each block is then compared to a
     pre-set threshold. If the mean is smaller than the threshold the block is set to zero.
     Otherwise the block will remain unchanged.
+
+    The conv_mode 'im2col' builds the full unfolded input, 'fused' computes the
+    block means with a convolution over the input and never materializes the
+    complete unfolded tensor.
     """
 
     def __init__(self,
@@ -30,10 +38,15 @@ class SparseConv2d(nn.Conv2d):
         self.block_height = block_size[1]
 
         self.collect_details = kwargs.get('collect_details', True)
+        self.conv_mode = kwargs.get('conv_mode', 'im2col')
+        assert self.conv_mode in ['im2col', 'fused'], "conv_mode has to be either im2col or fused"
+
+        # 0/1 kernel that sums the im2col columns of each column block, built on first use
+        self._block_indicator = None
 
         # Metrics and evaluation stats
-        self.sparse_present: float = 0.0
-        self.sparse_created: float = 0.0
+        self.sparse_present: int = 0
+        self.sparse_created: int = 0
         self.min_of_blocks: float = -torch.inf
         self.max_of_blocks: float = torch.inf
         self.number_of_blocks_w: int = 0
@@ -48,8 +61,8 @@ class SparseConv2d(nn.Conv2d):
         self._threshold = new_threshold
 
     def reset_stats(self):
-        self.sparse_present = 0.0
-        self.sparse_created = 0.0
+        self.sparse_present = 0
+        self.sparse_created = 0
         self.min_of_blocks = -torch.inf
         self.max_of_blocks = torch.inf
         self.number_of_blocks_w: int = 0
@@ -61,54 +74,35 @@ class SparseConv2d(nn.Conv2d):
         return s.format(**self.__dict__)
 
     def forward(self, x) -> torch.Tensor:
+        if self.conv_mode == 'fused':
+            return self._fused_conv(x)
         return self._custom_conv(x)
 
-    def _tensor_to_blocks(self, tensor) -> torch.Tensor:
-        return tensor.unfold(0, self.block_height,
-                             self.block_height).unfold(1, self.block_width,
-                                                       self.block_width)
-
-    def _blocks_to_tensor(self, blocks, padded_width, padded_height) -> torch.Tensor:
-        return blocks.permute(0, 2, 1, 3).view(padded_height, padded_width)
-
     def _apply_sparsity(self, blocks) -> torch.Tensor:
-        num_sparse_before = 0
-        num_sparse_produced = 0
-
-        # torch.nanmean(blocks, 2) -> each block replaced with mean
-        # use this to speed up
+        """Zeroes all blocks whose absolute mean is below the threshold. Works
+        in place on a [batch, blocks_h, block_height, blocks_w, block_width]
+        view, statistics are accumulated as tensors to avoid host syncs.
+        """
+        # mean of each block, the nan padding is ignored
+        mean_blocks = torch.abs(torch.nanmean(blocks, (2, 4)))
 
-        mean_blocks = torch.abs(torch.nanmean(blocks, (2, 3)))
         if self.collect_details:
-            # mean_of_block_means = torch.nanmean(mean_blocks)
-            min_of_blocks = torch.min(blocks)
-            max_of_blocks = torch.max(blocks)
-        else:
-            # mean_of_block_means = 0
-            min_of_blocks = 0
-            max_of_blocks = 0
+            # fmax / fmin ignore the nan padding just like comparing floats with nan
+            self.max_of_blocks = torch.fmax(torch.as_tensor(self.max_of_blocks, device=blocks.device),
+                                            torch.max(blocks))
+            self.min_of_blocks = torch.fmin(torch.as_tensor(self.min_of_blocks, device=blocks.device),
+                                            torch.min(blocks))
 
         # count how many sparse blocks are already present
-        num_sparse_before = (mean_blocks == 0).sum()
-
-        if torch.cuda.is_available():
-            blocks[mean_blocks < self._threshold,
-                   ...] = torch.cuda.FloatTensor(self.block_height,
-                                                 self.block_width).fill_(0)
-        else:
-            blocks[mean_blocks < self._threshold, ...] = torch.zeros(
-                (self.block_height, self.block_width))
-
-        mean_blocks = torch.abs(torch.nanmean(blocks, (2, 3)))
+        sparse_before = mean_blocks == 0
+        sparse_mask = mean_blocks < self._threshold
 
-        # count how many sparse blocks are present after sparsity operation
-        num_sparse_produced = (mean_blocks == 0).sum() - num_sparse_before
+        blocks.masked_fill_(sparse_mask[:, :, None, :, None], 0)
 
-        # gather statistics for later evaluation
-        self.sparse_created += num_sparse_produced.item()
-        self.sparse_present += num_sparse_before.item()
-        self.max_of_blocks = max(self.max_of_blocks, max_of_blocks)
-        self.min_of_blocks = min(self.min_of_blocks, min_of_blocks)
+        # zeroed blocks have a mean of 0 afterwards, hence all of them that
+        # were not sparse before have been produced by the sparsity operation
+        self.sparse_created = self.sparse_created + (sparse_mask & ~sparse_before).sum()
+        self.sparse_present = self.sparse_present + sparse_before.sum()
 
         return blocks
 
@@ -182,21 +176,130 @@ class SparseConv2d(nn.Conv2d):
             inp_unf, (0, padding_right, 0, padding_bottom), "constant",
             torch.nan)
 
-        # perform sparcity analysis for every batch
-        # FIXME: is this the most efficient way?
-        for batch in range(inp_unf.size(0)):
+        # the padded tensor is split into blocks of all samples at once, the
+        # view shares the memory, so zeroing blocks changes inp_unf in place
+        inp_unf = inp_unf.contiguous()
+        blocks = inp_unf.view(inp_unf.size(0),
+                              padded_height // self.block_height, self.block_height,
+                              padded_width // self.block_width, self.block_width)
 
-            im2col_2dtensor = inp_unf[batch]
-
-            blocks = self._tensor_to_blocks(im2col_2dtensor)
-
-            sparse_blocks = self._apply_sparsity(blocks)
-
-            inp_unf[batch] = self._blocks_to_tensor(sparse_blocks,
-                                                    padded_width,
-                                                    padded_height)
+        self._apply_sparsity(blocks)
 
         # remove padding
         output_unpadded = inp_unf[:, :original_height, :original_width]
 
         return output_unpadded
+
+    def _get_block_indicator(self, inp) -> torch.Tensor:
+        """Returns a [column_blocks, in_channels, kh, kw] kernel with a one
+        wherever the im2col column (channel major, like the kernel view) belongs
+        to the column block.
+        """
+        if (self._block_indicator is None or self._block_indicator.device != inp.device
+                or self._block_indicator.dtype != inp.dtype):
+            n_cols = self.in_channels * self.kernel_size[0] * self.kernel_size[1]
+            n_col_blocks = math.ceil(n_cols / self.block_width)
+
+            columns = torch.arange(n_cols, device=inp.device)
+            indicator = torch.zeros(n_col_blocks, n_cols, device=inp.device, dtype=inp.dtype)
+            indicator[columns // self.block_width, columns] = 1
+            self._block_indicator = indicator.view(n_col_blocks, self.in_channels, *self.kernel_size)
+
+        return self._block_indicator
+
+    def _fused_sparse_mask(self, inp) -> torch.Tensor:
+        """Computes which im2col blocks are zeroed without unfolding the input.
+        The sums of all column blocks are obtained with a convolution of the
+        input with a 0/1 kernel, afterwards rows are summed up to blocks. The
+        block sizes at the borders are known, which gives the same means as the
+        nan padding of the im2col mode.
+
+        Returns:
+            torch.Tensor: bool mask of shape [batch, blocks_h, blocks_w]
+        """
+        batch_size = inp.size(0)
+        n_cols = self.in_channels * self.kernel_size[0] * self.kernel_size[1]
+
+        column_sums = nn.functional.conv2d(inp, self._get_block_indicator(inp), None,
+                                           self.stride, self.padding, self.dilation)
+        column_sums = column_sums.flatten(2)
+        n_rows, n_col_blocks = column_sums.size(2), column_sums.size(1)
+        n_row_blocks = math.ceil(n_rows / self.block_height)
+
+        column_sums = nn.functional.pad(column_sums, (0, n_row_blocks * self.block_height - n_rows))
+        block_sums = column_sums.view(batch_size, n_col_blocks, n_row_blocks, self.block_height).sum(3)
+        block_sums = block_sums.transpose(1, 2)
+
+        # number of valid elements per block, only the last row and column of blocks can be smaller
+        rows = torch.clamp(n_rows - torch.arange(n_row_blocks, device=inp.device) * self.block_height,
+                           max=self.block_height)
+        cols = torch.clamp(n_cols - torch.arange(n_col_blocks, device=inp.device) * self.block_width,
+                           max=self.block_width)
+        mean_blocks = torch.abs(block_sums / (rows[:, None] * cols[None, :]))
+
+        if self.collect_details:
+            # the im2col entries are input values and the zeros of the padding
+            inp_max, inp_min = torch.max(inp), torch.min(inp)
+            if any(self.padding):
+                inp_max, inp_min = torch.clamp(inp_max, min=0), torch.clamp(inp_min, max=0)
+            self.max_of_blocks = torch.fmax(torch.as_tensor(self.max_of_blocks, device=inp.device), inp_max)
+            self.min_of_blocks = torch.fmin(torch.as_tensor(self.min_of_blocks, device=inp.device), inp_min)
+
+        sparse_before = mean_blocks == 0
+        sparse_mask = mean_blocks < self._threshold
+
+        self.sparse_created = self.sparse_created + (sparse_mask & ~sparse_before).sum()
+        self.sparse_present = self.sparse_present + sparse_before.sum()
+
+        return sparse_mask
+
+    def _fused_conv(self, inp) -> torch.Tensor:
+        """Same result as _custom_conv, but the unfolded input is never built
+        completely. For pointwise convolutions every input element appears in
+        exactly one im2col entry, so the mask is applied to the input and a
+        native convolution is used. Other kernels are unfolded in slabs of
+        output rows that are masked and multiplied one after another.
+        """
+        batch_size = inp.size(0)
+        kh, kw = self.kernel_size
+        sparse_mask = self._fused_sparse_mask(inp)
+
+        if (kh, kw) == (1, 1) and not any(self.padding):
+            # only every stride-th pixel is read by the convolution
+            inp = inp[:, :, ::self.stride[0], ::self.stride[1]]
+            h_out, w_out = inp.size(2), inp.size(3)
+
+            # expand the block mask to [batch, rows (pixels), columns (channels)]
+            element_mask = sparse_mask.repeat_interleave(self.block_height, 1)[:, :h_out * w_out]
+            element_mask = element_mask.repeat_interleave(self.block_width, 2)[:, :, :self.in_channels]
+            element_mask = element_mask.transpose(1, 2).reshape(inp.shape)
+
+            return nn.functional.conv2d(inp.masked_fill(element_mask, 0), self.kernel, self.bias)
+
+        h_out = (inp.size(2) + 2 * self.padding[0] - self.dilation[0] * (kh - 1) - 1) // self.stride[0] + 1
+        w_out = (inp.size(3) + 2 * self.padding[1] - self.dilation[1] * (kw - 1) - 1) // self.stride[1] + 1
+        n_cols = self.in_channels * kh * kw
+
+        inp = nn.functional.pad(inp, (self.padding[1], self.padding[1], self.padding[0], self.padding[0]))
+        kernel = self.kernel.view(self.kernel.size(0), -1).t()
+        column_mask = sparse_mask.repeat_interleave(self.block_width, 2)[:, :, :n_cols]
+
+        rows_per_chunk = max(1, FUSED_CHUNK_ELEMENTS // (batch_size * n_cols * w_out))
+        out_chunks = []
+        for row_start in range(0, h_out, rows_per_chunk):
+            row_end = min(h_out, row_start + rows_per_chunk)
+            input_rows = inp[:, :, row_start * self.stride[0]:
+                             (row_end - 1) * self.stride[0] + self.dilation[0] * (kh - 1) + 1]
+            inp_unf = nn.functional.unfold(input_rows, self.kernel_size, self.dilation, 0, self.stride)
+
+            # im2col rows of this chunk and the block row each of them belongs to
+            block_rows = torch.arange(row_start * w_out, row_end * w_out, device=inp.device) // self.block_height
+            inp_unf = inp_unf.transpose(1, 2).masked_fill(column_mask[:, block_rows], 0)
+            out_chunks.append(inp_unf.matmul(kernel))
+
+        out = torch.cat(out_chunks, 1).transpose(1, 2).reshape(batch_size, self.out_channels, h_out, w_out)
+
+        if self.bias is not None:
+            out = out + self.bias.view(1, -1, 1, 1)
+
+        return out
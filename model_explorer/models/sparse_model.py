@@ -13,7 +13,7 @@ class SparseModel(CustomModel):
     """
 
     def __init__(self, base_model: nn.Module, block_size: list, device: torch.device,
-                 collect_sparsity_details: bool = True):
+                 collect_sparsity_details: bool = True, conv_mode: str = 'im2col'):
         super().__init__(base_model, device)
 
         self._thresholds = {}
@@ -21,6 +21,7 @@ class SparseModel(CustomModel):
         # For now, block size cannot be changed dynamically
         assert len(block_size) == 2, "block size parameter has to be a list with 2 elements: width and height"
         self._block_size = block_size
+        self._conv_mode = conv_mode
         self._create_sparse_model()
 
     @property
@@ -36,10 +37,23 @@ class SparseModel(CustomModel):
         self._thresholds = new_thresholds
 
     def get_total_created_sparse_blocks(self) -> int:
-        return sum([module.sparse_created for module in self.explorable_modules])
+        # modules accumulate their counts as tensors, convert them once here
+        return int(sum([module.sparse_created for module in self.explorable_modules]))
 
     def get_total_present_sparse_blocks(self) -> int:
-        return sum([module.sparse_present for module in self.explorable_modules])
+        return int(sum([module.sparse_present for module in self.explorable_modules]))
+
+    def get_explorable_parameters(self) -> list:
+        return [module.threshold for module in self.explorable_modules]
+
+    def get_module_stats(self) -> list:
+        return [(module.sparse_created, module.sparse_present) for module in self.explorable_modules]
+
+    def add_module_stats(self, stats: list):
+        for module, module_stats in zip(self.explorable_modules, stats):
+            if module_stats is not None:
+                module.sparse_created = module.sparse_created + module_stats[0]
+                module.sparse_present = module.sparse_present + module_stats[1]
 
     def reset_model_stats(self):
         [module.reset_stats() for module in self.explorable_modules]
@@ -48,7 +62,8 @@ class SparseModel(CustomModel):
         for name, module in self.base_model.named_modules():
             if isinstance(module, nn.Conv2d):
                 self.thresholds[name] = 0.0
-                sparse_conv = SparseConv2d(module, self._block_size) #, self._collect_sparsity_details)
+                sparse_conv = SparseConv2d(module, self._block_size,
+                                           conv_mode=self._conv_mode) #, self._collect_sparsity_details)
                 self.explorable_modules.append(sparse_conv)
                 self.explorable_module_names.append(name)
 
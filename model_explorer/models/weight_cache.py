@@ -0,0 +1,91 @@
+import torch
+import functools
+
+from collections import OrderedDict
+
+
+class QuantizedWeightCache:
+    """Keeps the fake quantized weights of every QuantConv2d per bit width.
+    The weights do not change during an exploration, hence a weight quantizer
+    only runs once per (layer, bit width) and afterwards returns the stored
+    tensor. The least recently used entries are evicted once the memory limit
+    is exceeded. Entries can be stored as float16 to halve the memory, this is
+    lossy: the cached values are integers times a scale, which float16 rounds
+    unless the scale is a power of two, and small weights become subnormal.
+
+    The cache is only used without gradients, i.e. not while retraining.
+    Entries are keyed on the storage and the version of the weight tensor,
+    weights updated in place (optimizer steps, loading a state dict) or
+    replaced by a new tensor therefore never hit stale entries. It has to be
+    cleared if only the amax values change.
+    """
+
+    def __init__(self, weight_quantizers: list, memory_limit_mb: float = 256, dtype: str = 'float32') -> None:
+        assert dtype in ['float32', 'float16'], "The weight cache stores either float32 or float16"
+
+        self.weight_quantizers = weight_quantizers
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self.dtype = getattr(torch, dtype)
+
+        self._entries = OrderedDict()
+        self._memory_used = 0
+
+        # statistics
+        self.hits = 0
+        self.requests = 0
+
+        self._original_forwards = {}
+        for i, quantizer in enumerate(self.weight_quantizers):
+            # the previous instance forward (e.g. of the compact backend) is wrapped and restored by remove()
+            self._original_forwards[i] = quantizer.__dict__.get('forward', None)
+            quantizer.forward = functools.partial(self._forward, i, quantizer.forward)
+
+    def remove(self):
+        """Restores the original forward methods and drops all entries"""
+        for i, forward in self._original_forwards.items():
+            if forward is None:
+                del self.weight_quantizers[i].forward
+            else:
+                self.weight_quantizers[i].forward = forward
+        self._original_forwards = {}
+        self.clear()
+
+    def clear(self):
+        self._entries.clear()
+        self._memory_used = 0
+
+    def hit_rate(self) -> float:
+        return self.hits / self.requests if self.requests > 0 else 0.0
+
+    def reset_statistics(self):
+        self.hits = 0
+        self.requests = 0
+
+    def _forward(self, i: int, forward: callable, inputs: torch.Tensor) -> torch.Tensor:
+        quantizer = self.weight_quantizers[i]
+        if torch.is_grad_enabled() or quantizer._disabled or not quantizer._if_quant:
+            return forward(inputs)
+
+        self.requests += 1
+        key = (i, int(quantizer.num_bits), inputs.device, inputs.data_ptr(), inputs._version)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry.to(inputs.dtype)
+
+        outputs = forward(inputs)
+        self._insert(key, outputs.detach().to(self.dtype))
+        return outputs
+
+    def _insert(self, key: tuple, weights: torch.Tensor):
+        size = weights.numel() * weights.element_size()
+        if size > self.memory_limit:
+            return
+
+        self._entries[key] = weights
+        self._memory_used += size
+
+        while self._memory_used > self.memory_limit:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_used -= evicted.numel() * evicted.element_size()
@@ -1,8 +1,13 @@
+import inspect
+
 from typing import Union
 
+from model_explorer.utils.logger import logger
+
 from model_explorer.problems.evaluation_functions import ElementwiseEvaluationFunctionWithIndex, \
         LoopedElementwiseEvaluationWithIndex
 from model_explorer.models.custom_model import CustomModel
+from model_explorer.utils.sequential_testing import SequentialAccuracyTest
 
 from pymoo.core.problem import ElementwiseProblem
 
@@ -14,6 +19,10 @@ class CustomExplorationProblem(ElementwiseProblem):
     simply inherit from this class and can be explored seamlessly.
     """
 
+    # the accuracy is only a constraint, problems with an accuracy objective
+    # cannot stop early since their individuals would not be comparable
+    supports_early_termination = True
+
     def __init__(self, model: CustomModel, accuracy_function: callable,
                  progress: bool, min_accuracy: Union[list, float], elementwise: bool = True,
                  **kwargs: dict):
@@ -27,3 +36,118 @@ class CustomExplorationProblem(ElementwiseProblem):
         self.progress = progress
         self.min_accuracy = min_accuracy
         self.accuracy_function = accuracy_function
+
+        # optional cache in front of _evaluate, see evaluation_cache.py
+        self.evaluation_cache = None
+
+        # settings of the sequential accuracy test, None evaluates all samples
+        self.early_termination = None
+
+        # optional screening stage of the multi-fidelity evaluation, see multi_fidelity.py
+        self.screening = None
+        # optional surrogate that skips surely infeasible offspring, see surrogate.py
+        self.surrogate = None
+        # 'screening' while the runner scores individuals on the screening subset
+        self.fidelity = 'full'
+
+        # individuals evaluated together in one forward pass, see evaluate_population
+        self.population_size = 1
+        self.population_accuracy_function = None
+        self._population_accuracy = None
+
+        # extra outputs of _evaluate that are stored with the results
+        self.result_metadata_keys = ['n_samples']
+
+    def set_early_termination(self, settings: dict):
+        """Enables the sequential accuracy test of compute_accuracy.
+
+        Args:
+            settings (dict): early_termination settings from the workload
+            file, None evaluates all samples
+        """
+        if settings is not None:
+            if not self.supports_early_termination:
+                raise ValueError(f"{type(self).__name__} uses the accuracy as an objective, "
+                                 "early termination is not supported")
+            if 'early_termination' not in inspect.signature(self.accuracy_function).parameters:
+                name = getattr(self.accuracy_function, '__name__', self.accuracy_function)
+                raise ValueError(f"The accuracy function {name} does not support early termination")
+        self.early_termination = settings
+
+    def compute_accuracy(self, dataloader_generator, title: str = "") -> tuple:
+        """Runs the accuracy function of the problem. With early termination
+        the evaluation stops as soon as the accuracy constraint is surely
+        violated or surely satisfied by the configured margin.
+
+        Args:
+            dataloader_generator (DataLoaderGenerator): the evaluated dataset,
+            replaced by the screening subset during the screening stage
+            title (str, optional): title of the progress bar
+
+        Returns:
+            tuple: the accuracy result and the number of samples used
+        """
+        # already computed for the whole population
+        if self._population_accuracy is not None:
+            return self._population_accuracy
+
+        if self.fidelity == 'screening':
+            dataloader_generator = self.screening.dataloader_generator
+            title = f"Screening {title}"
+
+        # multiple accuracy constraints are always evaluated completely
+        if self.early_termination is None or isinstance(self.min_accuracy, list):
+            accuracy = self.accuracy_function(self.model.base_model, dataloader_generator,
+                                              progress=self.progress, title=title)
+            return accuracy, len(dataloader_generator)
+
+        test = SequentialAccuracyTest(self.min_accuracy, **self.early_termination)
+        accuracy = self.accuracy_function(self.model.base_model, dataloader_generator,
+                                          progress=self.progress, title=title, early_termination=test)
+        if test.decision is not None:
+            logger.debug(f"\tStopped early after {test.n_samples} samples, constraint {test.decision}")
+
+        return accuracy, test.n_samples
+
+    def supports_population_evaluation(self) -> bool:
+        return self.population_size > 1 and self.population_accuracy_function is not None and \
+            self.model.supports_population_mode()
+
+    def evaluate_population(self, indices: list, X, *args, **kwargs) -> list:
+        """Evaluates several individuals with one forward pass per batch, the
+        model runs in population mode on the batch replicated per individual.
+        The outputs are then set by _evaluate of each individual with the
+        precomputed accuracy. All samples are evaluated, i.e. there is no
+        early termination.
+
+        Args:
+            indices (list): index of each individual in the generation
+            X: [individuals, n_var] parameters
+
+        Returns:
+            list: the outputs of each individual
+        """
+        self.fidelity = kwargs.get('fidelity', 'full')
+        dataloader_generator = self.dataloader_generator
+        if self.fidelity == 'screening':
+            dataloader_generator = self.screening.dataloader_generator
+
+        self.model.enable_population_mode(X)
+        try:
+            accuracies = self.population_accuracy_function(
+                self.model.base_model, dataloader_generator, len(X), progress=self.progress,
+                title="Evaluating {}-{}".format(indices[0] + 1, indices[-1] + 1))
+        finally:
+            self.model.disable_population_mode()
+
+        results = []
+        for i, x, accuracy in zip(indices, X, accuracies):
+            self._population_accuracy = (accuracy, len(dataloader_generator))
+            out = dict()
+            try:
+                self._evaluate(i, x, out, *args, **kwargs)
+            finally:
+                self._population_accuracy = None
+            results.append(out)
+
+        return results
@@ -57,6 +57,16 @@ def init_quant_model(model: nn.Module, device: torch.device,
         logger.debug(f"Loading calibration file: {calibration_file}")
         qmodel.load_parameters(calibration_file)
 
+    if kwargs.get('quantization_backend', 'pytorch_quantization') == 'compact':
+        qmodel.enable_compact_quantization()
+        logger.debug("Using the compact quantization backend")
+
+    weight_cache_settings = kwargs.get('weight_cache', None)
+    if weight_cache_settings is not None:
+        qmodel.enable_weight_cache(memory_limit_mb=weight_cache_settings.get('memory_limit_mb', 256),
+                                   dtype=weight_cache_settings.get('dtype', 'float32'))
+        logger.debug("Caching quantized weights per bit width")
+
     return qmodel
 
 
@@ -144,10 +154,8 @@ class LayerwiseQuantizationProblem(CustomExplorationProblem):
         # assign new bit widths
         self.model.bit_widths = layer_bit_nums
 
-        accuracy_result = self.accuracy_function(
-            self.model.base_model,
+        accuracy_result, n_samples = self.compute_accuracy(
             self.dataloader_generator,
-            progress=self.progress,
             title="Evaluating {}/{}".format(index + 1, algorithm.pop_size)
         )
         f1_dram_energy_objective = self.model.get_forward_pass_dram_energy()
@@ -155,6 +163,7 @@ class LayerwiseQuantizationProblem(CustomExplorationProblem):
 
         # NOTE: In pymoo, each objective function is supposed to be minimized,
         # and each constraint needs to be provided in the form of <= 0
+        out["n_samples"] = n_samples
         out["F"] = [f1_dram_energy_objective]
 
         g1_accuracy_constraint = 0
@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+from model_explorer.utils.logger import logger
+
+# part of the context, entries of an older format (e.g. scalars stored as lists) are not reused
+CACHE_FORMAT_VERSION = 2
+
+
+class EvaluationCache:
+    """Stores the outputs (F, G, ...) of already evaluated individuals, keyed
+    on the repaired parameter vector and a context describing the problem and
+    the dataset. Individuals that were already scored in an earlier generation
+    or run are then not evaluated again.
+
+    With the disk backend every entry is written to its own small json file,
+    hence multiple processes (e.g. SLURM array jobs) can share one directory.
+    """
+
+    def __init__(self, context: dict, backend: str = 'memory', cache_dir: str = None) -> None:
+        assert backend in ['memory', 'disk'], "Cache backend has to be either memory or disk"
+        assert backend == 'memory' or cache_dir is not None, "The disk backend requires a cache directory"
+
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.context_hash = hashlib.sha1(
+            json.dumps([CACHE_FORMAT_VERSION, context], sort_keys=True, default=str).encode()).hexdigest()
+
+        self._entries = {}
+
+        # statistics of the current generation
+        self.hits = 0
+        self.requests = 0
+
+        if self.backend == 'disk':
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, x) -> str:
+        x_bytes = np.asarray(x, dtype=np.float64).tobytes()
+        return hashlib.sha1(self.context_hash.encode() + x_bytes).hexdigest()
+
+    def get(self, x) -> dict:
+        """Returns the stored output of an individual or None if it has not
+        been evaluated yet.
+        """
+        self.requests += 1
+        key = self.key(x)
+
+        entry = self._entries.get(key)
+        if entry is None and self.backend == 'disk':
+            entry = self._read_entry(key)
+            if entry is not None:
+                self._entries[key] = entry
+
+        if entry is None:
+            return None
+
+        self.hits += 1
+        # same shapes as a fresh evaluation: lists stay lists, scalars stay scalars
+        return {k: list(v) if isinstance(v, list) else v for k, v in entry.items()}
+
+    def put(self, x, out: dict):
+        key = self.key(x)
+        entry = {}
+        for k, v in out.items():
+            try:
+                value = np.asarray(v, dtype=np.float64)
+                entry[k] = value.item() if value.ndim == 0 else value.tolist()
+            except (TypeError, ValueError):
+                logger.debug(f"Evaluation cache skips non numeric output {k}")
+
+        self._entries[key] = entry
+        if self.backend == 'disk':
+            self._write_entry(key, entry)
+
+    def reset_statistics(self):
+        self.hits = 0
+        self.requests = 0
+
+    def hit_rate(self) -> float:
+        return self.hits / self.requests if self.requests > 0 else 0.0
+
+    def get_state(self) -> dict:
+        return {'context_hash': self.context_hash, 'entries': dict(self._entries)}
+
+    def set_state(self, state: dict):
+        """Adds the entries of a stored cache, they are ignored if the cache
+        was built for a different context.
+        """
+        if state['context_hash'] != self.context_hash:
+            logger.warning("Stored evaluation cache belongs to a different context, not restoring it")
+            return
+        self._entries.update(state['entries'])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _entry_file(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_entry(self, key: str) -> dict:
+        filename = self._entry_file(key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logger.warning(f"Could not read evaluation cache entry {filename}")
+            return None
+
+    def _write_entry(self, key: str, entry: dict):
+        filename = self._entry_file(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        # write to a temporary file first, so that concurrent readers never see partial entries
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(filename), suffix='.tmp', delete=False) as f:
+            json.dump(entry, f)
+        os.replace(f.name, filename)
+
+
+def build_evaluation_cache(settings: dict, context: dict) -> EvaluationCache:
+    """Creates the evaluation cache described in the evaluation section of the
+    exploration settings.
+
+    Args:
+        settings (dict): evaluation settings from the workload file, can be empty
+        context (dict): everything besides the parameters that influences the
+        evaluation result, e.g. problem, model and dataset settings
+
+    Returns:
+        EvaluationCache: the cache or None if caching is disabled
+    """
+    backend = settings.get('cache', None)
+    if backend is None or backend == 'none':
+        return None
+
+    return EvaluationCache(context, backend=backend, cache_dir=settings.get('cache_dir', None))
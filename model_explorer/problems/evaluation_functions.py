@@ -1,5 +1,16 @@
+import os
+import torch
+import numpy as np
+
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
 from tqdm import tqdm
 from model_explorer.utils.logger import logger
+from model_explorer.problems.evaluation_cache import EvaluationCache
+from model_explorer.problems.multi_fidelity import MultiFidelityScreening
+from model_explorer.problems.surrogate import GaussianProcessSurrogate, log_surrogate_error
 
 from pymoo.core.problem import ElementwiseEvaluationFunction, LoopedElementwiseEvaluation
 from pymoo.algorithms.moo.nsga2 import NSGA2
@@ -13,6 +24,7 @@ class ElementwiseEvaluationFunctionWithIndex(ElementwiseEvaluationFunction):
 
     def __call__(self, i, x):
         out = dict()
+        self.problem.fidelity = self.kwargs.get('fidelity', 'full')
         self.problem._evaluate(i, x, out, *self.args, **self.kwargs)
         return out
 
@@ -23,17 +35,235 @@ class LoopedElementwiseEvaluationWithIndex(LoopedElementwiseEvaluation):
     """
     def __call__(self, f, X):
         algorithm: NSGA2 = f.kwargs.get('algorithm')
+        cache: EvaluationCache = getattr(f.problem, 'evaluation_cache', None)
+
         progress_bar = tqdm(total=len(X), position=1, ascii=True, desc="Generation {}".format(algorithm.n_iter))
-        results = []
+        results = [None] * len(X)
+
+        # individuals already evaluated in an earlier generation or run are taken from the cache
+        pending = []
         for i, x in enumerate(X):
-            results.append(f(i, x))
-            progress_bar.update(1)
+            results[i] = cache.get(x) if cache is not None else None
+            if results[i] is None:
+                pending.append(i)
+            else:
+                progress_bar.update(1)
+
+        # surely infeasible individuals keep the surrogate prediction
+        surrogate: GaussianProcessSurrogate = getattr(f.problem, 'surrogate', None)
+        predicted_violation = {}
+        if surrogate is not None:
+            pending, predicted_violation = self._apply_surrogate(f, X, pending, results, progress_bar, surrogate)
+
+        screening: MultiFidelityScreening = getattr(f.problem, 'screening', None)
+        if screening is not None:
+            self._evaluate_multi_fidelity(f, X, pending, results, progress_bar, screening)
+        else:
+            self._evaluate_individuals(f, X, pending, results, progress_bar)
         progress_bar.close()
 
+        if surrogate is not None:
+            for i in pending:
+                results[i]['surrogate'] = 0.0
+                results[i]['surrogate_violation'] = predicted_violation.get(i, np.nan)
+                # screening results of individuals that were not promoted are no full evaluations
+                if results[i].get('promoted', 1.0) == 1.0:
+                    surrogate.add(X[i], results[i])
+            evaluated = [i for i in pending if i in predicted_violation]
+            log_surrogate_error(np.array([predicted_violation[i] for i in evaluated]),
+                                np.array([np.max(results[i]['G']) for i in evaluated]),
+                                len(predicted_violation) - len(evaluated), algorithm.n_iter)
+
+        if cache is not None:
+            for i in pending:
+                cache.put(X[i], results[i])
+            logger.info("Evaluation cache: {} of {} individuals found ({:.1%}) in Generation {}".format(
+                cache.hits, cache.requests, cache.hit_rate(), algorithm.n_iter))
+            cache.reset_statistics()
+
+        activation_cache = getattr(f.problem.model, 'activation_cache', None)
+        if activation_cache is not None and activation_cache.requests > 0:
+            logger.info("Activation cache: resumed {} of {} batches ({:.1%}) in Generation {}".format(
+                activation_cache.hits, activation_cache.requests, activation_cache.hit_rate(), algorithm.n_iter))
+            activation_cache.reset_statistics()
+
+        weight_cache = getattr(f.problem.model, 'weight_cache', None)
+        if weight_cache is not None and weight_cache.requests > 0:
+            logger.info("Weight cache: reused {} of {} quantized weights ({:.1%}) in Generation {}".format(
+                weight_cache.hits, weight_cache.requests, weight_cache.hit_rate(), algorithm.n_iter))
+            weight_cache.reset_statistics()
+
         # do some info generation
         accuracy_string = ", ".join(format(-result['G'][0], ".3f") for result in results)
         logger.info("Finished Generation {} \n Accuracies[0]: [{}]".format(algorithm.n_iter, accuracy_string))
 
         return results
 
+    def _evaluate_individuals(self, f, X, indices: list, results: list, progress_bar: tqdm):
+        """Evaluates the individuals at the given indices and stores their
+        outputs at the same position in results. Problems that support it
+        evaluate chunks of population_size individuals in one forward pass.
+        """
+        if f.problem.supports_population_evaluation():
+            population_size = f.problem.population_size
+            for start in range(0, len(indices), population_size):
+                chunk = indices[start:start + population_size]
+                for i, out in zip(chunk, f.problem.evaluate_population(chunk, X[chunk], *f.args, **f.kwargs)):
+                    results[i] = out
+                progress_bar.update(len(chunk))
+            return
+
+        for i in indices:
+            results[i] = f(i, X[i])
+            progress_bar.update(1)
+
+    def _apply_surrogate(self, f, X, indices: list, results: list, progress_bar: tqdm,
+                         surrogate: GaussianProcessSurrogate) -> tuple:
+        """Predicts the outputs of the pending individuals, the surely
+        infeasible ones are not evaluated and get the predicted outputs.
+
+        Returns:
+            tuple: the individuals that still have to be evaluated and the
+            predicted largest constraint violation of all pending individuals
+        """
+        if len(indices) == 0 or not surrogate.is_trained():
+            return indices, {}
+
+        evaluate, mean, violation = surrogate.select(X[indices], f.problem.n_obj)
+        predicted_violation = {i: float(v) for i, v in zip(indices, violation)}
+
+        remaining = []
+        for i, selected, prediction in zip(indices, evaluate, mean):
+            if selected:
+                remaining.append(i)
+                continue
+            results[i] = {'F': prediction[:f.problem.n_obj].tolist(), 'G': prediction[f.problem.n_obj:].tolist(),
+                          'surrogate': 1.0, 'surrogate_violation': predicted_violation[i]}
+            for key in f.problem.result_metadata_keys:
+                results[i].setdefault(key, np.nan)
+            progress_bar.update(1)
+
+        return remaining, predicted_violation
+
+    def _evaluate_multi_fidelity(self, f, X, indices: list, results: list, progress_bar: tqdm,
+                                 screening: MultiFidelityScreening):
+        """Scores the individuals on the screening subset and evaluates the
+        promoted ones again on the full dataset. The largest screening
+        constraint violation and the promotion are added to the outputs.
+        """
+        algorithm: NSGA2 = f.kwargs.get('algorithm')
+        # without feasible individuals the optimum holds the least infeasible ones, which are no front
+        front_F = None
+        if algorithm is not None and algorithm.opt is not None and np.all(algorithm.opt.get("feas")):
+            front_F = algorithm.opt.get("F")
+
+        screening_f = ElementwiseEvaluationFunctionWithIndex(f.problem, f.args, dict(f.kwargs, fidelity='screening'))
+        self._evaluate_individuals(screening_f, X, indices, results, progress_bar)
+
+        promoted = [i for i in indices if screening.promote(results[i], front_F)]
+        for i in indices:
+            results[i]['screening_violation'] = float(np.max(results[i]['G']))
+            results[i]['promoted'] = float(i in promoted)
+
+        logger.info("Screening: promoted {} of {} individuals to the full dataset in Generation {}".format(
+            len(promoted), len(indices), algorithm.n_iter))
+
+        progress_bar.total += len(promoted)
+        progress_bar.refresh()
+
+        screening_results = {i: results[i] for i in promoted}
+        self._evaluate_individuals(f, X, promoted, results, progress_bar)
+        for i in promoted:
+            results[i]['screening_violation'] = screening_results[i]['screening_violation']
+            results[i]['promoted'] = 1.0
+
+    def close(self):
+        pass
+
+
+# Problem copy of a worker process, set once by the pool initializer
+_worker_problem = None
+
+
+def _init_worker(problem, threads_per_worker: int):
+    global _worker_problem
+    _worker_problem = problem
+    if threads_per_worker:
+        torch.set_num_threads(threads_per_worker)
+
+
+def _evaluate_in_worker(i, x, args, kwargs):
+    f = ElementwiseEvaluationFunctionWithIndex(_worker_problem, args, kwargs)
+    return f(i, x)
+
+
+class ParallelElementwiseEvaluationWithIndex(LoopedElementwiseEvaluationWithIndex):
+    """Fans the individuals of a generation out over a pool of worker
+    processes. Each worker receives its own copy of the problem when the pool
+    is started, and with it its own model replica and dataloader generator.
+    Results are returned in index order, exactly like the serial runner.
+    """
+
+    def __init__(self, n_workers: int, threads_per_worker: int = None) -> None:
+        super().__init__()
+        assert n_workers > 0, "The parallel runner needs at least one worker"
+
+        self.n_workers = n_workers
+        self.threads_per_worker = threads_per_worker
+        if self.threads_per_worker is None:
+            self.threads_per_worker = max(1, (os.cpu_count() or 1) // n_workers)
+
+        self._executor = None
+
+    def _evaluate_individuals(self, f, X, indices: list, results: list, progress_bar: tqdm):
+        if self._executor is None:
+            logger.info(f"Starting {self.n_workers} evaluation workers with "
+                        f"{self.threads_per_worker} thread(s) each")
+            # spawn is required, forked processes cannot use cuda
+            self._executor = ProcessPoolExecutor(max_workers=self.n_workers,
+                                                 mp_context=get_context('spawn'),
+                                                 initializer=_init_worker,
+                                                 initargs=(f.problem, self.threads_per_worker))
+
+        # the algorithm itself is not sent to the workers, problems only read
+        # the generation and population size from it
+        kwargs = dict(f.kwargs)
+        algorithm: NSGA2 = kwargs.get('algorithm')
+        if algorithm is not None:
+            kwargs['algorithm'] = SimpleNamespace(n_iter=algorithm.n_iter, pop_size=algorithm.pop_size)
+
+        futures = {self._executor.submit(_evaluate_in_worker, i, X[i], f.args, kwargs): i for i in indices}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            progress_bar.update(1)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+
+def build_evaluation_runner(settings: dict) -> LoopedElementwiseEvaluationWithIndex:
+    """Creates the evaluation runner described in the evaluation section of
+    the exploration settings.
+
+    Args:
+        settings (dict): evaluation settings from the workload file, can be empty
+
+    Returns:
+        LoopedElementwiseEvaluationWithIndex: serial or parallel runner
+    """
+    runner = settings.get('runner', 'serial')
+
+    if runner == 'serial':
+        return LoopedElementwiseEvaluationWithIndex()
+    elif runner == 'parallel':
+        return ParallelElementwiseEvaluationWithIndex(n_workers=settings.get('workers', os.cpu_count()),
+                                                      threads_per_worker=settings.get('threads_per_worker', None))
 
+    raise ValueError(f"Unknown evaluation runner: {runner}")
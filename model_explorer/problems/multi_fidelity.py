@@ -0,0 +1,78 @@
+import numpy as np
+
+from model_explorer.utils.data_loader_generator import DataLoaderGenerator
+from model_explorer.utils.setup import build_dataloader_generators
+
+
+class MultiFidelityScreening:
+    """Two stage evaluation of the individuals of a generation. All of them
+    are scored on a small screening subset first, only promising individuals
+    are then evaluated on the full exploration dataset. An individual is
+    promoted if its screening accuracy is within the margin of the accuracy
+    constraint, or if it is surely feasible and not dominated by the current
+    front by more than the front margin. The remaining individuals keep their
+    screening result.
+    """
+
+    def __init__(self, dataloader_generator: DataLoaderGenerator, margin: float = 0.02,
+                 front_margin: float = None) -> None:
+        assert margin >= 0.0, "The screening margin has to be positive"
+        assert front_margin is None or front_margin >= 0.0, "The front margin has to be positive"
+
+        self.dataloader_generator = dataloader_generator
+        self.margin = margin
+        self.front_margin = front_margin
+
+    def promote(self, screening_out: dict, front_F: np.ndarray = None) -> bool:
+        """Decides if an individual is evaluated on the full dataset.
+
+        Args:
+            screening_out (dict): outputs of the screening evaluation (F, G)
+            front_F (np.ndarray, optional): objectives of the current front,
+            None if it has no feasible individuals
+
+        Returns:
+            bool: True if the individual is promoted
+        """
+        G = np.atleast_1d(np.asarray(screening_out['G'], dtype=np.float64))
+
+        # surely infeasible
+        if np.any(G > self.margin):
+            return False
+        # close to the accuracy constraint
+        if np.any(G >= -self.margin):
+            return True
+
+        if self.front_margin is None or front_F is None or len(front_F) == 0:
+            return True
+
+        # surely feasible, promoted unless the front dominates it even when improved by the margin
+        F = np.atleast_1d(np.asarray(screening_out['F'], dtype=np.float64))
+        F_relaxed = F - self.front_margin * np.abs(F)
+        return not np.any(np.all(front_F <= F_relaxed, axis=1) & np.any(front_F < F_relaxed, axis=1))
+
+    def settings(self) -> dict:
+        return {'samples': len(self.dataloader_generator), 'margin': self.margin, 'front_margin': self.front_margin}
+
+
+def build_screening(settings: dict, dataset_settings: dict) -> MultiFidelityScreening:
+    """Creates the screening stage described in the screening section of the
+    exploration settings.
+
+    Args:
+        settings (dict): screening settings from the workload file, can be None
+        dataset_settings (dict): settings of the exploration dataset, the
+        screening dataset overrides some of them (e.g. sample_limit)
+
+    Returns:
+        MultiFidelityScreening: the screening stage or None if it is disabled
+    """
+    if settings is None:
+        return None
+
+    screening_dataset = dict(dataset_settings, **settings.get('dataset', {}))
+    dataloader_generator = build_dataloader_generators({'screening': screening_dataset})['screening']
+
+    return MultiFidelityScreening(dataloader_generator,
+                                  margin=settings.get('margin', 0.02),
+                                  front_margin=settings.get('front_margin', None))
@@ -24,7 +24,8 @@ def init_sparse_model(model: nn.Module, device: torch.device,
         device (torch.device): torch device
     """
     block_size = kwargs.get('block_size')
-    sparse_model = SparseModel(model, block_size, device)
+    conv_mode = kwargs.get('conv_mode', 'im2col')
+    sparse_model = SparseModel(model, block_size, device, conv_mode=conv_mode)
     logger.debug("Initialized sparse model with {} sparse modules".format(sparse_model.get_explorable_parameter_count()))
     return sparse_model
 
@@ -67,6 +68,9 @@ class SparsityThresholdProblem(CustomExplorationProblem):
     """A pymoo problem definition for the sparsity exploration.
     """
 
+    # the accuracy is an objective
+    supports_early_termination = False
+
     def __init__(
             self,
             sparse_model: SparseModel,
@@ -111,15 +115,13 @@ class SparsityThresholdProblem(CustomExplorationProblem):
 
         self.model.thresholds = thresholds
 
-        f1_accuracy_objective = self.accuracy_function(
-            self.model.base_model,
+        f1_accuracy_objective, n_samples = self.compute_accuracy(
             self.dataloader_generator,
-            progress=self.progress,
             title="Evaluating {}/{}".format(index + 1, algorithm.pop_size)
         )
-        # get total created returns all created for a given batch, therefore div by batch size
+        # get total created returns all created for the evaluated samples, therefore div by their count
         f2_sparsity_objective = self.model.get_total_created_sparse_blocks()
-        f2_sparsity_objective /= len(self.dataloader_generator)
+        f2_sparsity_objective /= n_samples
 
         g1_accuracy_constraint = self.min_accuracy - f1_accuracy_objective
 
@@ -130,6 +132,7 @@ class SparsityThresholdProblem(CustomExplorationProblem):
 
         # NOTE: In pymoo, each objective function is supposed to be minimized,
         # and each constraint needs to be provided in the form of <= 0
+        out["n_samples"] = n_samples
         out["F"] = [-f1_accuracy_objective, -f2_sparsity_objective]
         out["G"] = [g1_accuracy_constraint]
 
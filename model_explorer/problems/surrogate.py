@@ -0,0 +1,160 @@
+import numpy as np
+
+from model_explorer.utils.logger import logger
+
+
+class GaussianProcessSurrogate:
+    """Gaussian process regression on all evaluated individuals so far, it
+    predicts the objectives F and the constraints G of new offspring. The
+    parameters are scaled to [0, 1] by the problem bounds, the outputs are
+    standardized and share one RBF kernel whose length scale is set by the
+    median distance of the training points.
+
+    Offspring whose optimistic prediction (mean - kappa * std) of the largest
+    constraint violation is still positive are surely infeasible and are not
+    evaluated, they keep the predicted outputs. All promising or uncertain
+    individuals are evaluated for real and extend the training data.
+    """
+
+    def __init__(self, xl, xu, kappa: float = 2.0, min_samples: int = 24, max_samples: int = 1000,
+                 noise: float = 1e-3) -> None:
+        self.xl = np.asarray(xl, dtype=np.float64)
+        self.xu = np.asarray(xu, dtype=np.float64)
+        self.kappa = kappa
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.noise = noise
+
+        self._samples = {}
+        self._model = None
+
+    def _scale(self, X) -> np.ndarray:
+        return (np.asarray(X, dtype=np.float64) - self.xl) / np.maximum(self.xu - self.xl, 1e-12)
+
+    def add(self, x, out: dict):
+        """Adds a real evaluation to the training data"""
+        y = np.concatenate([np.atleast_1d(np.asarray(out['F'], dtype=np.float64)),
+                            np.atleast_1d(np.asarray(out['G'], dtype=np.float64))])
+        self._samples[np.asarray(x, dtype=np.float64).tobytes()] = (np.asarray(x, dtype=np.float64), y)
+        self._model = None
+
+    def is_trained(self) -> bool:
+        return len(self._samples) >= self.min_samples
+
+    @staticmethod
+    def _distances(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+        # |a|^2 + |b|^2 - 2ab, avoids the [len(A), len(B), n_var] difference tensor
+        squared = (A ** 2).sum(axis=1)[:, None] + (B ** 2).sum(axis=1)[None, :] - 2.0 * A @ B.T
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def _fit(self):
+        # the most recent samples, fitting is cubic in their number
+        samples = list(self._samples.values())[-self.max_samples:]
+        X = self._scale(np.stack([x for x, _ in samples]))
+        Y = np.stack([y for _, y in samples])
+
+        y_mean = Y.mean(axis=0)
+        y_std = np.maximum(Y.std(axis=0), 1e-12)
+
+        distances = self._distances(X, X)
+        # exact zeros on the diagonal, the expanded form leaves rounding errors
+        np.fill_diagonal(distances, 0.0)
+        length_scale = max(float(np.median(distances[distances > 0])) if np.any(distances > 0) else 1.0, 1e-6)
+
+        K = np.exp(-0.5 * (distances / length_scale) ** 2) + self.noise * np.eye(len(X))
+        L = np.linalg.cholesky(K)
+        alpha = np.linalg.solve(L.T, np.linalg.solve(L, (Y - y_mean) / y_std))
+
+        self._model = (X, L, alpha, y_mean, y_std, length_scale)
+
+    def predict(self, X) -> tuple:
+        """Predicts the outputs of the given individuals.
+
+        Args:
+            X (np.ndarray): [individuals, n_var] parameters
+
+        Returns:
+            tuple: mean and standard deviation, both [individuals, n_obj + n_constr]
+        """
+        if self._model is None:
+            self._fit()
+        X_train, L, alpha, y_mean, y_std, length_scale = self._model
+
+        X = self._scale(X)
+        distances = self._distances(X, X_train)
+        K_s = np.exp(-0.5 * (distances / length_scale) ** 2)
+
+        mean = K_s @ alpha
+        v = np.linalg.solve(L, K_s.T)
+        variance = np.maximum(1.0 + self.noise - (v ** 2).sum(axis=0), 0.0)
+
+        return mean * y_std + y_mean, np.sqrt(variance)[:, None] * y_std
+
+    def select(self, X, n_obj: int) -> tuple:
+        """Splits the individuals into the ones that have to be evaluated and
+        the surely infeasible ones.
+
+        Args:
+            X (np.ndarray): [individuals, n_var] parameters
+            n_obj (int): number of objectives, the remaining outputs are constraints
+
+        Returns:
+            tuple: boolean mask of the evaluated individuals, predicted
+            outputs and predicted largest constraint violation
+        """
+        mean, std = self.predict(X)
+        violation = mean[:, n_obj:].max(axis=1)
+        optimistic_violation = (mean[:, n_obj:] - self.kappa * std[:, n_obj:]).max(axis=1)
+        return optimistic_violation <= 0, mean, violation
+
+    def get_state(self) -> dict:
+        return {'samples': list(self._samples.values())}
+
+    def set_state(self, state: dict):
+        for x, y in state['samples']:
+            self._samples[x.tobytes()] = (x, y)
+        self._model = None
+
+    def settings(self) -> dict:
+        return {'kappa': self.kappa, 'min_samples': self.min_samples, 'max_samples': self.max_samples,
+                'noise': self.noise}
+
+
+def log_surrogate_error(predicted_violation: np.ndarray, violation: np.ndarray, skipped: int, n_iter: int):
+    """Logs how well the surrogate predicted the evaluated individuals of a
+    generation, the error of the largest constraint violation and how often
+    the predicted feasibility was right.
+    """
+    if len(violation) == 0:
+        return
+    error = np.abs(predicted_violation - violation)
+    agreement = np.mean((predicted_violation <= 0) == (violation <= 0))
+    logger.info("Surrogate: skipped {} individuals, violation MAE {:.4f} (max {:.4f}), "
+                "feasibility agreement {:.1%} in Generation {}".format(
+                    skipped, error.mean(), error.max(), agreement, n_iter))
+
+
+def build_surrogate(settings: dict, xl, xu) -> GaussianProcessSurrogate:
+    """Creates the surrogate described in the surrogate section of the
+    exploration settings.
+
+    Args:
+        settings (dict): surrogate settings from the workload file, can be None
+        xl: lower bounds of the problem parameters
+        xu: upper bounds of the problem parameters
+
+    Returns:
+        GaussianProcessSurrogate: the surrogate or None if it is disabled
+    """
+    if settings is None:
+        return None
+
+    model = settings.get('model', 'gaussian_process')
+    if model != 'gaussian_process':
+        raise ValueError(f"Unknown surrogate model: {model}")
+
+    return GaussianProcessSurrogate(xl, xu,
+                                    kappa=settings.get('kappa', 2.0),
+                                    min_samples=settings.get('min_samples', 24),
+                                    max_samples=settings.get('max_samples', 1000),
+                                    noise=settings.get('noise', 1e-3))
@@ -1,34 +1,127 @@
 import os
 import glob
+import pickle
+import hashlib
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+
 from model_explorer.result_handling.results_collection import ResultsCollection
+from model_explorer.result_handling.results_writer import is_run_directory
 from model_explorer.utils.logger import logger
 
 
-def collect_results(path: str) -> ResultsCollection:
+INDEX_CACHE_DIR = ".results_index"
+# increased whenever the compact form of a ResultsCollection changes
+INDEX_CACHE_VERSION = 2
+
+
+def _result_signature(path: str) -> tuple:
+    """mtime and size of a result pickle, for run directories of all their
+    files, so that a cached index is invalidated when the result changes.
+    """
+    if os.path.isdir(path):
+        stats = [os.stat(f) for f in glob.glob(os.path.join(path, '*'))]
+        return (len(stats), max((s.st_mtime_ns for s in stats), default=0), sum(s.st_size for s in stats))
+
+    stat = os.stat(path)
+    return (1, stat.st_mtime_ns, stat.st_size)
+
+
+def _index_cache_file(path: str, metadata_columns: list) -> str:
+    path = os.path.abspath(path)
+    key = repr((INDEX_CACHE_VERSION, path, _result_signature(path), metadata_columns))
+    key = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(os.path.dirname(path), INDEX_CACHE_DIR, f"{key}.pkl")
+
+
+def _load_compact(path: str, metadata_columns: list) -> dict:
+    """Loads a result file (in a worker process) and only returns the compact
+    form of its entries.
+    """
+    if is_run_directory(path):
+        return ResultsCollection(run_dir=path, metadata_columns=metadata_columns).to_compact()
+    return ResultsCollection(pickle_file=path).to_compact()
+
+
+def load_results(paths: list, metadata_columns: list = None, workers: int = None,
+                 index_cache: bool = True) -> list:
+    """Loads the given result files and run directories in parallel worker
+    processes. The compact form of every file is stored in an index cache next
+    to it, unchanged files (same mtime and size) are read from there on the
+    next load.
+
+    Args:
+        paths (list): result pickles and run directories
+        metadata_columns (list, optional): metadata columns loaded from streamed runs
+        workers (int, optional): number of worker processes, None uses all cores
+        index_cache (bool, optional): read and write the index cache. Defaults to True.
+
+    Returns:
+        list: a ResultsCollection for each path, in the same order
+    """
+    compacts = [None] * len(paths)
+
+    if index_cache:
+        for i, path in enumerate(paths):
+            cache_file = _index_cache_file(path, metadata_columns)
+            if os.path.exists(cache_file):
+                with open(cache_file, 'rb') as f:
+                    compacts[i] = pickle.load(f)
+                logger.debug(f"Loaded results index of {path}")
+
+    missing = [i for i, compact in enumerate(compacts) if compact is None]
+    if len(missing) > 0:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(missing))) as executor:
+            futures = {i: executor.submit(_load_compact, paths[i], metadata_columns) for i in missing}
+            for i, future in futures.items():
+                compacts[i] = future.result()
+
+                if index_cache:
+                    cache_file = _index_cache_file(paths[i], metadata_columns)
+                    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                    with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(cache_file), delete=False) as f:
+                        pickle.dump(compacts[i], f)
+                    os.replace(f.name, cache_file)
+
+    return [ResultsCollection.from_compact(compact) for compact in compacts]
+
+
+def collect_results(path: str, metadata_columns: list = None, workers: int = None,
+                    index_cache: bool = True) -> ResultsCollection:
     """This function automatically gathers all results found in a given path.
 
     Args:
         path (str): Pathlike object, which is searched for results, can be a
-        single file or a folder with multiple pickles
+        single file, a streamed run directory or a folder with multiple
+        pickles and run directories
+        metadata_columns (list, optional): metadata columns loaded from
+        streamed runs, e.g. n_samples. Defaults to None.
+        workers (int, optional): processes loading the result files in
+        parallel, None uses all cores. Defaults to None.
+        index_cache (bool, optional): cache the loaded entries of every file,
+        unchanged files are then not loaded again. Defaults to True.
 
     Returns:
         ResultsCollection: all found results
     """
-    if os.path.isdir(path):
-        # if path start with empty results loader
-        results_collection = ResultsCollection()
-        for result_file in glob.glob(os.path.join(path, '*.pkl')):
-            rl = ResultsCollection(pickle_file=result_file)
-            if results_collection.individuals == []:
-                results_collection = rl
-            else:
-                results_collection.merge(rl)
-            logger.debug("Added results file: {} with {} individual(s)".format(result_file, len(rl.individuals)))
+    if os.path.isdir(path) and not is_run_directory(path):
+        result_files = sorted(glob.glob(os.path.join(path, '*.pkl')))
+        result_files += sorted([d for d in glob.glob(os.path.join(path, '*')) if is_run_directory(d)])
     else:
-        results_collection = ResultsCollection(path)
-        logger.debug("Added results file: {} with {} individual(s)".format(path, len(results_collection.individuals)))
+        result_files = [path]
+
+    results_collection = ResultsCollection()
+    for result_file, rl in zip(result_files, load_results(result_files, metadata_columns, workers, index_cache)):
+        if len(results_collection) == 0:
+            # deduplicated once, the following merges only insert unseen parameters
+            results_collection = rl
+            results_collection.drop_duplicate_parameters()
+        else:
+            results_collection.merge(rl)
+        logger.debug("Added results file: {} with {} individual(s)".format(result_file, len(rl)))
 
     results_collection.drop_duplicate_parameters()
-    logger.debug("Loaded in total {} individuals".format(len(results_collection.individuals)))
+    logger.debug("Loaded in total {} individuals".format(len(results_collection)))
 
     return results_collection
@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class ParameterIndex():
+    """Hashed set of parameter vectors. Vectors are canonicalized by rounding
+    them to multiples of the tolerance, hence sparsity thresholds that only
+    differ by floating point noise are treated as equal, while integer bit
+    widths are always compared exactly. Lookups and insertions are O(1).
+    """
+
+    def __init__(self, tolerance: float = 1e-6) -> None:
+        assert tolerance > 0, "The tolerance has to be positive"
+        self.tolerance = tolerance
+        self._keys = set()
+
+    def key(self, parameter) -> bytes:
+        canonical = np.rint(np.asarray(parameter, dtype=np.float64) / self.tolerance).astype(np.int64)
+        return canonical.tobytes()
+
+    def add(self, parameter) -> bool:
+        """Inserts the parameter vector.
+
+        Returns:
+            bool: True if the vector was not in the index before
+        """
+        key = self.key(parameter)
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        return True
+
+    def __contains__(self, parameter) -> bool:
+        return self.key(parameter) in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
@@ -0,0 +1,71 @@
+import numpy as np
+
+
+class ParetoIndex():
+    """Keeps the non-dominated set of a growing set of points, all coordinates
+    are minimized. Inserting a point compares it only against the current
+    front, hence the index can be updated whenever individuals are added.
+    Points equal to a front member are not added again.
+    """
+
+    def __init__(self) -> None:
+        self.rows = np.empty(0, dtype=np.int64)
+        self.points = None
+
+    def insert(self, rows, points: np.ndarray):
+        """Inserts a batch of points
+
+        Args:
+            rows: identifiers of the points, e.g. their row in a ResultsCollection
+            points (np.ndarray): [n, dims] coordinates, all minimized
+        """
+        points = np.asarray(points, dtype=np.float64)
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.points is None:
+            self.points = np.empty((0, points.shape[1]))
+
+        # points with small coordinate sums are likely dominating, inserting them first keeps the front small
+        for i in np.argsort(points.sum(axis=1), kind='stable'):
+            self._insert(rows[i], points[i])
+
+    def _insert(self, row: int, point: np.ndarray):
+        if len(self.rows) > 0:
+            if np.any(np.all(self.points <= point, axis=1)):
+                return
+            keep = ~np.all(point <= self.points, axis=1)
+            self.rows, self.points = self.rows[keep], self.points[keep]
+
+        self.rows = np.append(self.rows, row)
+        self.points = np.vstack([self.points, point])
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+def non_dominated_fronts(points: np.ndarray, k: int) -> list:
+    """Sorts the points into the fronts 0 ... k by repeatedly removing the
+    non-dominated set. Equal points are part of the same front.
+
+    Args:
+        points (np.ndarray): [n, dims] coordinates, all minimized
+        k (int): last front that is computed
+
+    Returns:
+        list: an array of row positions for each front
+    """
+    points = np.asarray(points, dtype=np.float64)
+    remaining = np.arange(len(points))
+    fronts = []
+
+    while len(remaining) > 0 and len(fronts) <= k:
+        index = ParetoIndex()
+        index.insert(remaining, points[remaining])
+
+        # duplicates of front members were rejected by the index
+        front_keys = {points[row].tobytes() for row in index.rows}
+        in_front = np.array([points[row].tobytes() in front_keys for row in remaining], dtype=bool)
+
+        fronts.append(remaining[in_front])
+        remaining = remaining[~in_front]
+
+    return fronts
@@ -1,10 +1,7 @@
-from typing import List
+from typing import List, Optional
 from dataclasses import dataclass
 
 import pymoo.core.mating
-import pymoo.operators.mutation.pm
-import pymoo.operators.crossover.sbx
-import pymoo.operators.selection.tournament
 
 
 @dataclass
@@ -17,7 +14,8 @@ class ResultEntry:
     generation: int
     individual_idx: int
     further_objectives: List[int]
-    pymoo_mating: pymoo.core.mating.Mating
+    # streamed results have no mating object, their mating settings are part of further_args
+    pymoo_mating: Optional[pymoo.core.mating.Mating]
     further_args: dict
 
     def parameters_sum(self) -> float:
@@ -29,14 +27,10 @@ class ResultEntry:
             "individual": self.individual_idx,
             "accuracies": self.accuracies,
         }
-        if isinstance(self.pymoo_mating.mutation, pymoo.operators.mutation.pm.PolynomialMutation):
-            rdict['mutation_eta'] = self.pymoo_mating.mutation.eta.value
-            rdict['mutation_prob'] = self.pymoo_mating.mutation.prob.value
-        if isinstance(self.pymoo_mating.crossover, pymoo.operators.crossover.sbx.SBX):
-            rdict['crossover_eta'] = self.pymoo_mating.crossover.eta.value
-            rdict['crossover_prob'] = self.pymoo_mating.crossover.prob.value
-        if isinstance(self.pymoo_mating.selection, pymoo.operators.selection.tournament.TournamentSelection):
-            rdict['selection_press'] = self.pymoo_mating.selection.pressure
+        if self.pymoo_mating is not None:
+            # imported here, the results writer requires pyarrow
+            from model_explorer.result_handling.results_writer import get_mating_settings
+            rdict.update(get_mating_settings(self.pymoo_mating))
 
         for i, v in enumerate(self.further_objectives):
             rdict[f'F_{i}'] = v
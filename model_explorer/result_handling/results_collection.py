@@ -2,22 +2,109 @@ from __future__ import annotations
 
 from model_explorer.utils.pickeling import CPUUnpickler
 from model_explorer.result_handling.result_entry import ResultEntry
+from model_explorer.result_handling.parameter_index import ParameterIndex
+from model_explorer.result_handling.pareto_index import ParetoIndex, non_dominated_fronts
+from model_explorer.result_handling.results_writer import read_run_meta, read_run_table, get_mating_settings
 from pymoo.core.result import Result
 
 import pymoo.algorithms.moo.nsga2
+import numpy as np
 import pandas as pd
 
 
+class InternedColumn():
+    """Column of arbitrary (e.g. non numeric) values, every distinct value is
+    only stored once and rows hold an index into the distinct values.
+    """
+
+    def __init__(self, values: list = None) -> None:
+        self.values = []
+        self._lookup = {}
+        self.codes = np.array([self._intern(v) for v in (values or [])], dtype=np.int32)
+
+    def _intern(self, value) -> int:
+        key = repr(value)
+        if key not in self._lookup:
+            self._lookup[key] = len(self.values)
+            self.values.append(value)
+        return self._lookup[key]
+
+    def take(self, rows) -> InternedColumn:
+        column = InternedColumn()
+        column.values, column._lookup = list(self.values), dict(self._lookup)
+        column.codes = self.codes[rows]
+        return column
+
+    def extend(self, other: InternedColumn):
+        remap = np.array([self._intern(v) for v in other.values], dtype=np.int32)
+        self.codes = np.concatenate([self.codes, remap[other.codes] if len(remap) > 0 else other.codes])
+
+    def to_list(self) -> list:
+        return [self.values[c] for c in self.codes]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+def _build_column(values: list):
+    """Numeric metadata is stored as float array, everything else interned"""
+    if all(isinstance(v, (int, float, np.number)) and not isinstance(v, bool) or v is None for v in values):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return InternedColumn(values)
+
+
+def _missing_column(column, length: int):
+    if isinstance(column, InternedColumn):
+        return InternedColumn([None] * length)
+    return np.full(length, np.nan)
+
+
 class ResultsCollection():
-    """Holds result entrys in a list and adds some supportive function to, e.g., drop duplicates
+    """Holds the result entries as structure of arrays: parameters, accuracies
+    and objectives are 2-D arrays with one row per individual, metadata such as
+    mating settings or the block size are columns. Filters and sorting work on
+    the arrays, ResultEntry objects are only created when individuals are
+    accessed.
     """
 
-    def __init__(self, pickle_file: str = None) -> None:
+    def __init__(self, pickle_file: str = None, run_dir: str = None, metadata_columns: list = None,
+                 parameter_tolerance: float = 1e-6) -> None:
         self.accuracy_limit = None
         self.explorable_module_names = []
-        self.individuals = []
+        self.parameter_tolerance = parameter_tolerance
+
+        self.parameters = np.empty((0, 0))
+        self.accuracies = np.empty((0, 0))
+        self.objectives = np.empty((0, 0))
+        self.generations = np.empty(0, dtype=np.int64)
+        self.individual_idxs = np.empty(0, dtype=np.int64)
+        self.metadata = {}
+
+        # set once the duplicates are dropped, merge then only adds unseen parameters
+        self._parameter_index = None
+        # built on the first pareto query and updated by merge
+        self._pareto_index = None
         if pickle_file:
             self._load(pickle_file)
+        elif run_dir:
+            self._load_run(run_dir, metadata_columns)
+
+    def _set_rows(self, accuracies: list, parameters: list, generations: list, individual_idxs: list,
+                  objectives: list, further_args: list):
+        self.accuracies = np.array(accuracies, dtype=np.float64).reshape(len(parameters), -1)
+        self.parameters = np.array(parameters, dtype=np.float64).reshape(len(parameters), -1)
+        self.objectives = np.array(objectives, dtype=np.float64).reshape(len(parameters), -1)
+        self.generations = np.array(generations, dtype=np.int64)
+        self.individual_idxs = np.array(individual_idxs, dtype=np.int64)
+
+        keys = list(dict.fromkeys(key for args in further_args for key in args))
+        self.metadata = {key: _build_column([args.get(key, None) for args in further_args]) for key in keys}
+
+    def _accuracies_from_constraints(self, G: np.ndarray) -> np.ndarray:
+        # Compute Constraint - Acc Limit for each available Accuracy
+        if isinstance(self.accuracy_limit, list):
+            return np.asarray(self.accuracy_limit)[None, :] - G
+        return self.accuracy_limit - G
 
     def _load(self, pickle_file: str):
         with open(pickle_file, 'rb') as f:
@@ -30,43 +117,175 @@ class ResultsCollection():
         self.accuracy_limit = d.problem.min_accuracy
         self.explorable_module_names = d.problem.model.explorable_module_names
 
+        further_args = {}
+        if hasattr(d.problem.model, '_block_size'):
+            further_args['block_size'] = d.problem.model._block_size
+
+        G, X, F, generations, individual_idxs, row_args = [], [], [], [], [], []
         for generation_idx, h in enumerate(d.history):
             assert isinstance(h, pymoo.algorithms.moo.nsga2.NSGA2)
-            for individual_idx, ind in enumerate(h.pop):
-                further_args = {}
-                if hasattr(d.problem.model, '_block_size'):
-                    further_args['block_size'] = d.problem.model._block_size
-
-                # Compute Constraint - Acc Limit for each available Accuracy
-                accuracies = None
-                if isinstance(self.accuracy_limit, list):
-                    accuracies = [limit - acc for acc, limit in zip(ind.get("G"), self.accuracy_limit)]
-                elif isinstance(self.accuracy_limit, float):
-                    accuracies = self.accuracy_limit - ind.get("G")
-
-                self.individuals.append(
-                    ResultEntry(accuracies=accuracies,
-                                further_objectives=ind.get("F"),
-                                parameter=ind.get("X").tolist(),
-                                generation=generation_idx,
-                                individual_idx=individual_idx,
-                                pymoo_mating=h.mating,
-                                further_args=further_args))
+            generation_args = dict(further_args, **get_mating_settings(h.mating))
+
+            G.append(h.pop.get("G"))
+            X.append(h.pop.get("X"))
+            F.append(h.pop.get("F"))
+            generations.extend([generation_idx] * len(h.pop))
+            individual_idxs.extend(range(len(h.pop)))
+            row_args.extend([generation_args] * len(h.pop))
+
+        self._set_rows(self._accuracies_from_constraints(np.concatenate(G).astype(np.float64)),
+                       np.concatenate(X), generations, individual_idxs, np.concatenate(F), row_args)
+
+    def _load_run(self, run_dir: str, metadata_columns: list = None):
+        """Loads the individuals streamed by the ResultsWriter, only the
+        required columns and the given metadata columns are read.
+        """
+        meta = read_run_meta(run_dir)
+        self.accuracy_limit = meta['min_accuracy']
+        self.explorable_module_names = meta['explorable_module_names']
+
+        metadata_columns = metadata_columns if metadata_columns is not None else []
+        table = read_run_table(run_dir, ['generation', 'individual', 'parameters', 'F', 'G'] + metadata_columns)
+        columns = table.to_pydict()
+
+        further_args = dict(meta['mating'])
+        if 'block_size' in meta:
+            further_args['block_size'] = meta['block_size']
+
+        G = np.array(columns['G'], dtype=np.float64).reshape(table.num_rows, -1)
+        self._set_rows(self._accuracies_from_constraints(G), columns['parameters'], columns['generation'],
+                       columns['individual'], columns['F'], [further_args] * table.num_rows)
+
+        for key in metadata_columns:
+            self.metadata[key] = _build_column(columns[key])
+
+    def to_compact(self) -> dict:
+        """Returns the arrays of the collection. The compact form is small and
+        fast to pickle, e.g. to send it between processes or to cache it on disk.
+        """
+        return {
+            'accuracy_limit': self.accuracy_limit,
+            'explorable_module_names': self.explorable_module_names,
+            'accuracies': self.accuracies,
+            'parameters': self.parameters,
+            'generations': self.generations,
+            'individual_idxs': self.individual_idxs,
+            'objectives': self.objectives,
+            'metadata': self.metadata
+        }
+
+    @classmethod
+    def from_compact(cls, compact: dict, parameter_tolerance: float = 1e-6) -> ResultsCollection:
+        collection = cls(parameter_tolerance=parameter_tolerance)
+        for key, value in compact.items():
+            setattr(collection, key, value)
+        return collection
+
+    def _take(self, rows):
+        """Keeps only the given rows (index array or boolean mask), in place"""
+        self.accuracies = self.accuracies[rows]
+        self.parameters = self.parameters[rows]
+        self.objectives = self.objectives[rows]
+        self.generations = self.generations[rows]
+        self.individual_idxs = self.individual_idxs[rows]
+        self.metadata = {key: column.take(rows) if isinstance(column, InternedColumn) else column[rows]
+                         for key, column in self.metadata.items()}
+        # row numbers changed
+        self._pareto_index = None
+
+    def subset(self, rows) -> ResultsCollection:
+        """Returns a new collection with the given rows (index array or boolean mask)"""
+        collection = ResultsCollection.from_compact(self.to_compact(), self.parameter_tolerance)
+        collection._take(rows)
+        return collection
 
     def merge(self, other: ResultsCollection):
         assert self.accuracy_limit == other.accuracy_limit
         assert self.explorable_module_names == other.explorable_module_names
-        self.individuals.extend(other.individuals)
+
+        other = other.subset(np.arange(len(other)))
+        if self._parameter_index is not None:
+            other._take(np.array([self._parameter_index.add(p) for p in other.parameters], dtype=bool))
+
+        if len(self) == 0:
+            self.accuracies, self.parameters, self.objectives = other.accuracies, other.parameters, other.objectives
+        else:
+            self.accuracies = np.concatenate([self.accuracies, other.accuracies])
+            self.parameters = np.concatenate([self.parameters, other.parameters])
+            self.objectives = np.concatenate([self.objectives, other.objectives])
+        self.generations = np.concatenate([self.generations, other.generations])
+        self.individual_idxs = np.concatenate([self.individual_idxs, other.individual_idxs])
+
+        n_before = len(self.generations) - len(other.generations)
+        for key in set(self.metadata) | set(other.metadata):
+            column = self.metadata.get(key, None)
+            other_column = other.metadata.get(key, None)
+            if column is None:
+                column = _missing_column(other_column, n_before)
+            if other_column is None:
+                other_column = _missing_column(column, len(other))
+
+            if isinstance(column, InternedColumn) or isinstance(other_column, InternedColumn):
+                if not isinstance(column, InternedColumn):
+                    column = InternedColumn(column.tolist())
+                if not isinstance(other_column, InternedColumn):
+                    other_column = InternedColumn(other_column.tolist())
+                column.extend(other_column)
+            else:
+                column = np.concatenate([column, other_column])
+            self.metadata[key] = column
+
+        if self._pareto_index is not None:
+            new_rows = np.arange(n_before, len(self))
+            self._pareto_index.insert(new_rows, self.get_pareto_points()[new_rows])
 
     def drop_duplicate_parameters(self):
-        # in place
-        seen_lists = []
-        new_individuals = []
-        for ind in self.individuals:
-            if ind.parameter not in seen_lists:
-                seen_lists.append(ind.parameter)
-                new_individuals.append(ind)
-        self.individuals = new_individuals
+        """Keeps the first individual of every parameter vector (in place).
+        Afterwards the collection stays free of duplicates when merging.
+        """
+        if self._parameter_index is not None:
+            return
+
+        self._parameter_index = ParameterIndex(self.parameter_tolerance)
+        self._take(np.array([self._parameter_index.add(p) for p in self.parameters], dtype=bool))
+
+    @property
+    def accuracy(self) -> np.ndarray:
+        """The first accuracy of every individual"""
+        return self.accuracies[:, 0]
+
+    @property
+    def individuals(self) -> list:
+        return self.get_individuals()
+
+    def get_individuals(self, rows=None) -> list:
+        """Creates ResultEntry objects of the given rows
+
+        Args:
+            rows (optional): index array or boolean mask, None for all individuals
+
+        Returns:
+            list: List of individuals, not a ResultCollection
+        """
+        rows = np.arange(len(self)) if rows is None else np.arange(len(self))[rows]
+        return [
+            ResultEntry(accuracies=self.accuracies[row],
+                        parameter=self.parameters[row].tolist(),
+                        generation=int(self.generations[row]),
+                        individual_idx=int(self.individual_idxs[row]),
+                        further_objectives=self.objectives[row],
+                        pymoo_mating=None,
+                        further_args=self._row_metadata(row))
+            for row in rows
+        ]
+
+    def _row_metadata(self, row: int) -> dict:
+        args = {}
+        for key, column in self.metadata.items():
+            value = column.values[column.codes[row]] if isinstance(column, InternedColumn) else column[row]
+            if value is not None and not (isinstance(value, float) and np.isnan(value)):
+                args[key] = value
+        return args
 
     def get_weighted_params_sorted_individuals(self, index: int = 0) -> list:
         """Get all individuals sorted by a given objective index
@@ -77,22 +296,84 @@ class ResultsCollection():
         Returns:
             list: List of individuals, not a ResultCollection
         """
-        return sorted(self.individuals, key=lambda ind: ind.further_objectives[index])
+        return self.get_individuals(np.argsort(self.objectives[:, index], kind='stable'))
 
     def get_accuracy_sorted_individuals(self) -> list:
-        return sorted(self.individuals,
-                      reverse=True,
-                      key=lambda ind: ind.accuracy)
+        return self.get_individuals(np.argsort(-self.accuracy, kind='stable'))
 
     def get_better_than_individuals(self, acc_threshold: float) -> list:
-        return [ind for ind in self.individuals if ind.accuracy >= acc_threshold]
+        return self.get_individuals(self.accuracy >= acc_threshold)
+
+    def get_pareto_points(self) -> np.ndarray:
+        """Coordinates used for the pareto queries, all minimized: the negated
+        accuracies and the objectives. This covers the single objective
+        quantization problems (accuracy against bits or energy) as well as
+        the two objective sparsity problem.
+        """
+        return np.hstack([-self.accuracies, self.objectives])
+
+    @property
+    def pareto_index(self) -> ParetoIndex:
+        if self._pareto_index is None:
+            self._pareto_index = ParetoIndex()
+            self._pareto_index.insert(np.arange(len(self)), self.get_pareto_points())
+        return self._pareto_index
+
+    def get_pareto_front(self, k: int = 0) -> list:
+        """Get the individuals of the k-th non-dominated front, front 0 is the
+        pareto front and is kept up to date while merging.
+
+        Args:
+            k (int, optional): index of the front. Defaults to 0.
+
+        Returns:
+            list: List of individuals, not a ResultCollection
+        """
+        if k == 0:
+            return self.get_individuals(np.sort(self.pareto_index.rows))
+
+        fronts = non_dominated_fronts(self.get_pareto_points(), k)
+        if len(fronts) <= k:
+            return []
+        return self.get_individuals(np.sort(fronts[k]))
+
+    def get_best_individual(self, min_accuracy: float, objective: int = 0) -> ResultEntry:
+        """Get the individual with the lowest objective value among all
+        individuals with an accuracy of at least min_accuracy. The optimum is
+        always part of the pareto front, hence only the front is searched.
+
+        Args:
+            min_accuracy (float): lower limit of the (first) accuracy
+            objective (int, optional): index of the minimized objective. Defaults to 0.
+
+        Returns:
+            ResultEntry: the best individual or None if no individual is accurate enough
+        """
+        rows = self.pareto_index.rows
+        rows = rows[self.accuracy[rows] >= min_accuracy]
+        if len(rows) == 0:
+            return None
+
+        # ties are broken by the higher accuracy
+        best = rows[np.lexsort((-self.accuracy[rows], self.objectives[rows, objective]))[0]]
+        return self.get_individuals([best])[0]
 
     def to_dataframe(self) -> pd.DataFrame:
-        return pd.DataFrame.from_records(
-            [r.to_dict() for r in self.individuals])
+        columns = {
+            'generation': self.generations,
+            'individual': self.individual_idxs,
+            'accuracies': list(self.accuracies)
+        }
+        for i in range(self.objectives.shape[1]):
+            columns[f'F_{i}'] = self.objectives[:, i]
+        for key, column in self.metadata.items():
+            columns[key] = column.to_list() if isinstance(column, InternedColumn) else column
+        columns['parameters'] = self.parameters.tolist()
+
+        return pd.DataFrame(columns)
 
     def __len__(self) -> int:
-        return len(self.individuals)
+        return len(self.generations)
 
     def __iter__(self) -> iter:
-        yield next(self.individuals)
+        return iter(self.get_individuals())
@@ -0,0 +1,133 @@
+import os
+import glob
+import json
+import socket
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from datetime import datetime
+
+from pymoo.core.callback import Callback
+from pymoo.core.mating import Mating
+from pymoo.algorithms.moo.nsga2 import NSGA2
+import pymoo.operators.mutation.pm
+import pymoo.operators.crossover.sbx
+import pymoo.operators.selection.tournament
+
+from model_explorer.utils.logger import logger
+
+
+RUN_META_FILE = "run_meta.json"
+GENERATION_FILE_PATTERN = "generation_{:05d}.parquet"
+
+
+def get_mating_settings(mating: Mating) -> dict:
+    """Extracts the numeric settings of the mating operators, which are stored
+    with the results instead of the operator objects.
+    """
+    settings = {}
+    if isinstance(mating.mutation, pymoo.operators.mutation.pm.PolynomialMutation):
+        settings['mutation_eta'] = mating.mutation.eta.value
+        settings['mutation_prob'] = mating.mutation.prob.value
+    if isinstance(mating.crossover, pymoo.operators.crossover.sbx.SBX):
+        settings['crossover_eta'] = mating.crossover.eta.value
+        settings['crossover_prob'] = mating.crossover.prob.value
+    if isinstance(mating.selection, pymoo.operators.selection.tournament.TournamentSelection):
+        settings['selection_press'] = mating.selection.pressure
+    return settings
+
+
+class ResultsWriter(Callback):
+    """Streams every evaluated individual into a run directory while the
+    exploration is running. After each generation the individuals evaluated
+    in it are appended as a new Parquet file with one row per individual
+    (generation, individual, parameters, F, G and the metadata outputs of the
+    problem). The run_meta.json file holds everything that is the same for all
+    rows, e.g. the accuracy limit and the explorable module names.
+    """
+
+    def __init__(self, run_dir: str, run_meta: dict = None) -> None:
+        super().__init__()
+        self.run_dir = run_dir
+        self.run_meta = run_meta if run_meta is not None else {}
+        self.rows_written = 0
+
+        os.makedirs(self.run_dir, exist_ok=True)
+
+    def initialize(self, algorithm: NSGA2):
+        problem = algorithm.problem
+        meta = dict(self.run_meta)
+        meta.update({
+            'min_accuracy': problem.min_accuracy,
+            'explorable_module_names': problem.model.explorable_module_names,
+            'n_var': problem.n_var,
+            'n_obj': problem.n_obj,
+            'n_constr': problem.n_constr,
+            'metadata_keys': list(getattr(problem, 'result_metadata_keys', [])),
+            'mating': get_mating_settings(algorithm.mating),
+            'hostname': socket.gethostname(),
+            'started': datetime.now().isoformat(timespec='seconds')
+        })
+        if hasattr(problem.model, '_block_size'):
+            meta['block_size'] = problem.model._block_size
+
+        with open(os.path.join(self.run_dir, RUN_META_FILE), 'w') as f:
+            json.dump(meta, f, indent=2, default=str)
+
+        self.metadata_keys = meta['metadata_keys']
+
+    def notify(self, algorithm: NSGA2):
+        # the offspring are exactly the individuals evaluated in this generation,
+        # the initial generation has none and all of its population was evaluated
+        individuals = getattr(algorithm, 'off', None)
+        if individuals is None:
+            individuals = algorithm.pop
+        if individuals is None or len(individuals) == 0:
+            return
+
+        columns = {
+            'generation': np.full(len(individuals), algorithm.n_iter - 1, dtype=np.int64),
+            'individual': np.arange(len(individuals), dtype=np.int64),
+            'parameters': individuals.get("X").astype(np.float64).tolist(),
+            'F': individuals.get("F").astype(np.float64).tolist(),
+            'G': individuals.get("G").astype(np.float64).tolist(),
+        }
+        for key in self.metadata_keys:
+            values = individuals.get(key)
+            if values is not None and all(v is not None for v in values):
+                columns[key] = np.asarray(values, dtype=np.float64)
+
+        filename = os.path.join(self.run_dir, GENERATION_FILE_PATTERN.format(algorithm.n_iter - 1))
+        pq.write_table(pa.table(columns), filename)
+        self.rows_written += len(individuals)
+
+        logger.debug(f"Wrote {len(individuals)} individuals to {filename}")
+
+
+def is_run_directory(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, RUN_META_FILE))
+
+
+def read_run_meta(run_dir: str) -> dict:
+    with open(os.path.join(run_dir, RUN_META_FILE), 'r') as f:
+        return json.load(f)
+
+
+def read_run_table(run_dir: str, columns: list = None) -> pa.Table:
+    """Reads the rows of a streamed run, only the given columns are loaded
+    from the generation files.
+
+    Args:
+        run_dir (str): run directory written by the ResultsWriter
+        columns (list, optional): columns to load, None loads all
+
+    Returns:
+        pa.Table: one row per evaluated individual
+    """
+    files = sorted(glob.glob(os.path.join(run_dir, "generation_*.parquet")))
+    if len(files) == 0:
+        raise ValueError(f"Result run at {run_dir} has no evaluated individuals")
+
+    return ds.dataset(files, format='parquet').to_table(columns=columns)
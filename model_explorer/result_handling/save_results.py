@@ -52,6 +52,32 @@ def save_result_pickle(res: pymoo.core.result.Result,
     logger.info(f"Saved result object to: {filename}")
 
 
+def get_run_directory(problem_name: str = "", model_name: str = "", dataset_name: str = "") -> str:
+    """Directory for the streamed results of an exploration run, named like
+    the result pickles and also including the slurm job id if present.
+
+    Args:
+        problem_name (str, optional): Name of the problem. Defaults to "".
+        model_name (str, optional): Model name. Defaults to "".
+        dataset_name (str, optional): Dataset name. Defaults to "".
+
+    Returns:
+        str: path inside the RESULTS_DIR
+    """
+    date_str = datetime.now().strftime("%Y-%m-%d_%H-%M")
+
+    if 'SLURM_ARRAY_TASK_ID' in os.environ:
+        dirname = 'expl_{}_{}_{}_{}_slurmid_{}'.format(
+            problem_name, model_name, dataset_name, date_str, os.environ['SLURM_ARRAY_TASK_ID']
+        )
+    else:
+        dirname = 'expl_{}_{}_{}_{}'.format(
+            problem_name, model_name, dataset_name, date_str
+        )
+
+    return os.path.join(RESULTS_DIR, dirname)
+
+
 def save_results_df_to_csv(name: str, result_df: pd.DataFrame,
                            problem_name: str, model_name: str,
                            dataset_name: str):
@@ -1,7 +1,14 @@
+import os
+import json
+import math
 import torch
+import numpy as np
 from torch.utils.data import DataLoader, Subset, RandomSampler
 import webdataset as wds
 
+from model_explorer.utils.logger import logger
+from model_explorer.utils.preprocessed_dataset import build_preprocessed_dataset
+
 
 class DataLoaderGenerator:
     """Generator for different dataloaders depending on the sample limit."""
@@ -12,7 +19,15 @@ class DataLoaderGenerator:
                  batch_size: int = 32,
                  items: int = None,
                  limit: int = None,
-                 randomize: bool = False) -> None:
+                 randomize: bool = False,
+                 preprocessed_cache: dict = None,
+                 subset_seed: int = None,
+                 subset_file: str = None,
+                 subset_source: str = None,
+                 num_workers: int = 4,
+                 persistent_workers: bool = False,
+                 prefetch_factor: int = None,
+                 pin_memory: bool = None) -> None:
         """Inits a dataloader generator with the given parameters and configures
         the batch size for all generated data loaders.
 
@@ -28,6 +43,29 @@ class DataLoaderGenerator:
                 Limit the amount of total samples
             randomize (bool):
                 If set to true, the dataset will be shuffled
+            preprocessed_cache (dict):
+                Serve the transformed samples from a memory-mapped file, keys
+                are dir, dtype (storage) and context (dataset settings). With
+                randomize and limit, a frozen subset is required
+            subset_seed (int):
+                Together with randomize, the limited subset is drawn once with
+                this seed and used for every dataloader (frozen subset)
+            subset_file (str):
+                Json file the frozen subset indices are read from if it
+                exists, otherwise the drawn indices are stored there
+            subset_source (str):
+                Dataset the frozen subset is drawn from (e.g. its path), stored
+                in the subset file together with the seed and checked on reuse
+            num_workers (int):
+                Number of dataloader worker processes, 0 loads in the main process
+            persistent_workers (bool):
+                Keep the workers alive between the iterations of the dataloader,
+                they are otherwise started again for every evaluated individual
+            prefetch_factor (int):
+                Batches loaded in advance by each worker, None uses the torch default
+            pin_memory (bool):
+                Use page-locked memory for faster host to GPU copies, None
+                enables it if cuda is available
         """
         assert dataset is not None, "A dataset has to be provided."
 
@@ -36,8 +74,14 @@ class DataLoaderGenerator:
                     options with the total amount of elements in the dataset"
             assert limit is None, "webdataset types do not support limits, as shuffling is not working across shards"
             assert randomize is False, "webdatasets do not support random selection"
+            assert preprocessed_cache is None, "webdatasets cannot be preprocessed"
+            assert subset_seed is None and subset_file is None, "webdatasets do not support frozen subsets"
             self.kind = 'wds'
         elif isinstance(dataset, torch.utils.data.dataset.Dataset):
+            # randomly limited samples could be any of the dataset, only a frozen subset is cached
+            assert preprocessed_cache is None or not randomize or limit is None or \
+                subset_seed is not None or subset_file is not None, \
+                "A preprocessed cache of a random sample limit requires a frozen subset (subset_seed or subset_file)"
             self.kind = 'torch_ds'
         else:
             raise ValueError("Only supporting Webdataset or Torch Datasets")
@@ -48,8 +92,23 @@ class DataLoaderGenerator:
         self.limit = limit
         self.dataloader = None
         self.randomize = randomize
+        self.preprocessed_cache = preprocessed_cache
+        self.subset_seed = subset_seed
+        self.subset_file = subset_file
+        self.subset_source = subset_source
+        # sample indices of a deterministic subset, None if samples are drawn per dataloader
+        self.subset_indices = None
+
+        self.num_workers = num_workers
+        self.persistent_workers = persistent_workers and num_workers > 0
+        self.prefetch_factor = prefetch_factor
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
 
-        self._create_data_loader()
+        if self.kind == 'torch_ds':
+            if self.randomize and (self.subset_seed is not None or self.subset_file is not None):
+                self.subset_indices = self._get_frozen_subset_indices()
+            elif not self.randomize and self.limit is not None:
+                self.subset_indices = list(range(self.limit))
 
         if self.kind == 'wds':
             self.length = items
@@ -58,14 +117,25 @@ class DataLoaderGenerator:
             self.length = len(self.dataset)
             if self.limit:
                 self.length = self.limit
-            self.n_batches = len(self.dataloader) // batch_size
+            # len() of the dataloader, which is only created on first use
+            self.n_batches = math.ceil(self.length / batch_size) // batch_size
 
     def __len__(self) -> int:
         return self.length
 
     def get_dataloader(self) -> DataLoader:
+        # created on first use, unpickled generators (e.g. of result files) never touch the dataset
+        if self.dataloader is None:
+            self._create_data_loader()
         return self.dataloader
 
+    def __getstate__(self) -> dict:
+        # a persistent dataloader holds an iterator with live worker processes,
+        # which cannot be pickled (history copies, spawned runner workers)
+        state = self.__dict__.copy()
+        state['dataloader'] = None
+        return state
+
     def _create_data_loader(self):
         """This method creates the internal dataloader with a given sample limit
         """
@@ -73,16 +143,62 @@ class DataLoaderGenerator:
         dataset = self.dataset
         sampler = None
 
-        if self.randomize:
+        if self.preprocessed_cache is not None:
+            # only the samples that can be drawn are materialized
+            indices = self.subset_indices
+            if indices is None:
+                indices = list(range(len(dataset)))
+            dataset = build_preprocessed_dataset(dataset, indices,
+                                                 cache_dir=self.preprocessed_cache['dir'],
+                                                 context=self.preprocessed_cache.get('context', {}),
+                                                 storage_dtype=self.preprocessed_cache.get('dtype', 'float16'))
+        elif self.subset_indices is not None:
+            dataset = Subset(dataset, indices=self.subset_indices)
+
+        if self.randomize and self.subset_indices is None:
             sampler = RandomSampler(dataset, num_samples=self.limit)
-        else:
-            if self.limit is not None:
-                # FIXME: add random range instead of range
-                dataset = Subset(dataset, indices=list(range(self.limit)))
 
+        # the prefetch factor is only accepted by torch if workers are used
+        worker_kwargs = {}
+        if self.num_workers > 0 and self.prefetch_factor is not None:
+            worker_kwargs['prefetch_factor'] = self.prefetch_factor
+
+        # get_dataloader always returns this instance, persistent workers therefore survive between individuals
         self.dataloader = DataLoader(dataset=dataset,
-                                     num_workers=4,
+                                     num_workers=self.num_workers,
+                                     persistent_workers=self.persistent_workers,
                                      batch_size=self.batch_size,
                                      collate_fn=self.collate_fn,
-                                     pin_memory=torch.cuda.is_available(),
-                                     sampler=sampler)
+                                     pin_memory=self.pin_memory,
+                                     sampler=sampler,
+                                     **worker_kwargs)
+
+    def _get_frozen_subset_indices(self) -> list:
+        """Draws the random subset once, it is read from the subset file if it
+        exists, hence reruns and worker processes use the same samples.
+        """
+        if self.subset_file is not None and os.path.exists(self.subset_file):
+            with open(self.subset_file, 'r') as f:
+                subset = json.load(f)
+            indices = subset['indices']
+            assert self.limit is None or len(indices) == self.limit, \
+                f"Subset file {self.subset_file} does not match the sample limit"
+            assert subset.get('seed') == self.subset_seed and subset.get('source') == self.subset_source \
+                and subset.get('dataset_size') == len(self.dataset), \
+                f"Subset file {self.subset_file} was drawn with another seed or dataset, remove it to draw a new subset"
+            logger.debug(f"Loaded frozen subset of {len(indices)} samples from {self.subset_file}")
+            return indices
+
+        n_samples = self.limit if self.limit is not None else len(self.dataset)
+        rng = np.random.default_rng(self.subset_seed)
+        # sorted, neighbouring samples are read together from disk
+        indices = sorted(rng.choice(len(self.dataset), size=n_samples, replace=False).tolist())
+
+        if self.subset_file is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.subset_file)), exist_ok=True)
+            with open(self.subset_file, 'w') as f:
+                json.dump({'seed': self.subset_seed, 'source': self.subset_source,
+                           'dataset_size': len(self.dataset), 'indices': indices}, f)
+            logger.info(f"Stored frozen subset of {n_samples} samples in {self.subset_file}")
+
+        return indices
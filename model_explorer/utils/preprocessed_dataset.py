@@ -0,0 +1,153 @@
+import os
+import json
+import shutil
+import pickle
+import hashlib
+import tempfile
+import torch
+import numpy as np
+
+from tqdm import tqdm
+from torch.utils.data import Dataset, DataLoader, Subset
+
+from model_explorer.utils.logger import logger
+
+STORAGE_DTYPES = {'float16': np.float16, 'float32': np.float32, 'uint8': np.uint8}
+
+
+def _identity_collate(batch):
+    return batch
+
+
+class PreprocessedTensorDataset(Dataset):
+    """Serves samples of a dataset whose transformation (decoding, resizing,
+    cropping, normalization, ...) was already applied once and written to a
+    memory-mapped tensor file. The first element of each sample has to be a
+    tensor with the same shape for all samples (the image), the remaining
+    elements (labels, paths, ...) are kept in a pickle file.
+
+    Images are read zero-copy from the file, only the conversion from the
+    storage dtype to the dtype of the original samples copies.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+        with open(os.path.join(directory, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, 'extras.pkl'), 'rb') as f:
+            self.extras = pickle.load(f)
+
+        self.sample_dtype = getattr(torch, self.meta['sample_dtype'])
+        self._images = None
+
+    def _open(self):
+        # copy on write: torch gets a writable array, but the file is never modified
+        self._images = np.memmap(os.path.join(self.directory, 'images.npy'),
+                                 dtype=STORAGE_DTYPES[self.meta['storage_dtype']], mode='c',
+                                 shape=tuple(self.meta['shape']))
+
+    def __len__(self) -> int:
+        return self.meta['shape'][0]
+
+    def __getitem__(self, index):
+        if self._images is None:
+            self._open()
+
+        image = torch.from_numpy(self._images[index])
+        if image.dtype != self.sample_dtype:
+            image = image.to(self.sample_dtype)
+
+        return (image, *self.extras[index])
+
+    def __getstate__(self):
+        # memmaps would be pickled with their whole content, workers reopen the file instead
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+
+def preprocessed_dataset_key(dataset: Dataset, indices: list, context: dict) -> str:
+    """Hash of everything that determines the preprocessed samples: the dataset
+    settings (path, type, ...), the transform and the sample indices.
+    """
+    description = {
+        'context': context,
+        'dataset': type(dataset).__name__,
+        'transform': repr(getattr(dataset, 'transform', None)),
+        'indices': indices
+    }
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def build_preprocessed_dataset(dataset: Dataset, indices: list, cache_dir: str, context: dict,
+                               storage_dtype: str = 'float16', num_workers: int = 4) -> PreprocessedTensorDataset:
+    """Returns the preprocessed version of the given samples, they are
+    materialized on the first call and read from the cache directory afterwards.
+
+    Args:
+        dataset (Dataset): map style dataset including its transformation
+        indices (list): the samples of the dataset that are cached
+        cache_dir (str): directory of all preprocessed datasets
+        context (dict): settings of the dataset, part of the cache key
+        storage_dtype (str, optional): float16, float32 or uint8, images that
+            are already uint8 are always stored as uint8. Defaults to 'float16'.
+        num_workers (int, optional): dataloader workers used for materializing
+
+    Returns:
+        PreprocessedTensorDataset: dataset reading from the cache file
+    """
+    assert storage_dtype in STORAGE_DTYPES, f"storage dtype has to be one of {list(STORAGE_DTYPES)}"
+
+    key = preprocessed_dataset_key(dataset, indices, dict(context, storage_dtype=storage_dtype))
+    directory = os.path.join(cache_dir, key)
+
+    if os.path.exists(os.path.join(directory, 'meta.json')):
+        logger.debug(f"Using preprocessed dataset {directory}")
+        return PreprocessedTensorDataset(directory)
+
+    logger.info(f"Preprocessing {len(indices)} samples to {directory}")
+    os.makedirs(cache_dir, exist_ok=True)
+    # everything is written to a temporary directory first, concurrent runs then never see partial files
+    tmp_directory = tempfile.mkdtemp(dir=cache_dir, prefix=f"{key}.tmp")
+
+    loader = DataLoader(Subset(dataset, indices), batch_size=64, num_workers=num_workers,
+                        collate_fn=_identity_collate)
+    images = None
+    extras = []
+    position = 0
+
+    for batch in tqdm(loader, ascii=True, desc="Preprocessing"):
+        for image, *sample_extras in batch:
+            assert isinstance(image, torch.Tensor), "The first element of a sample has to be a tensor"
+
+            if images is None:
+                meta = {
+                    'shape': [len(indices)] + list(image.shape),
+                    'sample_dtype': str(image.dtype).replace('torch.', ''),
+                    'storage_dtype': 'uint8' if image.dtype == torch.uint8 else storage_dtype
+                }
+                images = np.memmap(os.path.join(tmp_directory, 'images.npy'),
+                                   dtype=STORAGE_DTYPES[meta['storage_dtype']], mode='w+',
+                                   shape=tuple(meta['shape']))
+
+            assert list(image.shape) == meta['shape'][1:], "Samples need equal shapes to be preprocessed"
+            images[position] = image.numpy()
+            extras.append(tuple(sample_extras))
+            position += 1
+
+    images.flush()
+    del images
+
+    with open(os.path.join(tmp_directory, 'extras.pkl'), 'wb') as f:
+        pickle.dump(extras, f)
+    with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    try:
+        os.replace(tmp_directory, directory)
+    except OSError:
+        # another process finished the same dataset first
+        shutil.rmtree(tmp_directory)
+
+    return PreprocessedTensorDataset(directory)
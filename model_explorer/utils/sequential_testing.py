@@ -0,0 +1,62 @@
+import math
+
+
+class SequentialAccuracyTest():
+    """Decides during an accuracy evaluation whether the accuracy constraint is
+    surely violated or surely satisfied by a margin, so that the remaining
+    batches do not have to be evaluated.
+
+    Every sample contributes a score in [0, 1] (e.g. 1 for a correct
+    prediction). After each batch a Hoeffding confidence interval around the
+    running mean is checked. The confidence is split over all checks
+    (delta / (k * (k + 1)) for the k-th check), hence the decision holds with
+    the given confidence no matter after which batch the evaluation stops.
+    """
+
+    def __init__(self, min_accuracy: float, confidence: float = 0.95, margin: float = 0.0,
+                 min_samples: int = 0) -> None:
+        assert 0 < confidence < 1, "The confidence has to be between 0 and 1"
+
+        self.min_accuracy = min_accuracy
+        self.delta = 1 - confidence
+        self.margin = margin
+        self.min_samples = min_samples
+
+        self.score_sum = 0.0
+        self.n_samples = 0
+        self.n_checks = 0
+        self.decision = None
+
+    def update(self, score_sum: float, n_samples: int) -> bool:
+        """Adds the scores of one batch.
+
+        Args:
+            score_sum (float): sum of the per sample scores of the batch
+            n_samples (int): number of samples in the batch
+
+        Returns:
+            bool: True if the evaluation can be stopped
+        """
+        self.score_sum += float(score_sum)
+        self.n_samples += n_samples
+        self.n_checks += 1
+
+        if self.n_samples < self.min_samples:
+            return False
+
+        bound = self.bound()
+        accuracy = self.accuracy()
+        if accuracy + bound < self.min_accuracy:
+            self.decision = 'violated'
+        elif accuracy - bound > self.min_accuracy + self.margin:
+            self.decision = 'satisfied'
+
+        return self.decision is not None
+
+    def accuracy(self) -> float:
+        return self.score_sum / self.n_samples if self.n_samples > 0 else 0.0
+
+    def bound(self) -> float:
+        """Half width of the confidence interval of the current check"""
+        delta = self.delta / (self.n_checks * (self.n_checks + 1))
+        return math.sqrt(math.log(2 / delta) / (2 * self.n_samples))
@@ -12,6 +12,11 @@ TRANSFORMS_FOLDER = "..transforms"
 DATASETS_FOLDER = "..datasets"
 PROBLEMS_FOLDER = "..problems"
 
+# dataset settings that do not change the preprocessed samples (the indices are part of the key)
+PREPROCESSING_INDEPENDENT_SETTINGS = ['batch_size', 'sample_limit', 'randomize', 'total_samples', 'preprocessed_cache',
+                                      'subset_seed', 'subset_file', 'num_workers', 'persistent_workers',
+                                      'prefetch_factor', 'pin_memory']
+
 
 def setup_workload(model_settings: dict) -> list:
     """This function sets up the model and returns the model as well as the accuracy function.
@@ -37,6 +42,17 @@ def setup_workload(model_settings: dict) -> list:
     return model, accuracy_function
 
 
+def get_population_accuracy_function(model_settings: dict) -> callable:
+    """Returns the population variant of the accuracy function of the model,
+    which evaluates several individuals in one forward pass, or None if the
+    accuracy function module does not define `population_accuracy_function`.
+    """
+    return getattr(importlib.import_module(
+        f"{ACCURACY_FUNCTIONS_FOLDER}.{model_settings['accuracy_function']}",
+        package=__package__,
+    ), 'population_accuracy_function', None)
+
+
 def get_prepare_exploration_function(problem_name: str) -> list:
     """This function returns the preparation function which is defined in the
     problem file together the repair and sampling method. Functions are loaded
@@ -127,12 +143,28 @@ def build_dataloader_generators(settings_dict: dict) -> dict:
     ret_dict = {}
     for dataset_name, dataset_settings in settings_dict.items():
         dataset, collate = setup_dataset(dataset_settings)
+        # identifies the dataset a frozen subset was drawn from
+        subset_source = str(dataset_settings.get('path', dataset_settings['type']))
+        preprocessed_cache = None
+        if dataset_settings.get('preprocessed_cache', None) is not None:
+            preprocessed_cache = {'dir': dataset_settings['preprocessed_cache'],
+                                  'dtype': dataset_settings.get('preprocessed_dtype', 'float16'),
+                                  'context': {k: v for k, v in dataset_settings.items()
+                                              if k not in PREPROCESSING_INDEPENDENT_SETTINGS}}
         loader_generator = DataLoaderGenerator(dataset,
                                                collate,
                                                items=dataset_settings.get('total_samples', None),
                                                batch_size=dataset_settings['batch_size'],
                                                limit=dataset_settings.get('sample_limit', None),
-                                               randomize=dataset_settings.get('randomize', False))
+                                               randomize=dataset_settings.get('randomize', False),
+                                               preprocessed_cache=preprocessed_cache,
+                                               subset_seed=dataset_settings.get('subset_seed', None),
+                                               subset_file=dataset_settings.get('subset_file', None),
+                                               subset_source=subset_source,
+                                               num_workers=dataset_settings.get('num_workers', 4),
+                                               persistent_workers=dataset_settings.get('persistent_workers', False),
+                                               prefetch_factor=dataset_settings.get('prefetch_factor', None),
+                                               pin_memory=dataset_settings.get('pin_memory', None))
         ret_dict[dataset_name] = loader_generator
 
     return ret_dict
@@ -0,0 +1,170 @@
+import os
+import json
+import yaml
+import hashlib
+import tempfile
+import subprocess
+
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from model_explorer.utils.logger import logger
+from model_explorer.third_party.timeloop.scripts.parse_timeloop_output import parse_timeloop_stats
+
+# fields of the layer problem in the timeloop workload description
+SIGNATURE_KEYS = ['R', 'S', 'P', 'Q', 'C', 'K', 'N', 'Wstride', 'Hstride']
+
+
+def get_layer_signature(layer) -> tuple:
+    """Timeloop problem of a convolution layer from its torchinfo LayerInfo,
+    layers with equal signatures have the same mapping and energy.
+
+    Returns:
+        tuple: (R, S, P, Q, C, K, N, Wstride, Hstride)
+    """
+    w = layer.input_size[2]
+    h = layer.input_size[3]
+    s = layer.kernel_size[0]
+    r = layer.kernel_size[1]
+    w_pad = layer.module.padding[0]
+    h_pad = layer.module.padding[1]
+    w_stride = layer.module.stride[0]
+    h_stride = layer.module.stride[1]
+
+    q = int((w - s + 2 * w_pad) / w_stride) + 1
+    p = int((h - r + 2 * h_pad) / h_stride) + 1
+
+    return (layer.kernel_size[1], layer.kernel_size[0], p, q, layer.input_size[1], layer.output_size[1],
+            layer.input_size[0], w_stride, h_stride)
+
+
+def _extract_dram_stats(timeloop_result: dict) -> dict:
+    """Keeps the values of the parsed timeloop statistics that are used by the
+    energy analysis, as plain floats that can be stored as json.
+    """
+    dram = timeloop_result['energy_breakdown_pJ']['DRAM']
+    stats = {'energy_pJ': float(timeloop_result['energy_pJ'])}
+    for key, name in [('reads_per_instance', 'reads'), ('updates_per_instance', 'updates'),
+                      ('fills_per_instance', 'fills'), ('energy_per_access_per_instance', 'energy')]:
+        for i, tensor in enumerate(['w', 'i', 'o']):
+            stats[f'{tensor}_{name}'] = float(dram[key][i])
+    stats['total_dram_energy'] = float(dram['energy'])
+    return stats
+
+
+class TimeloopRunner():
+    """Maps layer problems with timeloop-mapper, several mapper processes run
+    concurrently. Every distinct (signature, bit width) pair is only mapped
+    once, the parsed results are cached on disk under the signature, the bit
+    width and the hash of the architecture config. Analysing another model
+    or batch size then only maps the new shapes.
+    """
+
+    def __init__(self, binary: str, config_file: str, work_dir: str, cache_dir: str,
+                 lib_path: str = None, jobs: int = 1) -> None:
+        self.binary = binary
+        self.lib_path = lib_path
+        self.work_dir = work_dir
+        self.cache_dir = cache_dir
+        self.jobs = jobs
+
+        with open(config_file, "r") as f:
+            self.config_text = f.read()
+        self.config_hash = hashlib.sha1(self.config_text.encode()).hexdigest()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _job_name(self, signature: tuple, bits: int) -> str:
+        return hashlib.sha1(repr((self.config_hash, tuple(signature), bits)).encode()).hexdigest()
+
+    def _cache_file(self, signature: tuple, bits: int) -> str:
+        return os.path.join(self.cache_dir, f"{self._job_name(signature, bits)}.json")
+
+    def _read_cache(self, signature: tuple, bits: int) -> dict:
+        cache_file = self._cache_file(signature, bits)
+        if not os.path.exists(cache_file):
+            return None
+        with open(cache_file, 'r') as f:
+            return json.load(f)['stats']
+
+    def _write_cache(self, signature: tuple, bits: int, stats: dict):
+        cache_file = self._cache_file(signature, bits)
+        with tempfile.NamedTemporaryFile('w', dir=self.cache_dir, suffix='.tmp', delete=False) as f:
+            json.dump({'signature': list(signature), 'bits': bits, 'stats': stats}, f)
+        os.replace(f.name, cache_file)
+
+    def _map(self, signature: tuple, bits: int) -> dict:
+        timeloop_wd = os.path.join(self.work_dir, self._job_name(signature, bits))
+        os.makedirs(timeloop_wd, exist_ok=True)
+
+        altered_config_file = os.path.join(timeloop_wd, "layer.yaml")
+        projected_results_file = os.path.join(timeloop_wd, "timeloop-mapper.map+stats.xml")
+        timeloop_log_file = os.path.join(timeloop_wd, "timeloop.log")
+
+        # Alter config
+        config = yaml.load(self.config_text, Loader=yaml.SafeLoader)
+        for key, value in zip(SIGNATURE_KEYS, signature):
+            config['problem'][key] = value
+        config['problem']['Wdilation'] = 1
+        config['problem']['Hdilation'] = 1
+        # set bitwidth to a fixed bit value
+        if 'storage' in config['arch']:
+            for hierarchy_level in config['arch']['storage']:
+                if hierarchy_level['name'] == 'DRAM':
+                    hierarchy_level['word-bits'] = bits
+
+        with open(altered_config_file, "w") as f:
+            f.write(yaml.dump(config))
+
+        # a result of an earlier run in a reused work directory must not be parsed
+        if os.path.exists(projected_results_file):
+            os.remove(projected_results_file)
+
+        # run Timeloop
+        timeloop_env = os.environ.copy()
+        if self.lib_path is not None:
+            timeloop_env["LD_LIBRARY_PATH"] = self.lib_path
+
+        with open(timeloop_log_file, "w") as outfile:
+            subprocess.call([self.binary, altered_config_file],
+                            cwd=timeloop_wd,
+                            stdout=outfile,
+                            stderr=outfile,
+                            env=timeloop_env)
+
+        if not os.path.exists(projected_results_file):
+            return None
+
+        stats = _extract_dram_stats(parse_timeloop_stats(projected_results_file))
+        self._write_cache(signature, bits, stats)
+        return stats
+
+    def map_layers(self, signatures: list, bit_widths: list, progress: bool = True) -> dict:
+        """Maps all distinct signatures at all bit widths.
+
+        Args:
+            signatures (list): layer signatures, duplicates are mapped once
+            bit_widths (list): DRAM word bits each signature is mapped with
+            progress (bool, optional): show a progress bar. Defaults to True.
+
+        Returns:
+            dict: (signature, bits) -> DRAM statistics, None if no mapping was found
+        """
+        results = {}
+        jobs = []
+        for signature in dict.fromkeys(tuple(s) for s in signatures):
+            for bits in bit_widths:
+                results[(signature, bits)] = self._read_cache(signature, bits)
+                if results[(signature, bits)] is None:
+                    jobs.append((signature, bits))
+
+        logger.info(f"{len(results) - len(jobs)} layer mappings cached, mapping {len(jobs)} "
+                    f"with {self.jobs} concurrent job(s)")
+
+        # the work is done by the mapper processes, threads are sufficient to wait for them
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {executor.submit(self._map, *job): job for job in jobs}
+            for future in tqdm(as_completed(futures), total=len(futures), ascii=True, disable=not progress):
+                results[futures[future]] = future.result()
+
+        return results
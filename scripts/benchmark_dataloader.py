@@ -0,0 +1,85 @@
+import time
+import logging
+import argparse
+import torch
+
+from model_explorer.utils.logger import logger, set_console_logger_level
+from model_explorer.utils.workload import Workload
+from model_explorer.utils.setup import build_dataloader_generators, setup_workload, setup_torch_device
+
+
+def benchmark_individuals(dataloader_generator, model, device, individuals: int) -> list:
+    """Iterates the dataloader once per simulated individual, like an accuracy
+    function does, and measures the time until the first batch arrives
+    (worker startup) and the time spent in the model.
+
+    Returns:
+        list: (startup, loading, compute) seconds of each individual
+    """
+    timings = []
+
+    for _ in range(individuals):
+        startup, loading, compute = None, 0.0, 0.0
+
+        start = time.perf_counter()
+        last = start
+        for X, *_ in dataloader_generator.get_dataloader():
+            now = time.perf_counter()
+            if startup is None:
+                startup = now - start
+            else:
+                loading += now - last
+
+            if model is not None:
+                with torch.no_grad():
+                    model(X.to(device))
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+            last = time.perf_counter()
+            compute += last - now
+
+        timings.append((startup or 0.0, loading, compute))
+
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("workload", help="The path to the workload yaml file.")
+    parser.add_argument("-d", "--dataset", default="exploration",
+                        help="Name of the dataset block in the exploration section")
+    parser.add_argument("-n", "--individuals", type=int, default=5,
+                        help="Number of simulated individual evaluations")
+    parser.add_argument("--no-compute", action="store_true",
+                        help="Only load the data, skip the model forward pass")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show verbose information.")
+    opt = parser.parse_args()
+
+    if opt.verbose:
+        set_console_logger_level(level=logging.DEBUG)
+
+    workload = Workload(opt.workload)
+    dataset_settings = workload['exploration']['datasets'][opt.dataset]
+
+    device = setup_torch_device()
+    model = None
+    if not opt.no_compute:
+        model, _ = setup_workload(workload['model'])
+        model = model.to(device).eval()
+
+    # the configured settings against the former behaviour of restarting the workers per individual
+    configurations = {
+        'configured': dataset_settings,
+        'non-persistent': dict(dataset_settings, persistent_workers=False)
+    }
+
+    for name, settings in configurations.items():
+        dataloader_generator = build_dataloader_generators({opt.dataset: settings})[opt.dataset]
+        timings = benchmark_individuals(dataloader_generator, model, device, opt.individuals)
+
+        logger.info(f"{name} (workers: {dataloader_generator.num_workers}, "
+                    f"persistent: {dataloader_generator.persistent_workers}):")
+        for i, (startup, loading, compute) in enumerate(timings):
+            total = startup + loading + compute
+            logger.info(f"\tIndividual {i + 1}: startup {startup:.2f}s, loading {loading:.2f}s, "
+                        f"compute {compute:.2f}s, startup share {startup / total:.1%}")
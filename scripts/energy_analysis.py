@@ -1,8 +1,6 @@
 import os
 import sys
 import argparse
-import subprocess
-import yaml
 import logging
 
 # FIXME?
@@ -10,7 +8,6 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '../model_explorer/third
 
 import pandas as pd
 
-from tqdm import tqdm
 from torchinfo import summary
 from torchinfo.layer_info import LayerInfo
 from typing import List
@@ -19,7 +16,7 @@ from model_explorer.utils.logger import logger, set_console_logger_level
 from model_explorer.utils.workload import Workload
 from model_explorer.utils.setup import setup_workload, get_model_init_function, setup_torch_device
 
-from model_explorer.third_party.timeloop.scripts.parse_timeloop_output import parse_timeloop_stats
+from model_explorer.utils.timeloop_runner import TimeloopRunner, get_layer_signature
 
 from pytorch_quantization.nn import QuantConv2d
 
@@ -28,9 +25,17 @@ from pytorch_quantization.nn import QuantConv2d
 TIMELOOP_BITS = 16
 
 
-def compute_memory_saving(workload: Workload, progress: bool = True):
-    timeloop_binary = os.path.abspath(os.path.join(os.path.dirname(__file__), '../model_explorer/third_party/timeloop/bin/timeloop-mapper'))
-    timeloop_lib_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../model_explorer/third_party/timeloop/lib'))
+def compute_memory_saving(workload: Workload, progress: bool = True, jobs: int = 1,
+                          timeloop_binary: str = None, cache_dir: str = None, bit_widths: list = None):
+    energy_settings = workload['exploration']['energy_evaluation']
+    if bit_widths is None:
+        bit_widths = energy_settings.get('bit_widths', [TIMELOOP_BITS])
+    bit_widths = sorted(set(bit_widths))
+
+    timeloop_dir = os.path.join(os.path.dirname(__file__), '../model_explorer/third_party/timeloop')
+    if timeloop_binary is None:
+        timeloop_binary = os.path.abspath(os.path.join(timeloop_dir, 'bin/timeloop-mapper'))
+    timeloop_lib_path = os.path.abspath(os.path.join(timeloop_dir, 'lib'))
 
     if not os.path.exists(timeloop_binary):
         raise FileNotFoundError("Please build timeloop first (see model_explorer/third_party/timeloop)")
@@ -45,7 +50,7 @@ def compute_memory_saving(workload: Workload, progress: bool = True):
         kwargs['calibration_file'] = workload['calibration']['file']
     explorable_model = model_init_func(model, device, **kwargs)
 
-    input_shape = workload['exploration']['energy_evaluation']['input_shape']
+    input_shape = energy_settings['input_shape']
     assert len(input_shape) == 4, "Input shape has to be N, C, W, H"
 
     layer_list = summary(explorable_model.base_model, input_size=input_shape, verbose=0, depth=100)
@@ -55,123 +60,46 @@ def compute_memory_saving(workload: Workload, progress: bool = True):
         if isinstance(layer_info.module, QuantConv2d):
             timeloop_layers.append(layer_info)
 
-    print(f"working on {len(timeloop_layers)} layers with timeloop")
+    signatures = [get_layer_signature(layer) for layer in timeloop_layers]
+    print(f"working on {len(timeloop_layers)} layers ({len(set(signatures))} distinct shapes) with timeloop")
+
+    # Setup Paths
+    config_file = os.path.abspath(os.path.join(os.path.dirname(__file__), '../timeloop_eval/workload.yaml'))
+    timeloop_base_wd = os.path.abspath(os.path.dirname(config_file))
+    if cache_dir is None:
+        cache_dir = os.path.join(timeloop_base_wd, 'cache')
+
+    runner = TimeloopRunner(timeloop_binary, config_file,
+                            work_dir=os.path.join(timeloop_base_wd, 'layer'),
+                            cache_dir=cache_dir,
+                            lib_path=timeloop_lib_path,
+                            jobs=jobs)
+    mappings = runner.map_layers(signatures, bit_widths, progress)
 
+    # one row per layer and bit width, the quantized model interpolates between them
     layer: LayerInfo
-    results = {}
-    total_inference_energy = 0.0
-
-    for i, layer in enumerate(tqdm(timeloop_layers, ascii=True, disable=not progress)):
-        # Gather information about layer
-        w = layer.input_size[2]
-        h = layer.input_size[3]
-        s = layer.kernel_size[0]
-        r = layer.kernel_size[1]
-        w_pad = layer.module.padding[0]
-        h_pad = layer.module.padding[1]
-        w_stride = layer.module.stride[0]
-        h_stride = layer.module.stride[1]
-
-        q = int((w - s + 2 * w_pad) / w_stride) + 1
-        p = int((h - r + 2 * h_pad) / h_stride) + 1
-
-        # Setup Paths
-        config_file = os.path.abspath(os.path.join(os.path.dirname(__file__), '../timeloop_eval/workload.yaml'))
-        timeloop_base_wd = os.path.abspath(os.path.dirname(config_file))
-
-        timeloop_wd = os.path.join(timeloop_base_wd, f'layer/{i}')
-        if not os.path.exists(timeloop_wd):
-            os.makedirs(timeloop_wd)
-
-        altered_config_file = os.path.join(timeloop_wd, f"layer_{i}.yaml")
-        projected_results_file = os.path.join(timeloop_wd, "timeloop-mapper.map+stats.xml")
-        timeloop_log_file = os.path.join(timeloop_wd, "timeloop.log")
-
-        # Alter config
-        with open(config_file, "r") as f:
-            config = yaml.load(f, Loader=yaml.SafeLoader)
-
-        config['problem']['R'] = layer.kernel_size[1]
-        config['problem']['S'] = layer.kernel_size[0]
-        config['problem']['P'] = p
-        config['problem']['Q'] = q
-        config['problem']['C'] = layer.input_size[1]
-        config['problem']['K'] = layer.output_size[1]
-        config['problem']['N'] = layer.input_size[0]
-        config['problem']['Wstride'] = w_stride
-        config['problem']['Hstride'] = h_stride
-        config['problem']['Wdilation'] = 1
-        config['problem']['Hdilation'] = 1
-        # set bitwidth to a fixed bit value
-        if 'storage' in config['arch']:
-            for hierarchy_level in config['arch']['storage']:
-                if hierarchy_level['name'] == 'DRAM':
-                    hierarchy_level['word-bits'] = TIMELOOP_BITS
-        # if layer.output_size[1] % 16 != 0:
-        #     for constraint in config['mapspace']['constraints']:
-        #         if constraint['type'] == 'spatial':
-        #             start_k = constraint['factors'].find('K')
-        #             end_k = constraint['factors'].find(' ', start_k)
-        #             constraint['factors'] = constraint['factors'][:start_k] + "K1" + constraint['factors'][end_k:]
-
-        with open(altered_config_file, "w") as f:
-            f.write(yaml.dump(config))
-
-        # run Timeloop
-        timeloop_env = os.environ.copy()
-        timeloop_env["LD_LIBRARY_PATH"] = timeloop_lib_path
-
-        with open(timeloop_log_file, "w") as outfile:
-            subprocess.call([timeloop_binary, altered_config_file],
-                            cwd=timeloop_wd,
-                            stdout=outfile,
-                            stderr=outfile,
-                            env=timeloop_env)
-
-        if not os.path.exists(projected_results_file):
-            # Rerun with lower utilization target?
-            # with open(config_file, "r") as f:
-            #     config = yaml.load(f, Loader=yaml.SafeLoader)
-            # for constraint in config['mapspace']['constraints']:
-            #     if constraint['type'] == 'utilization':
-            #         constraint['min'] = '0.001'
-            # with open(altered_config_file, "w") as f:
-            #     f.write(yaml.dump(config))
-
-            # with open(timeloop_log_file, "w") as outfile:
-            #     subprocess.call([timeloop_binary, altered_config_file],
-            #                     cwd=timeloop_wd,
-            #                     stdout=outfile,
-            #                     stderr=outfile,
-            #                     env=timeloop_env)
-            print(f"WARNING: Skipping Layer {i}")
-
-        else:
-            timeloop_result = parse_timeloop_stats(projected_results_file)
+    results = []
+    total_inference_energy = {bits: 0.0 for bits in bit_widths}
+
+    for i, (layer, signature) in enumerate(zip(timeloop_layers, signatures)):
+        for bits in bit_widths:
+            stats = mappings[(signature, bits)]
+            if stats is None:
+                print(f"WARNING: Skipping Layer {i} at {bits} bits")
+                continue
 
             # Store results
-            results[i] = {'layer_idx': i,
-                        'layer_type': layer.class_name,
-                        'w_reads': timeloop_result['energy_breakdown_pJ']['DRAM']['reads_per_instance'][0],
-                        'i_reads': timeloop_result['energy_breakdown_pJ']['DRAM']['reads_per_instance'][1],
-                        'o_reads': timeloop_result['energy_breakdown_pJ']['DRAM']['reads_per_instance'][2],
-                        'w_updates': timeloop_result['energy_breakdown_pJ']['DRAM']['updates_per_instance'][0],
-                        'i_updates': timeloop_result['energy_breakdown_pJ']['DRAM']['updates_per_instance'][1],
-                        'o_updates': timeloop_result['energy_breakdown_pJ']['DRAM']['updates_per_instance'][2],
-                        'w_fills': timeloop_result['energy_breakdown_pJ']['DRAM']['fills_per_instance'][0],
-                        'i_fills': timeloop_result['energy_breakdown_pJ']['DRAM']['fills_per_instance'][1],
-                        'o_fills': timeloop_result['energy_breakdown_pJ']['DRAM']['fills_per_instance'][2],
-                        'w_energy': timeloop_result['energy_breakdown_pJ']['DRAM']['energy_per_access_per_instance'][0],
-                        'i_energy': timeloop_result['energy_breakdown_pJ']['DRAM']['energy_per_access_per_instance'][1],
-                        'o_energy': timeloop_result['energy_breakdown_pJ']['DRAM']['energy_per_access_per_instance'][2],
-                        'total_dram_energy': timeloop_result['energy_breakdown_pJ']['DRAM']['energy'],
-                        'bitwidth': TIMELOOP_BITS}
-            total_inference_energy += timeloop_result['energy_pJ']
-
-    df = pd.DataFrame.from_dict(results, orient='index')
-    df.to_csv(workload['exploration']['energy_evaluation']['dram_analysis_file'])
-
-    print(f"Total Energy per Inference: {total_inference_energy/1_000_000_000:.4f}mJ")
+            row = {'layer_idx': i, 'layer_type': layer.class_name}
+            row.update({key: value for key, value in stats.items() if key != 'energy_pJ'})
+            row['bitwidth'] = bits
+            results.append(row)
+            total_inference_energy[bits] += stats['energy_pJ']
+
+    df = pd.DataFrame(results)
+    df.to_csv(energy_settings['dram_analysis_file'])
+
+    for bits, energy in total_inference_energy.items():
+        print(f"Total Energy per Inference at {bits} bits: {energy/1_000_000_000:.4f}mJ")
 
 
 if __name__ == "__main__":
@@ -186,6 +114,23 @@ if __name__ == "__main__":
                         "--progress",
                         action="store_true",
                         help="Show the current inference progress.")
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="Number of timeloop-mapper processes running concurrently.")
+    parser.add_argument("--timeloop-binary",
+                        default=None,
+                        help="Path to the timeloop-mapper executable, defaults to the third party build.")
+    parser.add_argument("--cache-dir",
+                        default=None,
+                        help="Directory of the cached layer mappings, defaults to timeloop_eval/cache.")
+    parser.add_argument("-b",
+                        "--bit-widths",
+                        type=int,
+                        nargs='+',
+                        default=None,
+                        help="DRAM word bits every layer is mapped with, overrides energy_evaluation.bit_widths.")
     opt = parser.parse_args()
 
     if opt.verbose:
@@ -201,7 +146,8 @@ if __name__ == "__main__":
 
     workload = Workload(workload_file)
 
-    compute_memory_saving(workload, opt.progress)
+    compute_memory_saving(workload, opt.progress, opt.jobs, opt.timeloop_binary, opt.cache_dir,
+                          opt.bit_widths)
 
     logger.info("Energy computation finised")
 
@@ -16,7 +16,7 @@ def select_individuals(results_path: str, count: int) -> pd.DataFrame:
 
     results_collection.drop_duplicate_parameters()
     logger.debug("Loaded in total {} individuals".format(
-        len(results_collection.individuals)))
+        len(results_collection)))
 
     # select individuals based on a prodcut of normed F_0 and accuracy
     ind_df = results_collection.to_dataframe()
@@ -50,6 +50,20 @@ if __name__ == "__main__":
                         "--progress",
                         action="store_true",
                         help="Show the current inference progress.")
+    parser.add_argument("-c",
+                        "--configurations-per-pass",
+                        type=int,
+                        default=1,
+                        help="Configurations evaluated together in one pass over the dataset.")
+    parser.add_argument("-j",
+                        "--workers",
+                        type=int,
+                        default=1,
+                        help="Processes the configurations are spread across.")
+    parser.add_argument("-r",
+                        "--results-file",
+                        default=None,
+                        help="Csv file finished configurations are appended to, rerun with the same file to resume.")
     opt = parser.parse_args()
 
     logger.info("Reevaluation of individuals started")
@@ -64,7 +78,10 @@ if __name__ == "__main__":
 
     workload = Workload(workload_file)
     individuals = select_individuals(opt.results_path, opt.top_elements)
-    results = evaluate_full_model(workload, individuals, opt.progress)
+    results = evaluate_full_model(workload, individuals, opt.progress,
+                                  configurations_per_pass=opt.configurations_per_pass,
+                                  workers=opt.workers,
+                                  results_file=opt.results_file)
 
     save_results_df_to_csv(
         'reeval', results,
@@ -5,6 +5,7 @@ import argparse
 from model_explorer.utils.logger import logger, set_console_logger_level
 from model_explorer.utils.workload import Workload
 from model_explorer.exploration.explore_model import explore_model
+from model_explorer.exploration.checkpoint import find_latest_checkpoint
 from model_explorer.result_handling.save_results import save_result_pickle
 
 # maps SLURM_JOB_ID to the accoring workload settings
@@ -34,6 +35,13 @@ if __name__ == "__main__":
         help="skip baseline computation to save time",
         action="store_true"
     )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        nargs="?",
+        const="latest",
+        default=None,
+        help="Continue from the checkpoint of a run directory, without a directory the latest run of the workload")
     opt = parser.parse_args()
 
     if opt.verbose:
@@ -54,10 +62,20 @@ if __name__ == "__main__":
         if job_id in extra_slurm_args:
             workload.merge(extra_slurm_args[job_id])
 
-    results = explore_model(workload, opt.skip_baseline, opt.progress)
+    resume = opt.resume
+    if resume == "latest":
+        resume = find_latest_checkpoint(workload['problem']['problem_function'], workload['model']['type'],
+                                        workload['exploration']['datasets']['exploration']['type'])
+        if resume is None:
+            raise Exception("No checkpoint found to resume from.")
+    if resume is not None:
+        logger.info(f"Resuming exploration from {resume}")
+
+    results = explore_model(workload, opt.skip_baseline, opt.progress, resume)
 
-    save_result_pickle(results, workload['problem']['problem_function'],
-                       workload['model']['type'], workload['exploration']['datasets']['exploration']['type'])
+    if workload['exploration'].get('results', {}).get('save_pickle', True):
+        save_result_pickle(results, workload['problem']['problem_function'],
+                           workload['model']['type'], workload['exploration']['datasets']['exploration']['type'])
 
     logger.info("Model exploration finished")
 
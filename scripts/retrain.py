@@ -16,7 +16,7 @@ def select_individuals(results_path: str, count: int) -> pd.DataFrame:
 
     results_collection.drop_duplicate_parameters()
     logger.debug("Loaded in total {} distinct individuals".format(
-        len(results_collection.individuals)))
+        len(results_collection)))
 
     # select individuals based on a prodcut of normed F_0 and accuracy
     ind_df = results_collection.to_dataframe()
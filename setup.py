@@ -10,6 +10,7 @@ setup(
         'matplotlib',
         'tqdm',
         'pandas',
+        'pyarrow',
         'seaborn',
         'gitpython',
         'opencv-python',
@@ -0,0 +1,46 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pymoo")
+pytest.importorskip("pandas")
+
+from pymoo.algorithms.moo.nsga2 import NSGA2
+from pymoo.core.problem import Problem
+
+from model_explorer.exploration.checkpoint import save_checkpoint, load_checkpoint, restore_checkpoint
+
+
+class ConstrainedProblem(Problem):
+
+    def __init__(self):
+        super().__init__(n_var=4, n_obj=2, n_ieq_constr=1, xl=0.0, xu=1.0)
+
+    def _evaluate(self, x, out, *args, **kwargs):
+        out["F"] = np.column_stack([x.sum(axis=1), (1.0 - x).sum(axis=1)])
+        out["G"] = 1.0 - x[:, :1] * 4.0
+
+
+def setup_algorithm():
+    algorithm = NSGA2(pop_size=10)
+    algorithm.setup(ConstrainedProblem(), termination=('n_gen', 5), seed=1)
+    return algorithm
+
+
+def test_checkpoint_round_trip(tmp_path):
+    algorithm = setup_algorithm()
+    for _ in range(2):
+        algorithm.next()
+    save_checkpoint(str(tmp_path), algorithm)
+
+    restored = setup_algorithm()
+    restore_checkpoint(restored, load_checkpoint(str(tmp_path)))
+
+    for key in ['X', 'F', 'G', 'CV', 'feas', 'rank']:
+        np.testing.assert_array_equal(restored.pop.get(key), algorithm.pop.get(key))
+    assert restored.n_iter == algorithm.n_iter
+    assert restored.evaluator.n_eval == algorithm.evaluator.n_eval
+
+    # the restored run continues until its termination
+    while restored.has_next():
+        restored.next()
+    assert restored.n_iter > algorithm.n_iter
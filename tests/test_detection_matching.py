@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+from model_explorer.accuracy_functions.detection_accuracy import box_iou, match_predictions
+
+
+def process_batch_reference(detections, labels, iouv):
+    """Per IoU level numpy matching of the previous implementation (yolov5)"""
+    correct = torch.zeros(detections.shape[0], iouv.shape[0], dtype=torch.bool)
+    iou = box_iou(labels[:, 1:], detections[:, :4])
+    correct_class = labels[:, 0:1] == detections[:, 5]
+
+    for i, iouv_i in enumerate(iouv):
+        x = torch.where((iou >= iouv_i) & correct_class)
+        if x[0].shape[0]:
+            matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()
+            if x[0].shape[0] > 1:
+                matches = matches[matches[:, 2].argsort()[::-1]]
+                matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+                matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+            correct[matches[:, 1].astype(int), i] = True
+
+    return correct
+
+
+def random_boxes(generator, n, n_classes):
+    xy = torch.rand((n, 2), generator=generator) * 80
+    wh = torch.rand((n, 2), generator=generator) * 20 + 5
+    cls = torch.randint(0, n_classes, (n, 1), generator=generator).float()
+    return torch.cat((xy, xy + wh), 1), cls
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_match_predictions_equals_reference(seed):
+    generator = torch.Generator().manual_seed(seed)
+    iouv = torch.linspace(0.5, 0.95, 10)
+
+    label_boxes, label_cls = random_boxes(generator, 8, 3)
+    # detections close to the labels, several per label and some unrelated ones
+    jitter = torch.randn((24, 4), generator=generator) * 3
+    det_boxes = torch.cat((label_boxes.repeat(3, 1) + jitter, random_boxes(generator, 6, 3)[0]))
+    det_cls = torch.cat((label_cls.repeat(3, 1), random_boxes(generator, 6, 3)[1]))
+    conf = torch.rand((len(det_boxes), 1), generator=generator)
+
+    # the detections are ordered by confidence after the NMS
+    order = conf[:, 0].argsort(descending=True)
+    detections = torch.cat((det_boxes, conf, det_cls), 1)[order]
+    labels = torch.cat((label_cls, label_boxes), 1)
+
+    expected = process_batch_reference(detections, labels, iouv)
+    assert torch.equal(match_predictions(detections, labels, iouv), expected)
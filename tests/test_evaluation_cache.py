@@ -0,0 +1,50 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+pytest.importorskip("pymoo")
+
+from types import SimpleNamespace
+
+from model_explorer.problems.custom_problem import CustomExplorationProblem
+from model_explorer.problems.evaluation_cache import EvaluationCache
+
+
+class CountingProblem(CustomExplorationProblem):
+
+    def __init__(self):
+        super().__init__(SimpleNamespace(), None, False, 0.5, n_var=2, n_obj=1, n_constr=1, xl=0.0, xu=1.0)
+        self.evaluation_cache = EvaluationCache({'problem': 'counting'})
+        self.n_evaluated = 0
+
+    def _evaluate(self, index, x, out, *args, **kwargs):
+        self.n_evaluated += 1
+        out["n_samples"] = 16
+        out["F"] = [float(x.sum())]
+        out["G"] = [float(x[0] - 0.5)]
+
+
+def evaluate(problem, X):
+    return problem.evaluate(X, return_as_dictionary=True, algorithm=SimpleNamespace(n_iter=1))
+
+
+def test_cache_hits_have_the_shapes_of_fresh_evaluations():
+    problem = CountingProblem()
+    rng = np.random.default_rng(0)
+
+    X = rng.random((4, 2))
+    fresh = evaluate(problem, X)
+
+    # two hits and two misses in one generation
+    mixed = evaluate(problem, np.vstack([X[:2], rng.random((2, 2))]))
+    assert problem.n_evaluated == 6
+    assert mixed["n_samples"].shape == fresh["n_samples"].shape == (4, )
+    assert mixed["F"].shape == fresh["F"].shape
+    np.testing.assert_array_equal(mixed["F"][:2], fresh["F"][:2])
+    np.testing.assert_array_equal(mixed["G"][:2], fresh["G"][:2])
+
+    # only hits
+    cached = evaluate(problem, X)
+    assert problem.n_evaluated == 6
+    assert cached["n_samples"].shape == (4, )
+    np.testing.assert_array_equal(cached["F"], fresh["F"])
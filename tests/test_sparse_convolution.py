@@ -0,0 +1,64 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from torch import nn
+
+from model_explorer.models import sparse_convolution
+from model_explorer.models.sparse_convolution import SparseConv2d
+
+
+CONVOLUTIONS = [
+    # kernel_size, stride, padding
+    (1, 1, 0),
+    (1, 2, 0),
+    (1, 1, 1),
+    (3, 1, 0),
+    (3, 1, 1),
+    (3, 2, 1),
+]
+
+
+def sparse_convolutions(kernel_size, stride, padding, threshold):
+    conv = nn.Conv2d(6, 4, kernel_size, stride=stride, padding=padding).double()
+    modules = []
+    for conv_mode in ['im2col', 'fused']:
+        module = SparseConv2d(conv, [4, 3], conv_mode=conv_mode)
+        module.threshold = threshold
+        modules.append(module)
+    return modules
+
+
+def random_input(seed):
+    generator = torch.Generator().manual_seed(seed)
+    inp = torch.randn((2, 6, 11, 9), generator=generator, dtype=torch.float64)
+    # zero regions create blocks that are already sparse
+    inp[:, :2, :5] = 0
+    return inp
+
+
+@pytest.mark.parametrize("kernel_size, stride, padding", CONVOLUTIONS)
+def test_fused_equals_im2col(kernel_size, stride, padding):
+    im2col, fused = sparse_convolutions(kernel_size, stride, padding, threshold=0.3)
+    inp = random_input(kernel_size * 10 + stride + padding)
+
+    with torch.no_grad():
+        torch.testing.assert_close(fused(inp), im2col(inp))
+
+    assert int(fused.sparse_created) == int(im2col.sparse_created)
+    assert int(fused.sparse_present) == int(im2col.sparse_present)
+    assert int(im2col.sparse_created) > 0
+
+
+@pytest.mark.parametrize("kernel_size, stride, padding", [(3, 1, 1), (3, 2, 0)])
+def test_fused_chunks_equal_im2col(monkeypatch, kernel_size, stride, padding):
+    # the unfolded input exceeds the chunk size, rows are processed in several slabs
+    monkeypatch.setattr(sparse_convolution, 'FUSED_CHUNK_ELEMENTS', 500)
+    im2col, fused = sparse_convolutions(kernel_size, stride, padding, threshold=0.3)
+    inp = random_input(0)
+
+    with torch.no_grad():
+        torch.testing.assert_close(fused(inp), im2col(inp))
+
+    assert int(fused.sparse_created) == int(im2col.sparse_created)
+    assert int(fused.sparse_present) == int(im2col.sparse_present)
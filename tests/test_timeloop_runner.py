@@ -0,0 +1,96 @@
+import os
+import sys
+import stat
+import pytest
+
+pytest.importorskip("yaml")
+pytest.importorskip("tqdm")
+pytest.importorskip("model_explorer.third_party.timeloop.scripts.parse_timeloop_output")
+
+from model_explorer.utils import timeloop_runner
+from model_explorer.utils.timeloop_runner import TimeloopRunner
+
+
+# stands in for timeloop-mapper: logs the call and writes the statistics file to its work directory
+STUB_MAPPER = """#!{python}
+import os
+import sys
+
+with open(os.environ['STUB_MAPPER_CALLS'], 'a') as f:
+    f.write(sys.argv[1] + '\\n')
+if os.environ.get('STUB_MAPPER_FAIL') != '1':
+    with open('timeloop-mapper.map+stats.xml', 'w') as f:
+        f.write('42.0')
+"""
+
+CONFIG = """arch:
+  storage:
+  - name: DRAM
+    word-bits: 16
+problem:
+  R: 1
+"""
+
+SIGNATURE_A = (3, 3, 8, 8, 16, 32, 1, 1, 1)
+SIGNATURE_B = (1, 1, 8, 8, 32, 64, 1, 2, 2)
+
+
+def parse_canned_stats(filename):
+    """Parsed form of the canned statistics file written by the stub mapper"""
+    with open(filename, 'r') as f:
+        energy = float(f.read())
+    dram = {key: [energy] * 3 for key in ['reads_per_instance', 'updates_per_instance', 'fills_per_instance',
+                                          'energy_per_access_per_instance']}
+    dram['energy'] = energy
+    return {'energy_pJ': energy, 'energy_breakdown_pJ': {'DRAM': dram}}
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    binary = tmp_path / "timeloop-mapper"
+    binary.write_text(STUB_MAPPER.format(python=sys.executable))
+    binary.chmod(binary.stat().st_mode | stat.S_IEXEC)
+
+    config_file = tmp_path / "arch.yaml"
+    config_file.write_text(CONFIG)
+
+    monkeypatch.setenv('STUB_MAPPER_CALLS', str(tmp_path / "calls.log"))
+    monkeypatch.setattr(timeloop_runner, 'parse_timeloop_stats', parse_canned_stats)
+
+    return TimeloopRunner(str(binary), str(config_file), work_dir=str(tmp_path / "work"),
+                          cache_dir=str(tmp_path / "cache"), jobs=2)
+
+
+def stub_calls(tmp_path) -> int:
+    calls_file = tmp_path / "calls.log"
+    return len(calls_file.read_text().splitlines()) if calls_file.exists() else 0
+
+
+def test_duplicate_signatures_are_mapped_once(runner, tmp_path):
+    results = runner.map_layers([SIGNATURE_A, SIGNATURE_B, list(SIGNATURE_A)], [8, 16], progress=False)
+
+    assert stub_calls(tmp_path) == 4
+    assert set(results) == {(s, b) for s in [SIGNATURE_A, SIGNATURE_B] for b in [8, 16]}
+    assert all(stats['total_dram_energy'] == 42.0 for stats in results.values())
+
+
+def test_rerun_uses_the_cache(runner, tmp_path):
+    first = runner.map_layers([SIGNATURE_A, SIGNATURE_B], [8], progress=False)
+    assert stub_calls(tmp_path) == 2
+
+    second = runner.map_layers([SIGNATURE_A, SIGNATURE_B], [8], progress=False)
+    assert stub_calls(tmp_path) == 2
+    assert second == first
+
+
+def test_failed_mapping_does_not_reuse_old_results(runner, tmp_path, monkeypatch):
+    runner.map_layers([SIGNATURE_A], [8], progress=False)
+
+    # the work directory still holds the statistics of the first run
+    for cache_file in os.listdir(runner.cache_dir):
+        os.remove(os.path.join(runner.cache_dir, cache_file))
+    monkeypatch.setenv('STUB_MAPPER_FAIL', '1')
+
+    results = runner.map_layers([SIGNATURE_A], [8], progress=False)
+    assert stub_calls(tmp_path) == 2
+    assert results[(SIGNATURE_A, 8)] is None